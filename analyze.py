@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import os.path
+import sys
+
+from os_utils import *
+
+
+# Reads the timelines recorded with '--trace-file' (one per script invocation) and finds the chain of steps
+# that limits the total build time. A step is a checkpointed phase of a target (configure, make, install-<subdir>,
+# strip, copy-bcl), or a whole action for targets without phases (e.g.: the BCL and LLVM builds).
+#
+# The dependencies between steps are inferred:
+#   - A step depends on the previous steps of the same target. Across scripts (e.g.: 'configure' and 'make' run
+#     separately), only on the steps of the same or an earlier phase, so a rerun 'configure' doesn't wait for
+#     an earlier 'make'.
+#   - A step depends on the steps of other targets run before it by the same script, as the scripts build
+#     one target at a time. These are 'order' edges, which '--dependencies-only' ignores to show the
+#     critical path the build would have if independent targets ran at the same time.
+#   - Across scripts, the cross-compiler targets depend on the LLVM build, the iOS cross-compiler targets on
+#     the configure step of their device target (for the offsets tool) and 'copy-bcl' on the BCL builds.
+
+EPSILON = 0.001
+
+
+class Step:
+    def __init__(self, process: int, span: dict):
+        args = span.get('args', {})
+        self.process = process
+        self.target_key = '-'.join(args[key] for key in ['product', 'target', 'configuration'] if args.get(key)) or 'session'
+        self.product = args.get('product', '')
+        self.target = args.get('target', '')
+        self.name = span['name']
+        self.start = span['ts'] / 1e6
+        self.end = (span['ts'] + span['dur']) / 1e6
+        self.duration = self.end - self.start
+        self.skipped = args.get('skipped', False)
+        self.commands = []
+        self.deps = []  # (step, kind)
+
+    def __str__(self) -> str:
+        return '%s: %s' % (self.target_key, self.name)
+
+
+def load_spans(trace_files: list) -> list:
+    '''Returns the complete spans of each trace, in the order of the files'''
+    traces = []
+    for trace_file in trace_files:
+        if not os.path.isfile(trace_file):
+            raise BuildError('Trace file not found: ' + trace_file)
+        with open(trace_file, 'r') as f:
+            try:
+                events = json.load(f)
+            except ValueError:
+                raise BuildError('Not a trace file: ' + trace_file)
+        if isinstance(events, dict):
+            if not 'traceEvents' in events:
+                raise BuildError('Not a trace file: ' + trace_file)
+            events = events['traceEvents']
+        traces += [[event for event in events if event.get('ph') == 'X']]
+    return traces
+
+
+def contains(outer: dict, inner: dict) -> bool:
+    return outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur'] and \
+        all(outer.get('args', {}).get(key) == inner.get('args', {}).get(key) for key in ['product', 'target', 'configuration'])
+
+
+def get_steps(traces: list) -> list:
+    steps = []
+    for process, spans in enumerate(traces):
+        phases = [span for span in spans if span.get('cat') == 'phase']
+        targets = [span for span in spans if span.get('cat') == 'target']
+        commands = [span for span in spans if span.get('cat') == 'command']
+
+        process_steps = [Step(process, span) for span in phases]
+        process_steps += [Step(process, target) for target in targets if not any(contains(target, phase) for phase in phases)]
+
+        for step in process_steps:
+            step.commands = [(command['name'], command['dur'] / 1e6) for command in commands
+                if step.start - EPSILON <= command['ts'] / 1e6 and (command['ts'] + command['dur']) / 1e6 <= step.end + EPSILON]
+
+        steps += process_steps
+
+    return sorted(steps, key=lambda step: (step.start, step.end))
+
+
+def get_phase_order(step: Step) -> int:
+    '''Index of the phase group of the step, or None for steps that aren't a phase (e.g.: a whole BCL build)'''
+    from checkpoint import get_phase_group, phase_groups
+    group = get_phase_group(step.name)
+    return phase_groups.index(group) if group in phase_groups else None
+
+
+def is_target_dependency(step: Step, other: Step) -> bool:
+    if other.target_key != step.target_key:
+        return False
+    if other.process == step.process:
+        return True
+    step_order, other_order = get_phase_order(step), get_phase_order(other)
+    return step_order is None or other_order is None or other_order <= step_order
+
+
+def is_cross_dependency(step: Step, other: Step) -> bool:
+    from ios import iOSCrossTable
+
+    if step.target.startswith('cross') and other.product == 'llvm':
+        return True
+    if step.product == 'ios' and step.target in iOSCrossTable.device_targets and \
+            other.product == 'ios' and other.target == iOSCrossTable.device_targets[step.target] and other.name == 'configure':
+        return True
+    if step.name == 'copy-bcl' and other.product.endswith('-bcl'):
+        return True
+    return False
+
+
+def add_dependencies(steps: list, dependencies_only: bool):
+    for i, step in enumerate(steps):
+        # Only the steps that started before, so there are no cycles between steps that took no time
+        for other in steps[:i]:
+            if other.end > step.start + EPSILON:
+                continue
+            if is_target_dependency(step, other):
+                step.deps += [(other, 'target')]
+            elif is_cross_dependency(step, other):
+                step.deps += [(other, 'dependency')]
+            elif other.process == step.process and not dependencies_only:
+                step.deps += [(other, 'order')]
+
+
+def get_schedule(steps: list, durations: dict) -> tuple:
+    '''Earliest finish of every step, with the step it waits for, if it only waited for its dependencies'''
+    finish = {}
+    waits_for = {}
+    # The steps are sorted by start time, so the dependencies of a step come before it
+    for step in steps:
+        start = 0
+        waits_for[step] = None
+        for dep, kind in step.deps:
+            if finish[dep] > start:
+                start = finish[dep]
+                waits_for[step] = (dep, kind)
+        finish[step] = start + durations[step]
+    return finish, waits_for
+
+
+def get_critical_path(steps: list, durations: dict) -> tuple:
+    finish, waits_for = get_schedule(steps, durations)
+    if not steps:
+        return 0, []
+    last = max(steps, key=lambda step: finish[step])
+    path = [(last, None)]
+    while waits_for[path[0][0]] is not None:
+        path.insert(0, waits_for[path[0][0]])
+    # Each entry is (step, kind of the edge to the step that follows it)
+    path = [(path[i][0], path[i + 1][1] if i + 1 < len(path) else None) for i in range(len(path))]
+    return finish[last], path
+
+
+def get_slack(steps: list, durations: dict, length: float) -> dict:
+    finish, _ = get_schedule(steps, durations)
+    latest_finish = { step: length for step in steps }
+    for step in reversed(steps):
+        for dep, _ in step.deps:
+            latest_finish[dep] = min(latest_finish[dep], latest_finish[step] - durations[step])
+    return { step: latest_finish[step] - finish[step] for step in steps }
+
+
+def get_busy_time(intervals: list) -> float:
+    '''Length of the union of the intervals'''
+    busy = 0
+    current_start, current_end = None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            busy += current_end - current_start if current_end is not None else 0
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    return busy + (current_end - current_start if current_end is not None else 0)
+
+
+def format_seconds(seconds: float) -> str:
+    return '%.1fs' % seconds
+
+
+def analyze(trace_files: list, cores: int, dependencies_only: bool, top: int, json_file: str):
+    traces = load_spans(trace_files)
+    steps = get_steps(traces)
+
+    if not steps:
+        raise BuildError('No build steps found in the trace files')
+
+    add_dependencies(steps, dependencies_only)
+
+    durations = { step: step.duration for step in steps }
+    length, path = get_critical_path(steps, durations)
+    slack = get_slack(steps, durations, length)
+
+    all_spans = [span for spans in traces for span in spans]
+    wall_start = min(span['ts'] for span in all_spans) / 1e6
+    wall_time = max(span['ts'] + span['dur'] for span in all_spans) / 1e6 - wall_start
+
+    command_spans = [span for span in all_spans if span.get('cat') == 'command']
+    command_time = get_busy_time([(span['ts'] / 1e6, (span['ts'] + span['dur']) / 1e6) for span in command_spans])
+    cpu_time = sum(span.get('args', {}).get('user_time', 0) + span.get('args', {}).get('system_time', 0) for span in command_spans)
+    idle_share = 1 - cpu_time / (cores * wall_time) if wall_time else 0
+
+    # How much shorter the critical path would be if the step took no time (e.g.: cached) or half the time
+    savings = []
+    for step, _ in path:
+        removed = get_critical_path(steps, { **durations, step: 0 })[0]
+        halved = get_critical_path(steps, { **durations, step: step.duration / 2 })[0]
+        savings += [(step, length - removed, length - halved)]
+    savings.sort(key=lambda saving: -saving[1])
+
+    print('Wall time: %s (%s traces), critical path: %s, steps: %s' % (format_seconds(wall_time), len(traces), format_seconds(length), len(steps)))
+    print('Cores: %s, CPU time of the commands: %s, idle: %.0f%% of the core time' % (cores, format_seconds(cpu_time), 100 * idle_share))
+    print('No command running for %s (%.0f%% of the wall time)' % (format_seconds(wall_time - command_time), 100 * (wall_time - command_time) / wall_time if wall_time else 0))
+
+    print('\nCritical path%s:' % (' (dependencies only)' if dependencies_only else ''))
+    for step, kind in path:
+        longest = max(step.commands, key=lambda command: command[1]) if step.commands else None
+        details = ', longest command: \'%s\' %s' % (longest[0], format_seconds(longest[1])) if longest else ''
+        print('  %8s  %s%s%s' % (format_seconds(step.duration), step, ' (skipped)' if step.skipped else '', details))
+        if kind == 'order':
+            print('            ^ only waits because the script runs targets one after the other')
+
+    print('\nSteps that would help most (critical path saving if cached / if twice as fast):')
+    for step, if_removed, if_halved in savings[:top]:
+        print('  %8s / %8s  %s' % (format_seconds(if_removed), format_seconds(if_halved), step))
+
+    off_path = sorted([step for step in steps if slack[step] > EPSILON], key=lambda step: -step.duration)
+    if off_path:
+        print('\nLongest steps off the critical path (slack: how much longer they could take without delaying the build):')
+        for step in off_path[:top]:
+            print('  %8s  slack %8s  %s' % (format_seconds(step.duration), format_seconds(slack[step]), step))
+
+    if json_file:
+        write_file_if_changed(json_file, json.dumps({
+            'wall_time': wall_time,
+            'critical_path_time': length,
+            'cores': cores,
+            'cpu_time': cpu_time,
+            'idle_share': idle_share,
+            'idle_wall_time': wall_time - command_time,
+            'critical_path': [{ 'step': str(step), 'duration': step.duration, 'edge': kind } for step, kind in path],
+            'savings': [{ 'step': str(step), 'if_removed': if_removed, 'if_halved': if_halved } for step, if_removed, if_halved in savings],
+            'steps': [{ 'step': str(step), 'start': step.start - wall_start, 'duration': step.duration, 'slack': slack[step] } for step in steps]
+        }, indent=4))
+
+
+def main(raw_args):
+    import cmd_utils
+
+    parser = cmd_utils.build_arg_parser(description='Finds the critical path, slack and idle time of builds recorded with \'--trace-file\'')
+
+    default_help = 'default: %(default)s'
+
+    parser.add_argument('action', choices=['analyze'])
+    parser.add_argument('trace_files', nargs='+', metavar='TRACE_FILE', help='Trace files of the scripts that took part in the build')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='Number of cores of the build machine.\n' + default_help)
+    parser.add_argument('--dependencies-only', action='store_true', default=False,
+        help='Ignore the order in which the scripts run their targets, to find the critical path if independent targets ran at the same time.')
+    parser.add_argument('--top', type=int, default=10, help='Number of steps to list in the suggestions.\n' + default_help)
+    parser.add_argument('--json', default='', help='Also write the analysis to this JSON file.')
+
+    args = parser.parse_args(raw_args)
+
+    try:
+        analyze([os.path.abspath(path) for path in args.trace_files], args.cores, args.dependencies_only, args.top,
+                os.path.abspath(args.json) if args.json else '')
+    except BuildError as e:
+        sys.exit(e.message)
+
+
+if __name__ == '__main__':
+    from sys import argv
+    main(argv[1:])
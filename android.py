@@ -2,9 +2,10 @@
 
 import os
 import os.path
-import subprocess
 import sys
 
+from checkpoint import clean_checkpoints, get_checkpoints
+from memory_build import remove_build_dir
 from options import *
 from os_utils import *
 import runtime
@@ -33,7 +34,9 @@ def check_for_android_ndk(opts: AndroidOpts):
         sdkmanager = opts.android_sdk_root + "/cmdline-tools/latest/bin/sdkmanager"
         if os.path.exists(sdkmanager):
             sdk_args = "ndk;" + opts.android_ndk_version
-            subprocess.check_call([sdkmanager, sdk_args])
+            # sdkmanager downloads from the network, so it may fail for transient reasons
+            retry_call(lambda: run_command(sdkmanager, [sdk_args], name='sdkmanager'),
+                retries=opts.retries, delay=opts.retry_delay, name='sdkmanager')
         else:
             print("ERROR: Cannot find %s. Please ensure ANDROID_SDK_ROOT is correct and cmdline-tools are installed" % (sdkmanager))
             sys.exit(1)
@@ -45,7 +48,9 @@ def check_for_cmake(opts: AndroidOpts):
         sdkmanager = opts.android_sdk_root + "/cmdline-tools/latest/bin/sdkmanager"
         if os.path.exists(sdkmanager):
             sdk_args = "cmake;" + opts.android_cmake_version
-            subprocess.check_call([sdkmanager, sdk_args])
+            # sdkmanager downloads from the network, so it may fail for transient reasons
+            retry_call(lambda: run_command(sdkmanager, [sdk_args], name='sdkmanager'),
+                retries=opts.retries, delay=opts.retry_delay, name='sdkmanager')
         else:
             print("ERROR: Cannot find %s. Please ensure ANDROID_SDK_ROOT is correct and cmdline-tools are installed" % (sdkmanager))
             sys.exit(1)
@@ -228,7 +233,27 @@ def strip_libs(opts: AndroidOpts, product: str, target: str):
 
     lib_files = globs(('*.a', '*.so'), dirpath=out_libs_dir)
     if len(lib_files):
-        run_command(strip, args=['--strip-unneeded'] + lib_files, name='strip')
+        runtime.strip_files(opts, product, target, strip, lib_files)
+
+
+def split_debug(opts: AndroidOpts, product: str, target: str):
+    from debug_symbols import split_debug_files
+
+    ndk_path = os.path.join(opts.android_sdk_root, 'ndk', opts.android_ndk_version)
+    toolchain_path = os.path.join(ndk_path, 'toolchains/llvm/prebuilt/linux-x86_64')
+    strip = os.path.join(toolchain_path, 'bin', 'llvm-strip')
+
+    install_dir = os.path.join(opts.install_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    out_libs_dir = os.path.join(install_dir, 'lib')
+
+    shared_lib_files = globs(('*.so',), dirpath=out_libs_dir)
+    if len(shared_lib_files):
+        split_debug_files(opts, product, target, strip, shared_lib_files, 'elf')
+
+    # Static libraries are still stripped the usual way
+    static_lib_files = globs(('*.a',), dirpath=out_libs_dir)
+    if len(static_lib_files):
+        runtime.strip_files(opts, product, target, strip, static_lib_files)
 
 
 def configure(opts: AndroidOpts, product: str, target: str):
@@ -245,29 +270,40 @@ def configure(opts: AndroidOpts, product: str, target: str):
 def make(opts: AndroidOpts, product: str, target: str):
     env = { 'ANDROID_API_VERSION': get_api_version_or_min(opts, target) }
 
-    build_dir = os.path.join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    runtime.run_make(opts, product, target)
+    runtime.run_make_install(opts, product, target)
 
-    make_args = make_default_args(opts)
-    make_args += ['-C', build_dir]
+    checkpoints = get_checkpoints(opts, product, target, opts.configuration)
 
-    run_command('make', args=make_args, name='make')
-    run_command('make', args=['-C', '%s/mono' % build_dir, 'install'], name='make install mono')
-    run_command('make', args=['-C', '%s/support' % build_dir, 'install'], name='make install support')
-    run_command('make', args=['-C', '%s/data' % build_dir, 'install'], name='make install data')
+    if opts.split_debug:
+        checkpoints.run('strip', lambda: split_debug(opts, product, target), inputs=['split-debug', opts.symbol_store])
+    elif opts.strip_libs:
+        checkpoints.run('strip', lambda: strip_libs(opts, product, target))
 
-    if opts.strip_libs:
-        strip_libs(opts, product, target)
+
+def size_report(opts: AndroidOpts, product: str, target: str):
+    from size_report import report_library_sizes
+
+    ndk_path = os.path.join(opts.android_sdk_root, 'ndk', opts.android_ndk_version)
+    toolchain_path = os.path.join(ndk_path, 'toolchains/llvm/prebuilt/linux-x86_64')
+    strip = os.path.join(toolchain_path, 'bin', 'llvm-strip')
+
+    report_library_sizes(opts, product, target, strip, 'elf')
 
 
 def clean(opts: AndroidOpts, product: str, target: str):
+    clean_checkpoints(opts, product, target, opts.configuration)
+    remove_build_dir(opts, product, target)
     rm_rf(
         os.path.join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration)),
         os.path.join(opts.configure_dir, '%s-%s-%s.config.cache' % (product, target, opts.configuration)),
+        runtime.get_strip_index_file(opts, product, target),
         os.path.join(opts.install_dir, '%s-%s-%s' % (product, target, opts.configuration))
     )
 
 
 def main(raw_args):
+    import build_trace
     import cmd_utils
     from cmd_utils import custom_bool
     from collections import OrderedDict
@@ -279,6 +315,7 @@ def main(raw_args):
     actions['configure'] = configure
     actions['make'] = make
     actions['clean'] = clean
+    actions['size-report'] = size_report
 
     parser = cmd_utils.build_arg_parser(
         description='Builds the Mono runtime for Android',
@@ -290,7 +327,7 @@ def main(raw_args):
 
     default_help = 'default: %(default)s'
 
-    parser.add_argument('action', choices=['configure', 'make', 'clean'])
+    parser.add_argument('action', choices=['configure', 'make', 'clean', 'size-report', 'watch'])
     parser.add_argument('--target', choices=target_choices, action='append', required=True)
     parser.add_argument('--android-sdk', default=android_sdk_default, help=default_help)
     parser.add_argument('--android-ndk-version', default=DEFAULT_NDK_VERSION, help=default_help)
@@ -298,6 +335,7 @@ def main(raw_args):
     parser.add_argument('--android-cmake-version', default=DEFAULT_CMAKE_VERSION, help=default_help)
 
     cmd_utils.add_runtime_arguments(parser, default_help)
+    cmd_utils.add_watch_arguments(parser, default_help)
 
     args = parser.parse_args(raw_args)
 
@@ -306,23 +344,35 @@ def main(raw_args):
 
     opts = android_opts_from_args(args)
 
+    cmd_utils.init_build_session(opts)
+
     if not os.path.isdir(opts.mono_source_root):
         print('Mono sources directory not found: ' + opts.mono_source_root)
         sys.exit(1)
 
-    check_for_android_ndk(opts)
-    check_for_cmake(opts)
-
     build_targets = cmd_utils.expand_input_targets(input_targets, { 'all-targets': targets })
-    action = actions[input_action]
 
     try:
+        check_for_android_ndk(opts)
+        check_for_cmake(opts)
+
+        if input_action == 'watch':
+            import watch
+            watch.watch_targets(opts, 'android', build_targets, debounce=args.watch_debounce,
+                    poll_interval=args.watch_poll_interval, force_polling=args.watch_polling)
+            return
+
+        action = actions[input_action]
+
         for target in build_targets:
-            action(opts, 'android', target)
+            with build_trace.target_span(input_action, product='android', target=target, configuration=opts.configuration):
+                action(opts, 'android', target)
     except BuildError as e:
         sys.exit(e.message)
 
 
 if __name__ == '__main__':
     from sys import argv
-    main(argv[1:])
+    from metrics_db import recording_exit_status
+    with recording_exit_status():
+        main(argv[1:])
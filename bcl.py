@@ -40,6 +40,15 @@ def get_profile_install_dirs(opts: BaseOpts, product: str):
     profiles = profiles_table[product]
     return [path_join(install_dir, get_profile_dir(profile, product)) for profile in profiles]
 
+def get_exclude_patterns(opts: BclOpts, product: str):
+    file_patterns = []
+    file_patterns += ['.*'] # Hidden files we shouldn't copy (e.g.: .stamp)
+    file_patterns += ['*.dll.so', '*.exe.so'] # Pre-built AOT modules. We don't need them and they take a lot of space.
+    file_patterns += ['*.pdb'] if opts.remove_pdb else []
+    file_patterns += os.environ.get('bcl-%s_EXCLUDE' % product, '').split()
+    file_patterns += opts.exclude
+    return file_patterns
+
 def configure_bcl(opts: BclOpts, product: str):
     stamp_file = path_join(opts.configure_dir, '.stamp-bcl-configure')
 
@@ -88,7 +97,7 @@ def make_bcl(opts: BclOpts):
     make_args = make_default_args(opts)
     make_args += ['-C', build_dir, '-C', 'mono']
 
-    run_command('make', args=make_args, name='make bcl')
+    retry_call(lambda: run_command('make', args=make_args, name='make bcl'), retries=opts.retries, delay=opts.retry_delay, name='make bcl')
 
     touch(stamp_file)
 
@@ -123,7 +132,7 @@ def make_product(opts: BclOpts, product: str):
     if product == 'desktop-win32':
         make_args += ['PROFILE_PLATFORM=win32'] # Requires patch: 'bcl-profile-platform-override.diff'
 
-    run_command('make', args=make_args, name='make profiles')
+    retry_call(lambda: run_command('make', args=make_args, name='make profiles'), retries=opts.retries, delay=opts.retry_delay, name='make profiles')
 
     if opts.tests and len(test_profiles) > 0:
         test_make_args = make_default_args(opts)
@@ -131,22 +140,17 @@ def make_product(opts: BclOpts, product: str):
 
         run_command('make', args=test_make_args, name='make tests')
 
-    # Copy the bcl profiles to the output directory
-    from distutils.dir_util import copy_tree
+    # Copy the bcl profiles to the output directory, skipping unneeded files
+    from tree_sync import sync_tree
+    exclude = get_exclude_patterns(opts, product)
+    skipped_files, skipped_bytes = 0, 0
     for profile in profiles:
         profile_dir = get_profile_dir(profile, product)
-        copy_tree('%s/mcs/class/lib/%s' % (opts.mono_source_root, profile_dir), '%s/%s' % (install_dir, profile_dir))
-
-    # Remove unneeded files
-    import glob
-    file_patterns = []
-    file_patterns += ['.*'] # Recursively remove hidden files we shoudln't have copied (e.g.: .stamp)
-    file_patterns += ['*.dll.so', '*.exe.so'] # Remove pre-built AOT modules. We don't need them and they take a lot of space.
-    file_patterns += ['*.pdb'] if opts.remove_pdb else []
-    for profile in profiles:
-        for file_pattern in file_patterns:
-            file_pattern_recursive = '%s/**/%s' % (install_dir, file_pattern)
-            [rm_rf(x) for x in glob.iglob(file_pattern_recursive, recursive=True)]
+        stats = sync_tree('%s/mcs/class/lib/%s' % (opts.mono_source_root, profile_dir), '%s/%s' % (install_dir, profile_dir),
+            link_mode=opts.link_mode, jobs=int(opts.jobs), delete=True, exclude=exclude)
+        skipped_files += stats['skipped']
+        skipped_bytes += stats['skipped_bytes']
+    print('Skipped %s files (%s bytes) matching: %s' % (skipped_files, skipped_bytes, ' '.join(exclude)))
 
     # WebAssembly.Framework.sln
     if product == 'wasm':
@@ -157,7 +161,6 @@ def make_product(opts: BclOpts, product: str):
         from msbuild_helper import build_solution
         build_solution(wasm_fx_sln_file, 'Release')
 
-        import shutil
         from glob import glob
 
         fglob = glob(path_join(wasm_fx_output_dir, '*.dll'))
@@ -167,7 +170,7 @@ def make_product(opts: BclOpts, product: str):
 
         for file in fglob:
             if os.path.isfile(file):
-                shutil.copy(file, output_dir)
+                copy_replacing(file, output_dir)
 
     # godot_android_ext profile (custom 'Mono.Android.dll')
     if product == 'android':
@@ -185,7 +188,7 @@ def make_product(opts: BclOpts, product: str):
         ]
         android_env_csc_args += ['-r:%s' % path_join(monodroid_profile_dir, r) for r in refs]
 
-        run_command('csc', android_env_csc_args)
+        run_command('csc', android_env_csc_args, name='csc')
 
     # (custom 'Xamarin.iOS.dll')
     if product == 'ios':
@@ -204,7 +207,7 @@ def make_product(opts: BclOpts, product: str):
         ]
         android_env_csc_args += ['-r:%s' % path_join(monotouch_profile_dir, r) for r in refs]
 
-        run_command('csc', android_env_csc_args)
+        run_command('csc', android_env_csc_args, name='csc')
 
 
 def clean_product(opts: BclOpts, product: str):
@@ -215,6 +218,7 @@ def clean_product(opts: BclOpts, product: str):
 
 
 def main(raw_args):
+    import build_trace
     import cmd_utils
     from cmd_utils import custom_bool
 
@@ -231,22 +235,30 @@ def main(raw_args):
     parser.add_argument('--product', choices=product_values, action='append', required=True)
     parser.add_argument('--tests', action='store_true', default=False, help=default_help)
     parser.add_argument('--remove-pdb', type=custom_bool, default=True, help=default_help)
+    parser.add_argument('--exclude', action='append', default=[],
+        help='File name pattern to skip when copying the profiles to the install directory. Can be specified multiple times. ' +
+             'Per product patterns can be given with the \'bcl-<product>_EXCLUDE\' environment variable.')
 
     cmd_utils.add_base_arguments(parser, default_help)
 
     args = parser.parse_args(raw_args)
 
     opts = bcl_opts_from_args(args)
+
+    cmd_utils.init_build_session(opts)
     products = args.product
 
     try:
         for product in products:
             action = actions[args.action]
-            action(opts, product)
+            with build_trace.target_span(args.action, product='%s-bcl' % product):
+                action(opts, product)
     except BuildError as e:
         sys.exit(e.message)
 
 
 if __name__ == '__main__':
     from sys import argv
-    main(argv[1:])
+    from metrics_db import recording_exit_status
+    with recording_exit_status():
+        main(argv[1:])
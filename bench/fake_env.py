@@ -0,0 +1,113 @@
+import json
+import os
+import os.path
+import shlex
+import sys
+
+from os.path import join as path_join
+
+
+# Creates a work directory with everything the build scripts need to run against fake_tool.py:
+#   bin/: make, emmake, strip, cmake and csc wrappers, to be put first in PATH
+#   mono/: a minimal Mono source layout (configure, autogen.sh, llvm/build.mk, mcs/class/lib, tools/offsets-tool-py)
+#   android-sdk/: the NDK and CMake directories checked by android.py, with the NDK's llvm-strip
+#   configs/, installs/: the '--configure-dir' and '--install-dir' of the scripts
+#   fake-tools.json: the behaviour of the tools (see fake_tool.py)
+
+tools = ['make', 'emmake', 'strip', 'cmake', 'csc']
+
+android_ndk_version = '23.2.8568313'
+android_cmake_version = '3.18.1'
+
+source_file = 'mono/mini/mini.c'
+
+
+def write_wrapper(path: str, tool: str, env: dict={}):
+    fake_tool = path_join(os.path.dirname(os.path.abspath(__file__)), 'fake_tool.py')
+    env_assignments = ''.join('%s=%s ' % (key, shlex.quote(value)) for key, value in env.items())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n%sexec %s %s %s "$@"\n' % (env_assignments, shlex.quote(sys.executable), shlex.quote(fake_tool), tool))
+    os.chmod(path, 0o755)
+
+
+def init_git_repo(path: str):
+    import subprocess
+    git = ['git', '-c', 'user.name=bench', '-c', 'user.email=bench@localhost']
+    try:
+        subprocess.check_call(git + ['init', '-q'], cwd=path)
+        subprocess.check_call(git + ['add', '-A'], cwd=path)
+        subprocess.check_call(git + ['commit', '-q', '-m', 'Fake Mono sources'], cwd=path)
+    except (OSError, subprocess.CalledProcessError):
+        print('WARNING: Could not create a git repository for the fake Mono sources. Make checkpoints will never be reused.')
+
+
+def modify_sources(fake_env: dict):
+    '''Changes a tracked file of the fake Mono sources, which invalidates the make checkpoints'''
+    with open(path_join(fake_env['mono_root'], source_file), 'a') as f:
+        f.write('/* modified */\n')
+
+
+def write_config(config_file: str, config: dict):
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+    # Reset the failure injection counters and the invocation log
+    for path in [config_file + '.counters', path_join(os.path.dirname(config_file), 'invocations.jsonl')]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def create(work_dir: str, config: dict) -> dict:
+    '''Creates the fake environment in 'work_dir'. Returns its paths and the environment variables to run the scripts with.'''
+    work_dir = os.path.abspath(work_dir)
+
+    bin_dir = path_join(work_dir, 'bin')
+    mono_root = path_join(work_dir, 'mono')
+    android_sdk = path_join(work_dir, 'android-sdk')
+    config_file = path_join(work_dir, 'fake-tools.json')
+
+    for tool in tools:
+        write_wrapper(path_join(bin_dir, tool), tool)
+
+    write_wrapper(path_join(mono_root, 'configure'), 'configure', env={ 'FAKE_SOURCE_ROOT': mono_root })
+
+    for dirpath in ['llvm', 'mcs/class/lib', 'mono/mini', 'tools/offsets-tool-py', 'sdks/builds']:
+        os.makedirs(path_join(mono_root, dirpath), exist_ok=True)
+    with open(path_join(mono_root, 'llvm', 'build.mk'), 'w') as f:
+        f.write('# Fake LLVM build\n')
+    with open(path_join(mono_root, source_file), 'w') as f:
+        f.write('/* Fake source file. Modify it to invalidate the make checkpoints. */\n')
+
+    # The make checkpoints fingerprint the sources with git. Without a repository they never match.
+    init_git_repo(mono_root)
+
+    ndk_path = path_join(android_sdk, 'ndk', android_ndk_version)
+    write_wrapper(path_join(ndk_path, 'toolchains', 'llvm', 'prebuilt', 'linux-x86_64', 'bin', 'llvm-strip'), 'strip')
+    write_wrapper(path_join(android_sdk, 'cmake', android_cmake_version, 'bin', 'cmake'), 'cmake')
+
+    write_config(config_file, config)
+
+    env = os.environ.copy()
+    env['PATH'] = bin_dir + os.pathsep + env['PATH']
+    env['FAKE_TOOLS_CONFIG'] = config_file
+    env['ANDROID_SDK_ROOT'] = android_sdk
+    env['MONO_SOURCE_ROOT'] = mono_root
+
+    return {
+        'work_dir': work_dir,
+        'bin_dir': bin_dir,
+        'mono_root': mono_root,
+        'android_sdk': android_sdk,
+        'configure_dir': path_join(work_dir, 'configs'),
+        'install_dir': path_join(work_dir, 'installs'),
+        'config_file': config_file,
+        'env': env
+    }
+
+
+def load_invocations(fake_env: dict) -> list:
+    path = path_join(fake_env['work_dir'], 'invocations.jsonl')
+    if not os.path.isfile(path):
+        return []
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,263 @@
+import fcntl
+import json
+import os
+import os.path
+import random
+import sys
+import time
+
+from os.path import join as path_join
+
+
+# Stand-in for the tools run by the build scripts: configure, make, emmake, strip, cmake and csc. The wrappers
+# created by fake_env.py run 'fake_tool.py <tool> [args...]'. The tools produce the files the scripts expect
+# (Makefiles, object files, installed libraries, BCL assemblies, LLVM binaries) without compiling anything.
+#
+# The behaviour is read from the JSON file in $FAKE_TOOLS_CONFIG. Keys are '<tool>' or '<tool>:<target>'
+# (e.g.: 'make:install', 'make:all-mcs'), with 'default' as fallback. Each entry may have:
+#   seconds: wall time of the invocation
+#   cpu: fraction of that time spent busy on one core instead of sleeping (0 to 1)
+#   io_kib: KiB written to the object files of the directory (make) or to the installed libraries (make install)
+#   fail: number of invocations that fail before it starts succeeding (counted across processes)
+#   fail_rate: probability of each invocation to fail
+# Invocations are logged to 'invocations.jsonl' next to the config.
+
+runtime_subdirs = ['mono', 'mono/eglib', 'mono/arch', 'mono/utils', 'mono/cil', 'mono/sgen', 'mono/metadata', 'mono/mini', 'support', 'data', 'runtime']
+
+runtime_install_files = {
+    'mono': ['lib/libmonosgen-2.0.so', 'lib/libmonosgen-2.0.a', 'lib/libmono-native.so', 'lib/libmono-btls-shared.so', 'bin/mono-sgen'],
+    'mono/mini': ['bin/mono-sgen'],
+    'support': ['lib/libMonoPosixHelper.so'],
+    'data': ['etc/mono/config']
+}
+
+bcl_assemblies = ['mscorlib.dll', 'System.dll', 'System.Core.dll', 'System.Net.Http.dll', 'System.Xml.dll']
+
+state_file_name = '.fake-configure.json'
+
+
+def get_config() -> dict:
+    config_file = os.environ.get('FAKE_TOOLS_CONFIG', '')
+    if not config_file or not os.path.isfile(config_file):
+        return {}
+    with open(config_file, 'r') as f:
+        return json.load(f)
+
+
+def get_behaviour(config: dict, tool: str, targets: list) -> tuple:
+    '''Returns the config key and the settings for the invocation'''
+    behaviour = dict(config.get('default', {}))
+    key = tool
+    behaviour.update(config.get(tool, {}))
+    for target in targets:
+        if '%s:%s' % (tool, target) in config:
+            key = '%s:%s' % (tool, target)
+            behaviour.update(config[key])
+            break
+    return key, behaviour
+
+
+def count_invocation(key: str) -> int:
+    '''Returns how many times 'key' was invoked before, across all the processes using the same config'''
+    config_file = os.environ.get('FAKE_TOOLS_CONFIG', '')
+    if not config_file:
+        return 0
+    counters_file = config_file + '.counters'
+    with open(counters_file, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        content = f.read()
+        counters = json.loads(content) if content else {}
+        count = counters.get(key, 0)
+        counters[key] = count + 1
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(counters))
+    return count
+
+
+def log_invocation(entry: dict):
+    config_file = os.environ.get('FAKE_TOOLS_CONFIG', '')
+    if not config_file:
+        return
+    fd = os.open(path_join(os.path.dirname(config_file), 'invocations.jsonl'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(entry) + '\n').encode())
+    finally:
+        os.close(fd)
+
+
+def simulate_work(behaviour: dict):
+    seconds = behaviour.get('seconds', 0)
+    busy = seconds * min(max(behaviour.get('cpu', 0), 0), 1)
+    end = time.time() + busy
+    while time.time() < end:
+        pass
+    time.sleep(max(seconds - busy, 0))
+
+
+def write_file(path: str, size: int):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Half random, so compression and stripping have something to do
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size // 2) + b'\0' * (size - size // 2))
+
+
+def find_state(directory: str):
+    '''The configure state of the build directory that contains 'directory' '''
+    current = directory
+    while True:
+        state_file = path_join(current, state_file_name)
+        if os.path.isfile(state_file):
+            with open(state_file, 'r') as f:
+                return current, json.load(f)
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None, None
+        current = parent
+
+
+def fake_configure(args: list, behaviour: dict):
+    build_dir = os.getcwd()
+    # Set by the 'configure' wrapper in the fake Mono sources
+    source_root = os.environ['FAKE_SOURCE_ROOT']
+    prefix = next((arg[len('--prefix='):] for arg in args if arg.startswith('--prefix=')), '/usr/local')
+
+    for subdir in [''] + runtime_subdirs:
+        makefile = path_join(build_dir, subdir, 'Makefile')
+        # Read by '--minimal-build'
+        subdirs = [os.path.relpath(s, subdir or '.') for s in runtime_subdirs if os.path.dirname(s) == subdir]
+        os.makedirs(os.path.dirname(makefile), exist_ok=True)
+        with open(makefile, 'w') as f:
+            f.write('# Generated by fake configure\nCC = cc\nCXX = c++\nSUBDIRS = %s\n' % ' '.join(subdirs))
+
+    with open(path_join(build_dir, state_file_name), 'w') as f:
+        json.dump({ 'source_root': source_root, 'prefix': prefix, 'args': args }, f)
+
+
+def parse_make_args(args: list) -> tuple:
+    directory = os.getcwd()
+    targets, variables, makefile = [], {}, ''
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '-C':
+            directory = os.path.normpath(path_join(directory, args[i + 1]))
+            i += 1
+        elif arg == '-f':
+            makefile = args[i + 1]
+            i += 1
+        elif arg.startswith('-'):
+            pass
+        elif '=' in arg:
+            name, value = arg.split('=', 1)
+            variables[name] = value
+        else:
+            targets += [arg]
+        i += 1
+    return directory, targets, variables, makefile
+
+
+def fake_make(args: list, behaviour: dict):
+    directory, targets, variables, makefile = parse_make_args(args)
+    io_bytes = int(behaviour.get('io_kib', 0) * 1024)
+
+    # LLVM: make -C <mono>/llvm -f build.mk install-llvm LLVM_BUILD=<dir> LLVM_PREFIX=<dir>
+    if makefile == 'build.mk':
+        if 'LLVM_BUILD' in variables:
+            write_file(path_join(variables['LLVM_BUILD'], 'lib', 'libLLVMCore.a'), io_bytes)
+        if 'install-llvm' in targets and 'LLVM_PREFIX' in variables:
+            for name in ['bin/llc', 'bin/opt', 'lib/libLLVMCore.a']:
+                write_file(path_join(variables['LLVM_PREFIX'], name), max(io_bytes, 1024))
+        return
+
+    build_dir, state = find_state(directory)
+
+    # Offsets tool, tests, etc
+    if state is None or any(target in ['setup', 'test', 'xunit-test'] for target in targets):
+        return
+
+    subdir = os.path.relpath(directory, build_dir)
+
+    if 'clean' in targets:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.endswith('.o'):
+                    os.remove(path_join(dirpath, filename))
+        return
+
+    # BCL: make -C <bcl> -C runtime all-mcs build_profiles=<profiles>
+    if 'all-mcs' in targets:
+        suffix = '-win32' if variables.get('PROFILE_PLATFORM') == 'win32' else ''
+        for profile in variables.get('build_profiles', '').split():
+            for assembly in bcl_assemblies:
+                write_file(path_join(state['source_root'], 'mcs', 'class', 'lib', profile + suffix, assembly), max(io_bytes // len(bcl_assemblies), 1024))
+        return
+
+    if 'install' in targets:
+        for subdir_prefix, files in runtime_install_files.items():
+            if subdir == subdir_prefix:
+                for name in files:
+                    write_file(path_join(state['prefix'], name), max(io_bytes // len(files), 1024))
+        return
+
+    # Build: object files in the directory, or in each subdirectory for the top level
+    object_dirs = [directory] if subdir != '.' else [path_join(build_dir, s) for s in runtime_subdirs]
+    for object_dir in object_dirs:
+        for i in range(4):
+            write_file(path_join(object_dir, 'fake-%s.o' % i), max(io_bytes // (4 * len(object_dirs)), 64))
+
+
+def fake_strip(args: list, behaviour: dict):
+    for arg in args:
+        if arg.startswith('-') or not os.path.isfile(arg):
+            continue
+        with open(arg, 'rb') as f:
+            content = f.read()
+        # Already stripped files stay the same
+        if not content.endswith(b'\0'):
+            continue
+        with open(arg, 'wb') as f:
+            f.write(content.rstrip(b'\0') + b'\1')
+
+
+def fake_csc(args: list, behaviour: dict):
+    for arg in args:
+        if arg.startswith('-out:'):
+            write_file(arg[len('-out:'):], 4096)
+
+
+def main(argv: list):
+    tool, args = argv[0], argv[1:]
+
+    if tool == 'emmake':
+        # emmake only sets up the environment for the command it runs
+        os.execvp(args[0], args)
+
+    if tool == 'cmake' and '--version' in args:
+        print('cmake version 3.18.1')
+        return 0
+
+    targets = parse_make_args(args)[1] if tool == 'make' else []
+    key, behaviour = get_behaviour(get_config(), tool, targets)
+
+    start = time.time()
+    simulate_work(behaviour)
+
+    failed = count_invocation(key) < behaviour.get('fail', 0) or random.random() < behaviour.get('fail_rate', 0)
+
+    if not failed:
+        handlers = { 'configure': fake_configure, 'make': fake_make, 'strip': fake_strip, 'csc': fake_csc }
+        if tool in handlers:
+            handlers[tool](args, behaviour)
+
+    log_invocation({ 'tool': tool, 'key': key, 'cwd': os.getcwd(), 'args': args, 'start': start, 'end': time.time(), 'failed': failed })
+
+    if failed:
+        sys.stderr.write('fake %s: error: injected failure (%s)\n' % (tool, key))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import time
+
+from os.path import join as path_join
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, repo_dir)
+
+import fake_env
+
+from os_utils import *
+
+
+# Runs the build scripts against the fake tools of fake_env.py to measure the orchestration layer itself:
+#   overhead: wall time not spent in commands, with each of the instrumentation options
+#   scaling: wall time of an Android build of all the targets with different '--jobs' values
+#   cache: cold build, '--resume' without changes, '--resume' after a source change, and the BCL and LLVM stamps
+#   failures: injected failures with and without '--retries'
+# Every script invocation runs in its own process, as in real builds.
+
+scenarios = ['overhead', 'scaling', 'cache', 'failures']
+
+
+class Bench:
+    def __init__(self, work_dir: str, repeat: int):
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self.runs = 0
+
+    def create_env(self, name: str, config: dict) -> dict:
+        env_dir = path_join(self.work_dir, name)
+        if os.path.isdir(env_dir):
+            shutil.rmtree(env_dir)
+        return fake_env.create(env_dir, config)
+
+    def reset_outputs(self, env: dict):
+        for path in [env['configure_dir'], env['install_dir']]:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        # The BCL build writes its profiles to the sources
+        shutil.rmtree(path_join(env['mono_root'], 'mcs', 'class', 'lib'), ignore_errors=True)
+
+    def run_script(self, env: dict, script: str, args: list) -> dict:
+        '''Runs one of the build scripts and returns its timings, based on its trace'''
+        from analyze import get_busy_time
+
+        self.runs += 1
+        trace_file = path_join(env['work_dir'], 'trace-%s.json' % self.runs)
+        log_file = path_join(env['work_dir'], 'run-%s.log' % self.runs)
+
+        command = [sys.executable, path_join(repo_dir, script)] + args + [
+            '--mono-sources', env['mono_root'],
+            '--configure-dir', env['configure_dir'],
+            '--install-dir', env['install_dir'],
+            '--trace-file', trace_file
+        ]
+
+        start = time.time()
+        with open(log_file, 'w') as log:
+            exit_code = subprocess.call(command, env=env['env'], stdout=log, stderr=subprocess.STDOUT)
+        wall_time = time.time() - start
+
+        spans = []
+        if os.path.isfile(trace_file):
+            with open(trace_file, 'r') as f:
+                spans = [event for event in json.load(f)['traceEvents'] if event.get('ph') == 'X']
+
+        commands = [(span['ts'] / 1e6, (span['ts'] + span['dur']) / 1e6) for span in spans if span.get('cat') == 'command']
+        phases = [span for span in spans if span.get('cat') == 'phase']
+        command_time = get_busy_time(commands)
+
+        return {
+            'script': script,
+            'args': args,
+            'exit_code': exit_code,
+            'wall_time': wall_time,
+            'command_time': command_time,
+            'overhead': wall_time - command_time,
+            'commands': len(commands),
+            'phases_run': len([span for span in phases if not span['args'].get('skipped')]),
+            'phases_skipped': len([span for span in phases if span['args'].get('skipped')]),
+            'log': log_file
+        }
+
+    def median_run(self, env: dict, runs: list, prepare=None) -> dict:
+        '''Runs the (script, args) list 'repeat' times. Returns the results of the repetition with the median total wall time.'''
+        repetitions = []
+        for i in range(self.repeat):
+            if prepare is not None:
+                prepare()
+            repetitions += [[self.run_script(env, script, args) for script, args in runs]]
+        repetitions.sort(key=lambda results: sum(result['wall_time'] for result in results))
+        return repetitions[len(repetitions) // 2]
+
+
+def bench_overhead(bench: Bench, jobs: list) -> list:
+    '''All the tools take no time, so everything measured is the scripts themselves'''
+    env = bench.create_env('overhead', {})
+    variants = [
+        ('trace only', []),
+        ('--capture-logs', ['--capture-logs']),
+        ('--progress', ['--progress']),
+        ('--metrics-db', ['--metrics-db', path_join(env['work_dir'], 'metrics.sqlite')]),
+        ('--make-timing', ['--make-timing', 'yes']),
+        ('--resource-report', ['--resource-report', path_join(env['work_dir'], 'resources.json')])
+    ]
+
+    results = []
+    for name, extra_args in variants:
+        runs = [('linux.py', ['configure', '--target', 'x86_64'] + extra_args), ('linux.py', ['make', '--target', 'x86_64'] + extra_args)]
+        for result in bench.median_run(env, runs, prepare=lambda: bench.reset_outputs(env)):
+            results += [dict(result, scenario='overhead', variant=name)]
+    return results
+
+
+def bench_scaling(bench: Bench, jobs: list) -> list:
+    env = bench.create_env('scaling', {
+        'configure': { 'seconds': 0.2 },
+        'make': { 'seconds': 0.5, 'cpu': 0.5, 'io_kib': 4096 },
+        'make:install': { 'seconds': 0.3, 'io_kib': 8192 },
+        'strip': { 'seconds': 0.2, 'cpu': 1 }
+    })
+
+    results = []
+    for job_count in jobs:
+        def prepare():
+            bench.reset_outputs(env)
+            bench.run_script(env, 'android.py', ['configure', '--target', 'all-targets'])
+        runs = [('android.py', ['make', '--target', 'all-targets', '-j%s' % job_count])]
+        for result in bench.median_run(env, runs, prepare=prepare):
+            results += [dict(result, scenario='scaling', variant='-j%s' % job_count)]
+    return results
+
+
+def bench_cache(bench: Bench, jobs: list) -> list:
+    env = bench.create_env('cache', {
+        'configure': { 'seconds': 0.3 },
+        'make': { 'seconds': 0.5, 'io_kib': 2048 },
+        'make:install': { 'seconds': 0.1 },
+        'make:all-mcs': { 'seconds': 0.5, 'io_kib': 8192 },
+        'strip': { 'seconds': 0.05 }
+    })
+
+    build = [('linux.py', ['configure', '--target', 'x86_64', '--resume']), ('linux.py', ['make', '--target', 'x86_64', '--resume'])]
+    bcl = [('bcl.py', ['make', '--product', 'desktop']), ('linux.py', ['copy-bcl', '--target', 'x86_64', '--resume'])]
+    llvm = [('llvm.py', ['make', '--target', 'llvm64'])]
+
+    results = []
+    bench.reset_outputs(env)
+    for variant, runs in [('cold', build + bcl + llvm), ('warm', build + bcl + llvm)]:
+        results += [dict(result, scenario='cache', variant=variant) for result in [bench.run_script(env, script, args) for script, args in runs]]
+
+    fake_env.modify_sources(env)
+    results += [dict(result, scenario='cache', variant='source changed') for result in [bench.run_script(env, script, args) for script, args in build]]
+    return results
+
+
+def bench_failures(bench: Bench, jobs: list) -> list:
+    config = { 'make': { 'seconds': 0.1, 'fail': 1 } }
+    env = bench.create_env('failures', config)
+
+    results = []
+    for variant, extra_args in [('no retries', []), ('--retries 1', ['--retries', '1', '--retry-delay', '0'])]:
+        bench.reset_outputs(env)
+        fake_env.write_config(env['config_file'], config)
+        bench.run_script(env, 'linux.py', ['configure', '--target', 'x86_64'])
+        result = bench.run_script(env, 'linux.py', ['make', '--target', 'x86_64'] + extra_args)
+        make_invocations = [i for i in fake_env.load_invocations(env) if i['key'] == 'make']
+        results += [dict(result, scenario='failures', variant=variant, make_invocations=len(make_invocations))]
+    return results
+
+
+def print_results(results: list):
+    rows = [('scenario', 'variant', 'step', 'exit', 'wall s', 'commands s', 'overhead s', 'phases run', 'skipped')]
+    for r in results:
+        rows += [(r['scenario'], r['variant'], '%s %s' % (r['script'], r['args'][0]), str(r['exit_code']), '%.2f' % r['wall_time'],
+            '%.2f' % r['command_time'], '%.2f' % r['overhead'], str(r['phases_run']), str(r['phases_skipped']))]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(value.ljust(width) if i < 3 else value.rjust(width) for i, (value, width) in enumerate(zip(row, widths))))
+
+
+def main(raw_args):
+    import cmd_utils
+
+    parser = cmd_utils.build_arg_parser(description='Benchmarks the build scripts against fake tools and a fake Mono source tree')
+
+    default_help = 'default: %(default)s'
+
+    parser.add_argument('--scenario', choices=scenarios, action='append', default=[], help='Scenario to run. Default: all of them.')
+    parser.add_argument('--work-dir', default=path_join('/tmp', 'godot-mono-builds-bench'), help=default_help)
+    parser.add_argument('--jobs', type=int, action='append', default=[], help='Job counts for the scaling scenario. Default: 1, 2 and 4.')
+    parser.add_argument('--repeat', type=int, default=1, help='Repetitions of the overhead and scaling measurements. The median is reported.\n' + default_help)
+    parser.add_argument('--output', default='', help='Also write the results to this JSON file.')
+
+    args = parser.parse_args(raw_args)
+
+    work_dir = os.path.abspath(args.work_dir)
+    bench = Bench(work_dir, max(args.repeat, 1))
+
+    functions = { 'overhead': bench_overhead, 'scaling': bench_scaling, 'cache': bench_cache, 'failures': bench_failures }
+
+    try:
+        mkdir_p(work_dir)
+        results = []
+        for scenario in args.scenario or scenarios:
+            print('Running scenario: ' + scenario)
+            results += functions[scenario](bench, args.jobs or [1, 2, 4])
+    except BuildError as e:
+        sys.exit(e.message)
+
+    print_results(results)
+
+    if args.output:
+        write_file_if_changed(os.path.abspath(args.output), json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    from sys import argv
+    main(argv[1:])
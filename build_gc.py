@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import os
+import os.path
+import sys
+import time
+
+from os.path import join as path_join
+
+from os_utils import *
+
+
+# Files removed by '--objects-only'. Everything else in the build tree, including the
+# configure state (Makefiles, config.status, config.h), is kept.
+object_file_patterns = ['*.o', '*.lo', '*.obj', '*.dwo']
+
+
+# A directory of the configure directory is a build tree only if it was configured. This leaves out
+# the directories of the build metadata ('logs', 'size-reports', 'make-timing', 'time-trace', ...).
+build_tree_markers = ['config.status', 'Makefile', 'CMakeCache.txt']
+
+
+def is_build_tree(tree_dir: str) -> bool:
+    return any(os.path.isfile(path_join(tree_dir, marker)) for marker in build_tree_markers)
+
+
+def get_build_trees(configure_dir: str) -> list:
+    '''
+    Returns the build trees in the configure directory. Trees symlinked to another location
+    (e.g.: '--build-in-memory') are managed there and not listed.
+    '''
+    if not os.path.isdir(configure_dir):
+        return []
+    return sorted(d for d in os.listdir(configure_dir)
+        if not d.startswith('.') and not os.path.islink(path_join(configure_dir, d)) and is_build_tree(path_join(configure_dir, d)))
+
+
+def scan_tree(tree_dir: str) -> dict:
+    '''Returns the size, object file size and last modification time of a build tree'''
+    from fnmatch import fnmatch
+
+    size = 0
+    object_size = 0
+    # Only file mtimes count. Removing the object files updates the mtime of their directories.
+    last_used = 0
+
+    for dirpath, dirnames, filenames in os.walk(tree_dir):
+        for filename in filenames:
+            try:
+                st = os.lstat(path_join(dirpath, filename))
+            except OSError:
+                continue
+            size += st.st_size
+            last_used = max(last_used, st.st_mtime)
+            if any(fnmatch(filename, pattern) for pattern in object_file_patterns):
+                object_size += st.st_size
+
+    return { 'size': size, 'object_size': object_size, 'last_used': last_used or os.stat(tree_dir).st_mtime }
+
+
+def remove_object_files(tree_dir: str) -> int:
+    from fnmatch import fnmatch
+
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(tree_dir):
+        for filename in filenames:
+            if any(fnmatch(filename, pattern) for pattern in object_file_patterns):
+                path = path_join(dirpath, filename)
+                removed += os.lstat(path).st_size
+                os.remove(path)
+    return removed
+
+
+def evict_tree(configure_dir: str, tree: str):
+    rm_rf(path_join(configure_dir, tree))
+
+    # The BCL is configured and built in its build tree, so none of its stamps hold anymore
+    # (with only the configure stamp removed, 'make_bcl' would be skipped on a fresh tree).
+    # Other stamps, checkpoints and config caches are kept. The checkpoints notice the
+    # missing Makefile and configure again.
+    if tree == 'bcl':
+        rm_rf(*globs(('.stamp-bcl-*',), dirpath=configure_dir))
+
+
+def gc(configure_dir: str, install_dir: str, budget_mib: int, objects_only: bool, min_age_hours: float, dry_run: bool, jobs: int):
+    trees = get_build_trees(configure_dir)
+    scans = dict(zip(trees, run_parallel(lambda tree: scan_tree(path_join(configure_dir, tree)), trees, jobs)))
+
+    budget = budget_mib * 1024 * 1024
+    total = sum(scan['size'] for scan in scans.values())
+
+    print('Configure directory: %s bytes in %s build trees (budget: %s bytes)' % (total, len(trees), budget))
+
+    now = time.time()
+    freed = 0
+
+    for tree in sorted(trees, key=lambda tree: scans[tree]['last_used']):
+        if total - freed <= budget:
+            break
+
+        scan = scans[tree]
+
+        if now - scan['last_used'] < min_age_hours * 3600:
+            # Trees are sorted by last use, so the rest are more recent
+            print('Not evicting build trees used in the last %s hours' % min_age_hours)
+            break
+
+        if objects_only:
+            if not scan['object_size']:
+                continue
+            print('%s object files of: %s (%s bytes, last used %s)' % ('Would remove' if dry_run else 'Removing', tree,
+                scan['object_size'], time.strftime('%Y-%m-%d %H:%M', time.localtime(scan['last_used']))))
+            freed += scan['object_size'] if dry_run else remove_object_files(path_join(configure_dir, tree))
+        else:
+            print('%s build tree: %s (%s bytes, last used %s)' % ('Would evict' if dry_run else 'Evicting', tree,
+                scan['size'], time.strftime('%Y-%m-%d %H:%M', time.localtime(scan['last_used']))))
+            if not dry_run:
+                evict_tree(configure_dir, tree)
+            freed += scan['size']
+
+    print('%s %s bytes; configure directory is now %s bytes' % ('Would free' if dry_run else 'Freed', freed, total - freed))
+
+    if total - freed > budget:
+        print('WARNING: The configure directory is still over budget')
+
+    # Install outputs are never evicted. Just report them.
+    if os.path.isdir(install_dir):
+        install_size = sum(scan_tree(path_join(install_dir, d))['size'] for d in os.listdir(install_dir) if os.path.isdir(path_join(install_dir, d)))
+        print('Install directory (not evicted): %s bytes' % install_size)
+
+
+def main(raw_args):
+    import cmd_utils
+
+    parser = cmd_utils.build_arg_parser(description='Evicts the least recently used build trees to keep the configure directory under a size budget')
+
+    default_help = 'default: %(default)s'
+
+    home = os.environ.get('HOME')
+
+    parser.add_argument('action', choices=['gc'])
+    parser.add_argument('--configure-dir', default=path_join(home, 'mono-configs'), help=default_help)
+    parser.add_argument('--install-dir', default=path_join(home, 'mono-installs'), help=default_help)
+    parser.add_argument('--budget', type=int, required=True, help='Maximum size in MiB of the build trees in the configure directory')
+    parser.add_argument('--objects-only', action='store_true', default=False,
+        help='Only remove the object files of the evicted build trees, keeping their configure state so they don\'t need to be configured again.\n' + default_help)
+    parser.add_argument('--min-age', type=float, default=1, help='Never evict build trees used in the last N hours (e.g.: by a running build).\n' + default_help)
+    parser.add_argument('--dry-run', action='store_true', default=False, help=default_help)
+    parser.add_argument('--jobs', '-j', nargs='?', const=str(os.cpu_count()), default='1', help=default_help)
+
+    args = parser.parse_args(raw_args)
+
+    try:
+        gc(os.path.abspath(args.configure_dir), os.path.abspath(args.install_dir), args.budget, args.objects_only, args.min_age, args.dry_run, int(args.jobs))
+    except BuildError as e:
+        sys.exit(e.message)
+
+
+if __name__ == '__main__':
+    from sys import argv
+    main(argv[1:])
@@ -0,0 +1,129 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# Records spans in the Chrome Trace Event format, which can be opened with 'chrome://tracing'
+# or https://ui.perfetto.dev. Tracing is enabled with '--trace-file'. Span categories:
+#   target: one action (e.g.: 'make') for one target
+#   phase: a checkpointed build phase (configure, make, install-<subdir>, strip, copy-bcl)
+#   command: a command run with 'run_command'
+#   task: anything else (e.g.: stripping one file in a parallel worker)
+# Every span carries the product, target and configuration it belongs to as arguments.
+
+
+# Arguments added to every span started in the current context. Copied into the workers of 'run_parallel'.
+context_args = contextvars.ContextVar('context_args', default={})
+
+
+class Tracer:
+    def __init__(self, path: str):
+        self.path = path
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+            'args': { 'name': ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:2]) }
+        }]
+        # Started from the main thread, which gets the first id
+        self.get_tid()
+
+    def get_tid(self) -> int:
+        # Small sequential ids are easier to read in the viewer than thread idents
+        ident = threading.get_ident()
+        with self.lock:
+            if not ident in self.threads:
+                tid = len(self.threads)
+                self.threads[ident] = tid
+                name = 'main' if threading.current_thread() is threading.main_thread() else 'worker-%s' % tid
+                self.events += [{ 'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': { 'name': name } }]
+            return self.threads[ident]
+
+    def add_span(self, name: str, cat: str, start: float, end: float, args: dict):
+        event = {
+            'name': name, 'cat': cat, 'ph': 'X', 'pid': self.pid, 'tid': self.get_tid(),
+            'ts': int(start * 1e6), 'dur': int((end - start) * 1e6), 'args': args
+        }
+        with self.lock:
+            self.events += [event]
+
+    def save(self):
+        from os_utils import write_file_if_changed
+        with self.lock:
+            events = list(self.events)
+        write_file_if_changed(self.path, json.dumps({ 'traceEvents': events, 'displayTimeUnit': 'ms' }))
+
+
+tracer = None
+
+# Objects notified when spans start and end (e.g.: the progress display), whether tracing or not.
+# They must implement 'span_started(name, cat, args)' and 'span_ended(name, cat, args, duration)'.
+listeners = []
+
+
+def start_trace(path: str):
+    '''Starts recording spans. The trace file is written when the process exits, even if the build failed.'''
+    import atexit
+
+    global tracer
+    if tracer is not None:
+        return
+    tracer = Tracer(os.path.abspath(path))
+    atexit.register(tracer.save)
+
+
+def is_tracing() -> bool:
+    return tracer is not None
+
+
+@contextmanager
+def context(**args):
+    '''Adds the arguments to all the spans started inside the block'''
+    token = context_args.set(dict(context_args.get(), **args))
+    try:
+        yield
+    finally:
+        context_args.reset(token)
+
+
+@contextmanager
+def span(name: str, cat: str='task', **args):
+    '''Yields a dictionary where more arguments can be added before the span ends'''
+    extra_args = {}
+
+    if tracer is None and not listeners:
+        yield extra_args
+        return
+
+    span_args = dict(context_args.get())
+    span_args.update(args)
+
+    for listener in listeners:
+        listener.span_started(name, cat, span_args)
+
+    start = time.time()
+    status = 'failed'
+    try:
+        yield extra_args
+        status = 'ok'
+    finally:
+        end = time.time()
+        span_args['status'] = status
+        span_args.update(extra_args)
+        for listener in listeners:
+            listener.span_ended(name, cat, span_args, end - start)
+        if tracer is not None:
+            tracer.add_span(name, cat, start, end, span_args)
+
+
+@contextmanager
+def target_span(name: str, **args):
+    '''Span of one action for one target. 'args' (e.g.: product, target, configuration) are added to every span inside.'''
+    with context(**args), span(name, cat='target'):
+        yield
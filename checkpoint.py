@@ -0,0 +1,153 @@
+import json
+import os
+import os.path
+import threading
+import time
+
+from os.path import join as path_join
+
+from build_trace import span
+from options import BaseOpts
+from os_utils import *
+
+
+# Build phases of a target, in order. Install phases are named 'install-<subdir>' and belong to
+# the 'install' group. The fingerprint of a phase includes the fingerprints of the phases recorded
+# for the nearest preceding group, so redoing a phase invalidates everything that comes after it.
+phase_groups = ['configure', 'make', 'install', 'strip', 'copy-bcl']
+
+
+def get_phase_group(phase: str) -> str:
+    return 'install' if phase.startswith('install-') else phase
+
+
+def fingerprint_of(*values) -> str:
+    import hashlib
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_tree_fingerprint(dirpath: str) -> str:
+    '''Cheap fingerprint of a directory tree based on file paths, sizes and mtimes'''
+    entries = []
+    for root, dirnames, filenames in os.walk(dirpath):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = path_join(root, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries += [(os.path.relpath(path, dirpath), st.st_size, st.st_mtime_ns)]
+    return fingerprint_of(entries)
+
+
+def get_source_fingerprint(mono_source_root: str) -> str:
+    '''Fingerprint of the Mono sources: the git revision plus any uncommitted changes (e.g.: applied patches)'''
+    import subprocess
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=mono_source_root, stderr=subprocess.DEVNULL)
+        diff = subprocess.check_output(['git', 'diff', 'HEAD'], cwd=mono_source_root, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        # Not a git repository. Nothing we can cheaply fingerprint, so treat it as always changed.
+        return fingerprint_of('no-git', time.time())
+    return fingerprint_of(revision.decode().strip(), fingerprint_of(diff.decode(errors='replace')))
+
+
+def get_checkpoint_file(opts: BaseOpts, name: str) -> str:
+    return path_join(opts.configure_dir, '.checkpoint-%s.json' % name)
+
+
+class Checkpoints:
+    '''Records the completed build phases of a target along with the fingerprint of their inputs'''
+
+    def __init__(self, opts: BaseOpts, name: str):
+        self.path = get_checkpoint_file(opts, name)
+        self.resume = opts.resume
+        self.retries = opts.retries
+        self.retry_delay = opts.retry_delay
+        self.lock = threading.Lock()
+        self.phases = self.load()
+
+    def load(self) -> dict:
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                phases = json.load(f)
+            return phases if isinstance(phases, dict) else {}
+        except ValueError:
+            print('WARNING: Ignoring corrupt checkpoint file: ' + self.path)
+            return {}
+
+    def save(self):
+        mkdir_p(os.path.dirname(self.path))
+        write_file_if_changed(self.path, json.dumps(self.phases, indent=4, sort_keys=True))
+
+    def get_predecessor_fingerprints(self, phase: str) -> list:
+        group_index = phase_groups.index(get_phase_group(phase))
+        for group in reversed(phase_groups[:group_index]):
+            fingerprints = sorted((p, r['fingerprint']) for p, r in self.phases.items() if get_phase_group(p) == group)
+            if fingerprints:
+                return fingerprints
+        return []
+
+    def get_fingerprint(self, phase: str, inputs) -> str:
+        with self.lock:
+            return fingerprint_of(phase, inputs, self.get_predecessor_fingerprints(phase))
+
+    def is_complete(self, phase: str, fingerprint: str, outputs) -> bool:
+        with self.lock:
+            record = self.phases.get(phase)
+        if record is None or record['fingerprint'] != fingerprint:
+            return False
+        return all(os.path.exists(output) for output in outputs)
+
+    def invalidate_from(self, phase: str):
+        group_index = phase_groups.index(get_phase_group(phase))
+        with self.lock:
+            later_groups = phase_groups[group_index + 1:]
+            for p in [p for p in self.phases if p == phase or get_phase_group(p) in later_groups]:
+                del self.phases[p]
+            self.save()
+
+    def record(self, phase: str, fingerprint: str):
+        with self.lock:
+            self.phases[phase] = { 'fingerprint': fingerprint, 'completed': time.time() }
+            self.save()
+
+    def run(self, phase: str, fn, inputs=[], outputs=[]) -> bool:
+        '''Runs the phase unless resuming and its checkpoint is valid. Returns whether the phase ran.'''
+        fingerprint = self.get_fingerprint(phase, inputs)
+
+        if self.resume and self.is_complete(phase, fingerprint, outputs):
+            print('Skipping phase \'%s\': checkpoint is up to date' % phase)
+            with span(phase, cat='phase', skipped=True):
+                return False
+
+        with span(phase, cat='phase', skipped=False):
+            self.invalidate_from(phase)
+            retry_call(fn, retries=self.retries, delay=self.retry_delay, name=phase)
+            self.record(phase, fingerprint)
+        return True
+
+
+checkpoints_cache = {}
+checkpoints_cache_lock = threading.Lock()
+
+
+def get_checkpoints(opts: BaseOpts, product: str, target: str, configuration: str) -> Checkpoints:
+    return get_checkpoints_by_name(opts, '%s-%s-%s' % (product, target, configuration))
+
+
+def get_checkpoints_by_name(opts: BaseOpts, name: str) -> Checkpoints:
+    with checkpoints_cache_lock:
+        if not name in checkpoints_cache:
+            checkpoints_cache[name] = Checkpoints(opts, name)
+        return checkpoints_cache[name]
+
+
+def clean_checkpoints(opts: BaseOpts, product: str, target: str, configuration: str):
+    name = '%s-%s-%s' % (product, target, configuration)
+    with checkpoints_cache_lock:
+        checkpoints_cache.pop(name, None)
+    rm_rf(get_checkpoint_file(opts, name))
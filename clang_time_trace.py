@@ -0,0 +1,124 @@
+import json
+import os
+import os.path
+
+from os.path import join as path_join
+
+
+# With '--time-trace', the runtime and LLVM builds compile with clang's '-ftime-trace', which writes a
+# '<object>.json' trace next to each object file. After make, the traces of the build directory are merged
+# into a ranked report of the most expensive translation units, headers, template instantiations and
+# compiler phases. The report is written to '<configure_dir>/time-trace/<name>.json'.
+#
+# Header times are inclusive: a header's time includes the headers it includes.
+
+TIME_TRACE_FLAGS = ['-ftime-trace', '-ftime-trace-granularity=500']
+
+
+def is_clang(command: str) -> bool:
+    import shlex
+    import subprocess
+    from os_utils import find_executable
+
+    # The command may be wrapped (e.g.: 'ccache clang', or the osxcross wrapper of ios.py followed by '<triple>-clang')
+    tokens = shlex.split(command) if command.strip() else ['cc']
+    if any('clang' in os.path.basename(token) for token in tokens if not token.startswith('-')):
+        return True
+
+    # e.g.: 'cc' on macOS. Run the whole command, so wrappers still set up the compiler's environment.
+    program = tokens[0] if os.path.isabs(tokens[0]) else find_executable(tokens[0])
+    if not program:
+        return False
+    try:
+        return b'clang' in subprocess.check_output([program] + tokens[1:] + ['--version'], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+
+def warn(message: str):
+    # Shown even in progress mode, where the standard output goes to the session log
+    from progress import print_to_terminal
+    print_to_terminal('WARNING: ' + message)
+
+
+def get_time_trace_flags(compiler: str, description: str) -> list:
+    if not is_clang(compiler):
+        warn('\'--time-trace\' requires clang, but the compiler of %s is \'%s\'. %s will be built without it.' % (description, compiler, description))
+        return []
+    return TIME_TRACE_FLAGS
+
+
+def find_trace_files(build_dir: str) -> list:
+    '''The '-ftime-trace' outputs: '.json' files next to an object file with the same name'''
+    trace_files = []
+    for dirpath, dirnames, filenames in os.walk(build_dir):
+        names = set(filenames)
+        for filename in filenames:
+            if filename.endswith('.json') and (filename[:-len('.json')] + '.o' in names or filename[:-len('.json')] + '.obj' in names):
+                trace_files += [path_join(dirpath, filename)]
+    return trace_files
+
+
+def add_time(totals: dict, key: str, duration: float):
+    entry = totals.setdefault(key, [0, 0])
+    entry[0] += duration
+    entry[1] += 1
+
+
+def aggregate(trace_files: list, build_dir: str) -> dict:
+    '''Returns the total time in seconds and count of each translation unit, header, template and phase'''
+    units, headers, templates, phases = {}, {}, {}, {}
+
+    for trace_file in trace_files:
+        try:
+            with open(trace_file, 'r') as f:
+                events = json.load(f).get('traceEvents', [])
+        except (ValueError, AttributeError):
+            continue # Not a time trace
+
+        unit = os.path.relpath(trace_file, build_dir)[:-len('.json')] + '.o'
+
+        for event in events:
+            if event.get('ph') != 'X':
+                continue
+            name = event.get('name', '')
+            duration = event.get('dur', 0) / 1e6
+            detail = event.get('args', {}).get('detail', '')
+
+            if name == 'ExecuteCompiler':
+                add_time(units, unit, duration)
+            elif name == 'Source' and detail:
+                add_time(headers, detail, duration)
+            elif name in ['InstantiateFunction', 'InstantiateClass'] and detail:
+                add_time(templates, detail, duration)
+            elif name.startswith('Total ') and name != 'Total ExecuteCompiler':
+                add_time(phases, name[len('Total '):], duration)
+
+    def ranked(totals):
+        return [{ 'name': key, 'time': value[0], 'count': value[1] } for key, value in sorted(totals.items(), key=lambda item: -item[1][0])]
+
+    return { 'units': ranked(units), 'headers': ranked(headers), 'templates': ranked(templates), 'phases': ranked(phases) }
+
+
+def report_time_trace(opts, name: str, build_dir: str, top: int=15):
+    from os_utils import mkdir_p, write_file_if_changed
+
+    trace_files = find_trace_files(build_dir)
+    if not trace_files:
+        warn('\'--time-trace\' was requested, but no \'-ftime-trace\' files were found for %s in: %s' % (name, build_dir))
+        return
+
+    report = aggregate(trace_files, build_dir)
+
+    print('Compile time hotspots of %s (%s translation units):' % (name, len(trace_files)))
+    for title, key in [('Translation units', 'units'), ('Headers (inclusive)', 'headers'),
+                       ('Template instantiations', 'templates'), ('Compiler phases', 'phases')]:
+        if not report[key]:
+            continue
+        print('  %s:' % title)
+        for entry in report[key][:top]:
+            print('    %9.1fs  %6sx  %s' % (entry['time'], entry['count'], entry['name']))
+
+    report_dir = path_join(opts.configure_dir, 'time-trace')
+    mkdir_p(report_dir)
+    write_file_if_changed(path_join(report_dir, name + '.json'), json.dumps(report, indent=4))
@@ -56,6 +56,23 @@ def add_base_arguments(parser, default_help):
         parser.add_argument('--mono-sources', required=True)
 
     parser.add_argument('--mxe-prefix', default='/usr', help=default_help)
+    parser.add_argument('--resume', action='store_true', default=False, help='Skip the build phases whose checkpoint is still valid.\n' + default_help)
+    parser.add_argument('--retries', type=int, default=0, help='Number of times to retry a failed build phase.\n' + default_help)
+    parser.add_argument('--retry-delay', type=float, default=10, help='Seconds to wait before retrying a failed build phase.\n' + default_help)
+    parser.add_argument('--link-mode', choices=['copy', 'hardlink', 'reflink'], default='copy',
+        help='How to place files when copying trees (e.g.: the BCL). \'hardlink\' and \'reflink\' fall back to copying across filesystems. ' +
+             'Hardlinked files are shared with the source tree, so they must not be modified in place.\n' + default_help)
+    parser.add_argument('--resource-report', default='', help='Write the CPU time, peak RSS, block I/O and context switches of every command to this JSON file.')
+    parser.add_argument('--metrics-db', default='', help='Append the timings, resource usage and artifact sizes of this run to this SQLite database (see \'report.py\').')
+    parser.add_argument('--trace-file', default='', help='Write a timeline of the build steps to this file, in Chrome Trace Event format (e.g.: for https://ui.perfetto.dev).')
+    parser.add_argument('--time-trace', action='store_true', default=False,
+        help='Compile the runtimes and LLVM with clang\'s \'-ftime-trace\' and print the most expensive files, headers and compiler phases after make.')
+    parser.add_argument('--capture-logs', action='store_true', default=False,
+        help='Write the output of every command to its own compressed log instead of the terminal. The last lines and the first error are printed if the command fails.')
+    parser.add_argument('--progress', action='store_true', default=False,
+        help='Show one status line per active target with an ETA from the previous runs. Implies \'--capture-logs\'.')
+    parser.add_argument('--log-dir', default='', help='Directory for the logs of \'--capture-logs\' and \'--progress\'. Default: \'<configure-dir>/logs\'.')
+    parser.add_argument('--log-tail', type=int, default=30, help='Number of lines of output kept in memory for each command, printed if it fails.\n' + default_help)
 
 
 def add_runtime_arguments(parser, default_help):
@@ -64,6 +81,30 @@ def add_runtime_arguments(parser, default_help):
     parser.add_argument('--configuration', choices=['release', 'debug'], default='release', help=default_help)
     parser.add_argument('--enable-cxx', action='store_true', default=False, help=default_help)
     parser.add_argument('--strip-libs', type=custom_bool, default=True, help='Strip the libraries if possible after running make.\n' + default_help)
+    parser.add_argument('--minimal-build', type=custom_bool, default=False, help='Only build the subdirectories needed for the installed files.\n' + default_help)
+    parser.add_argument('--split-debug', type=custom_bool, default=False,
+        help='Move the debug info of the shared libraries to a symbol store instead of discarding it. Takes precedence over \'--strip-libs\'.\n' + default_help)
+    parser.add_argument('--debug-level', choices=['default', '0', '1', '2', '3'], default='default',
+        help='Debug info level (-g<level>). \'default\' uses -g for release and -ggdb3 for debug builds.\n' + default_help)
+    parser.add_argument('--split-dwarf', type=custom_bool, default=False, help='Keep the DWARF in separate .dwo files in the build directory (-gsplit-dwarf). ELF only.\n' + default_help)
+    parser.add_argument('--compress-debug-sections', type=custom_bool, default=False, help='Compress the debug sections of objects and libraries (-gz). ELF only.\n' + default_help)
+    parser.add_argument('--build-in-memory', type=custom_bool, default=False,
+        help='Place the build directories of the targets in \'--memory-dir\' (e.g.: a tmpfs), spilling the least recently used ones back to disk when over budget.\n' + default_help)
+    parser.add_argument('--memory-dir', default='/dev/shm/godot-mono-builds', help=default_help)
+    parser.add_argument('--memory-budget', type=int, default=8192, help='Maximum size in MiB of the build directories in memory.\n' + default_help)
+    parser.add_argument('--symbol-store', default='', help='Symbol store directory for \'--split-debug\'. Default: \'symbol-store\' inside the install directory.')
+    parser.add_argument('--make-timing', type=custom_bool, default=False,
+        help='Time every recursive make and print the cost of each directory of the build after make.\n' + default_help)
+    parser.add_argument('--make-timing-compilers', type=custom_bool, default=False,
+        help='Also time every compiler invocation and print the slowest files. Implies \'--make-timing\'.\n' + default_help)
+    parser.add_argument('--size-baseline', default='',
+        help='Size report to compare with in the \'size-report\' action. Default: the previous different report of the target.')
+
+
+def add_watch_arguments(parser, default_help):
+    parser.add_argument('--watch-debounce', type=float, default=1.0, help='Seconds without changes before rebuilding in \'watch\' mode.\n' + default_help)
+    parser.add_argument('--watch-poll-interval', type=float, default=1.0, help=default_help)
+    parser.add_argument('--watch-polling', action='store_true', default=False, help='Poll for changes instead of using inotify.\n' + default_help)
 
 
 def expand_input_targets(input_targets, target_shortcuts=[]):
@@ -81,3 +122,25 @@ def expand_input_targets(input_targets, target_shortcuts=[]):
             targets += [target]
 
     return targets
+
+
+def init_build_session(opts):
+    '''Called by the scripts once the options are parsed, before running any action'''
+    import resource_usage
+    resource_usage.start_report(opts.resource_report, opts.jobs)
+
+    if opts.metrics_db:
+        import metrics_db
+        metrics_db.start_recording(opts.metrics_db, opts.mono_source_root, opts.jobs)
+
+    if opts.trace_file:
+        import build_trace
+        build_trace.start_trace(opts.trace_file)
+
+    if opts.capture_logs:
+        import log_capture
+        log_capture.start_capture(opts.log_dir, opts.log_tail)
+
+    if opts.progress:
+        import progress
+        progress.start_progress(opts.log_dir)
@@ -0,0 +1,206 @@
+import json
+import os
+import os.path
+import re
+import shlex
+import shutil
+import tempfile
+
+from os.path import join as path_join
+
+from build_trace import span
+from options import RuntimeOpts
+from os_utils import *
+
+
+# Symbol store layout:
+#   .build-id/<id[:2]>/<id[2:]>.debug: ELF debug info, indexed by GNU build-id (same layout GDB uses)
+#   uuid/<UUID>/<name>.dSYM: Mach-O debug info, indexed by the LC_UUID of each architecture
+#   sha256/<sha256>/<name>.debug: debug info of binaries without a build-id (e.g.: PE DLLs), by the hash of the debug info
+#   sha256/<sha256>/<name>.dSYM: debug info of Mach-O binaries without a UUID, by the hash of the binary before stripping
+#   index.json: maps each build-id/UUID/hash to the binary it was extracted from, and the hash of the stripped binary
+#
+# Splitting an already stripped binary would produce empty debug info. Binaries whose hash matches the recorded
+# hash of a stripped binary are skipped, and a store entry is never replaced with a smaller one.
+
+
+# Default symbol store, inside the install directory
+SYMBOL_STORE_DIR_NAME = 'symbol-store'
+
+
+def get_symbol_store_dir(opts: RuntimeOpts) -> str:
+    return opts.symbol_store if opts.symbol_store else path_join(opts.install_dir, SYMBOL_STORE_DIR_NAME)
+
+
+def tool_from_strip(strip: str, tool: str) -> str:
+    # The templates only configure 'strip'; the other binutils have the same prefix (e.g.: 'x86_64-w64-mingw32-', 'llvm-')
+    if strip.endswith('strip'):
+        return strip[:-len('strip')] + tool
+    return tool
+
+
+def run_tool_output(tool: str, args) -> str:
+    import subprocess
+    tool_cmd = shlex.split(tool)
+    try:
+        return subprocess.check_output(tool_cmd + args, stderr=subprocess.DEVNULL).decode(errors='replace')
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run_tool(tool: str, args, name: str):
+    tool_cmd = shlex.split(tool)
+    run_command(tool_cmd[0], args=tool_cmd[1:] + args, name=name)
+
+
+def read_elf_build_id(readelf: str, file: str) -> str:
+    match = re.search(r'Build ID:\s*([0-9a-fA-F]+)', run_tool_output(readelf, ['-n', file]))
+    return match.group(1).lower() if match else ''
+
+
+def read_macho_uuids(dwarfdump: str, file: str) -> list:
+    return [uuid.upper() for uuid in re.findall(r'UUID:\s*([0-9A-Fa-f-]{36})', run_tool_output(dwarfdump, ['--uuid', file]))]
+
+
+def get_store_entry_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(path_join(dirpath, filename)) for dirpath, dirnames, filenames in os.walk(path) for filename in filenames)
+
+
+def store_debug_info(src: str, dst: str):
+    '''Moves the debug file or dSYM bundle to the store, unless the store already has a larger one'''
+    if os.path.exists(dst):
+        if get_store_entry_size(dst) > get_store_entry_size(src):
+            print('WARNING: Not replacing %s with smaller debug info (was the binary already stripped?)' % dst)
+            return
+        rm_rf(dst)
+    mkdir_p(os.path.dirname(dst))
+    shutil.move(src, dst)
+
+
+def split_objcopy_debug(strip: str, file: str, store_dir: str) -> dict:
+    objcopy = tool_from_strip(strip, 'objcopy')
+    readelf = tool_from_strip(strip, 'readelf')
+
+    name = os.path.basename(file)
+
+    build_id = read_elf_build_id(readelf, file)
+
+    sections = run_tool_output(readelf, ['-S', file])
+
+    if '.gnu_debuglink' in sections:
+        # Already split. Splitting again would replace the stored debug info with an empty one.
+        dst = path_join(store_dir, '.build-id', build_id[:2], build_id[2:] + '.debug') if build_id else ''
+        if dst and os.path.isfile(dst):
+            return { build_id: { 'file': name, 'debug_file': os.path.relpath(dst, store_dir), 'kind': 'build-id' } }
+        if '.debug_info' not in sections:
+            print('WARNING: %s was already split and has no debug info left; skipping' % file)
+            return {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The debuglink stores the file name, so the temporary file must already have the final name
+        debug_file = path_join(tmp_dir, name + '.debug')
+
+        break_hardlink(file)
+        run_tool(objcopy, ['--only-keep-debug', file, debug_file], name='objcopy --only-keep-debug %s' % name)
+        run_tool(objcopy, ['--strip-unneeded', '--add-gnu-debuglink=%s' % debug_file, file], name='objcopy --strip-unneeded %s' % name)
+
+        if build_id:
+            key = build_id
+            dst = path_join(store_dir, '.build-id', build_id[:2], build_id[2:] + '.debug')
+        else:
+            key = file_sha256(debug_file)
+            dst = path_join(store_dir, 'sha256', key, name + '.debug')
+
+        store_debug_info(debug_file, dst)
+
+    return { key: { 'file': name, 'debug_file': os.path.relpath(dst, store_dir), 'kind': 'build-id' if build_id else 'sha256' } }
+
+
+def split_macho_debug(strip: str, file: str, store_dir: str) -> dict:
+    import sys
+
+    dsymutil = tool_from_strip(strip, 'dsymutil')
+    dwarfdump = tool_from_strip(strip, 'dwarfdump')
+
+    if sys.platform != 'darwin':
+        # OSXCROSS may not provide these. The LLVM tools handle Mach-O as well.
+        dsymutil = find_executable('llvm-dsymutil') or dsymutil
+        dwarfdump = find_executable('llvm-dwarfdump') or dwarfdump
+
+    name = os.path.basename(file)
+
+    uuids = read_macho_uuids(dwarfdump, file)
+
+    if uuids and all(os.path.isdir(path_join(store_dir, 'uuid', uuid, name + '.dSYM')) for uuid in uuids):
+        # Already split. The UUID changes whenever the binary is relinked.
+        return { uuid: { 'file': name, 'debug_file': path_join('uuid', uuid, name + '.dSYM'), 'kind': 'uuid' } for uuid in uuids }
+
+    # Without a UUID, key on the binary before stripping. After stripping, its hash would describe the stripped binary.
+    keys = [(uuid, path_join('uuid', uuid, name + '.dSYM'), 'uuid') for uuid in uuids]
+    if not keys:
+        sha256 = file_sha256(file)
+        keys = [(sha256, path_join('sha256', sha256, name + '.dSYM'), 'sha256')]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dsym_dir = path_join(tmp_dir, name + '.dSYM')
+
+        break_hardlink(file)
+        run_tool(dsymutil, [file, '-o', dsym_dir], name='dsymutil %s' % name)
+        # 'strip -S' removes the debug symbols; '--strip-unneeded' isn't supported by the macOS strip
+        run_tool(strip, ['-S', file], name='strip -S %s' % name)
+
+        records = {}
+        for key, debug_file, kind in keys:
+            tmp_copy = path_join(tmp_dir, 'copy', key, name + '.dSYM')
+            shutil.copytree(dsym_dir, tmp_copy)
+            store_debug_info(tmp_copy, path_join(store_dir, debug_file))
+            records[key] = { 'file': name, 'debug_file': debug_file, 'kind': kind }
+
+    return records
+
+
+def split_debug_files(opts: RuntimeOpts, product: str, target: str, strip: str, files, object_format: str):
+    '''
+    Extracts the debug info of the files into the symbol store and strips them. 'object_format'
+    is one of 'elf', 'pe' or 'macho'. Files are processed in parallel.
+    '''
+    store_dir = get_symbol_store_dir(opts)
+    mkdir_p(store_dir)
+
+    # Avoid processing the same file twice through symlinks
+    files = sorted(set(os.path.realpath(f) for f in files))
+
+    split_fn = split_macho_debug if object_format == 'macho' else split_objcopy_debug
+
+    def split_file(file):
+        # Already split and stripped by a previous run
+        sha256 = file_sha256(file)
+        previous = { key: record for key, record in index.items() if record.get('stripped_sha256') == sha256 and
+                     os.path.exists(path_join(store_dir, record['debug_file'])) }
+        if previous:
+            print('Debug info of %s already split; skipping' % file)
+            return previous
+
+        size_before = os.path.getsize(file)
+        with span('split debug %s' % os.path.basename(file), file=file):
+            records = split_fn(strip, file, store_dir)
+        if not records:
+            return records
+        stripped_sha256 = file_sha256(file)
+        for record in records.values():
+            record.update({ 'product': product, 'target': target, 'configuration': opts.configuration, 'stripped_sha256': stripped_sha256 })
+        print('Split debug info of %s: %s -> %s bytes' % (file, size_before, os.path.getsize(file)))
+        return records
+
+    index_file = path_join(store_dir, 'index.json')
+    index = {}
+    if os.path.isfile(index_file):
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+
+    for records in run_parallel(split_file, files, int(opts.jobs)):
+        index.update(records)
+
+    write_file_if_changed(index_file, json.dumps(index, indent=4, sort_keys=True))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import os.path
+import shutil
+import sys
+
+from os.path import join as path_join
+
+from os_utils import *
+
+
+# Content store layout, relative to the install directory:
+#   .content-store/objects/<sha256[:2]>/<sha256>-<mode>: one inode per distinct content and file mode
+#   .content-store/manifest.json: the files of every tree, with their hash, size and mode
+# Deduplicated files are hardlinks to the store objects. Tools that modify installed files must
+# replace them (write a new file and rename it) instead of modifying them in place. strip and
+# objcopy modify files in place, so 'strip_files' and '--split-debug' call 'break_hardlink' first.
+STORE_DIR_NAME = '.content-store'
+
+
+def get_store_dir(install_dir: str) -> str:
+    return path_join(install_dir, STORE_DIR_NAME)
+
+
+def get_manifest_path(install_dir: str) -> str:
+    return path_join(get_store_dir(install_dir), 'manifest.json')
+
+
+def get_object_path(install_dir: str, sha256: str, mode: int) -> str:
+    return path_join(get_store_dir(install_dir), 'objects', sha256[:2], '%s-%o' % (sha256, mode))
+
+
+def load_manifest(install_dir: str) -> dict:
+    manifest_path = get_manifest_path(install_dir)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(install_dir: str, manifest: dict):
+    mkdir_p(get_store_dir(install_dir))
+    write_file_if_changed(get_manifest_path(install_dir), json.dumps(manifest, indent=1, sort_keys=True))
+
+
+def list_tree_files(install_dir: str, tree: str) -> list:
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path_join(install_dir, tree)):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = path_join(dirpath, filename)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files += [os.path.relpath(path, install_dir)]
+    return files
+
+
+def hash_entry(install_dir: str, rel_path: str, previous: dict) -> dict:
+    st = os.stat(path_join(install_dir, rel_path))
+    mode = st.st_mode & 0o7777
+
+    # Reuse the previous hash if the file is the same inode with the same size and mtime
+    if previous and previous['ino'] == st.st_ino and previous['size'] == st.st_size and previous['mtime_ns'] == st.st_mtime_ns:
+        sha256 = previous['sha256']
+    else:
+        sha256 = file_sha256(path_join(install_dir, rel_path))
+
+    return { 'sha256': sha256, 'size': st.st_size, 'mode': mode, 'ino': st.st_ino, 'mtime_ns': st.st_mtime_ns }
+
+
+def link_to_store(install_dir: str, rel_path: str, entry: dict) -> int:
+    '''Replaces the file with a hardlink to its store object. Returns the number of bytes saved.'''
+    path = path_join(install_dir, rel_path)
+    object_path = get_object_path(install_dir, entry['sha256'], entry['mode'])
+
+    if not os.path.isfile(object_path):
+        # First time this content is seen. The file itself becomes the store object.
+        mkdir_p(os.path.dirname(object_path))
+        os.link(path, object_path)
+        return 0
+
+    object_stat = os.stat(object_path)
+    if object_stat.st_ino == entry['ino']:
+        return 0
+
+    tmp_path = '%s.dedupe-tmp-%s' % (path, os.getpid())
+    os.link(object_path, tmp_path)
+    os.replace(tmp_path, path)
+
+    entry['ino'] = object_stat.st_ino
+    entry['mtime_ns'] = object_stat.st_mtime_ns
+    return entry['size']
+
+
+def prune_store(install_dir: str) -> int:
+    '''Removes store objects no longer referenced by any file'''
+    removed = 0
+    objects_dir = path_join(get_store_dir(install_dir), 'objects')
+    for dirpath, dirnames, filenames in os.walk(objects_dir):
+        for filename in filenames:
+            object_path = path_join(dirpath, filename)
+            if os.stat(object_path).st_nlink == 1:
+                os.remove(object_path)
+                removed += 1
+    return removed
+
+
+def get_trees(install_dir: str, trees) -> list:
+    if trees:
+        return trees
+    return sorted(d for d in os.listdir(install_dir) if d != STORE_DIR_NAME and os.path.isdir(path_join(install_dir, d)))
+
+
+def dedupe(install_dir: str, trees, jobs: int, min_size: int):
+    manifest = load_manifest(install_dir)
+    trees = get_trees(install_dir, trees)
+
+    previous_entries = {}
+    for tree in trees:
+        previous_entries.update(manifest.pop(tree, {}))
+
+    files = [f for tree in trees for f in list_tree_files(install_dir, tree)]
+
+    entries = run_parallel(lambda f: hash_entry(install_dir, f, previous_entries.get(f)), files, jobs)
+
+    saved_bytes = 0
+    linked_files = 0
+
+    for rel_path, entry in zip(files, entries):
+        tree = rel_path.split(os.sep)[0]
+        if entry['size'] >= min_size:
+            try:
+                saved = link_to_store(install_dir, rel_path, entry)
+            except OSError as e:
+                # E.g.: the tree is on a different filesystem than the store
+                print('WARNING: Cannot deduplicate \'%s\': %s' % (rel_path, e))
+                saved = 0
+            saved_bytes += saved
+            linked_files += 1 if saved else 0
+        manifest.setdefault(tree, {})[rel_path] = entry
+
+    pruned = prune_store(install_dir)
+
+    save_manifest(install_dir, manifest)
+
+    print('Deduplicated %s files (%s bytes saved) across %s trees; %s unreferenced objects removed' % (linked_files, saved_bytes, len(trees), pruned))
+
+
+def export(install_dir: str, tree: str, output_dir: str):
+    '''Copies a tree to 'output_dir' as standalone files, verifying them against the manifest'''
+    manifest = load_manifest(install_dir)
+    tree_manifest = manifest.get(tree, {})
+
+    for rel_path in list_tree_files(install_dir, tree):
+        src = path_join(install_dir, rel_path)
+        dst = path_join(output_dir, os.path.relpath(rel_path, tree))
+
+        mkdir_p(os.path.dirname(dst))
+        shutil.copy2(src, dst)
+
+        # The size alone misses files modified in place, so the exported copy is hashed
+        entry = tree_manifest.get(rel_path)
+        if entry is not None and (entry['size'] != os.path.getsize(dst) or entry['sha256'] != file_sha256(dst)):
+            raise BuildError('File does not match the dedupe manifest: ' + src)
+
+    print('Exported \'%s\' to: %s' % (tree, output_dir))
+
+
+def unlink(install_dir: str, trees):
+    '''Replaces the hardlinks of the given trees with standalone copies, so they can be modified in place'''
+    manifest = load_manifest(install_dir)
+    trees = get_trees(install_dir, trees)
+
+    for tree in trees:
+        for rel_path in list_tree_files(install_dir, tree):
+            path = path_join(install_dir, rel_path)
+            if os.stat(path).st_nlink > 1:
+                tmp_path = '%s.dedupe-tmp-%s' % (path, os.getpid())
+                shutil.copy2(path, tmp_path)
+                os.replace(tmp_path, path)
+        manifest.pop(tree, None)
+
+    prune_store(install_dir)
+    save_manifest(install_dir, manifest)
+
+
+def main(raw_args):
+    import cmd_utils
+
+    parser = cmd_utils.build_arg_parser(description='Deduplicates identical files across the install directories using a content store')
+
+    default_help = 'default: %(default)s'
+
+    home = os.environ.get('HOME')
+
+    parser.add_argument('action', choices=['dedupe', 'export', 'unlink'])
+    parser.add_argument('--install-dir', default=path_join(home, 'mono-installs'), help=default_help)
+    parser.add_argument('--tree', action='append', default=[], help='Install directory to process (e.g.: desktop-linux-x86_64-release). Default: all of them.')
+    parser.add_argument('--output', default='', help='Output directory for the \'export\' action')
+    parser.add_argument('--min-size', type=int, default=1, help='Smallest file size in bytes to deduplicate.\n' + default_help)
+    parser.add_argument('--jobs', '-j', nargs='?', const=str(os.cpu_count()), default='1', help=default_help)
+
+    args = parser.parse_args(raw_args)
+
+    install_dir = os.path.abspath(args.install_dir)
+
+    try:
+        if args.action == 'dedupe':
+            dedupe(install_dir, args.tree, int(args.jobs), args.min_size)
+        elif args.action == 'export':
+            if len(args.tree) != 1 or not args.output:
+                raise BuildError('The \'export\' action requires exactly one --tree and --output')
+            export(install_dir, args.tree[0], os.path.abspath(args.output))
+        elif args.action == 'unlink':
+            unlink(install_dir, args.tree)
+    except BuildError as e:
+        sys.exit(e.message)
+
+
+if __name__ == '__main__':
+    from sys import argv
+    main(argv[1:])
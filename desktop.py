@@ -5,6 +5,8 @@ import sys
 
 from os.path import join as path_join
 
+from checkpoint import clean_checkpoints, get_checkpoints, get_tree_fingerprint
+from memory_build import remove_build_dir
 from options import *
 from os_utils import *
 import runtime
@@ -186,15 +188,43 @@ def strip_libs(opts: DesktopOpts, product: str, target_platform: str, target: st
     out_libs_dir = path_join(install_dir, 'lib')
 
     lib_files = globs(('*.a', '*.so'), dirpath=out_libs_dir)
-    if len(lib_files):
-        run_command(strip, args=['--strip-unneeded'] + lib_files, name='strip')
 
     if target_platform == 'windows':
         out_bin_dir = path_join(install_dir, 'bin')
+        lib_files += globs(('*.dll',), dirpath=out_bin_dir)
+
+    if len(lib_files):
+        runtime.strip_files(opts, product, target, strip, lib_files)
+
+
+def split_debug(opts: DesktopOpts, product: str, target_platform: str, target: str):
+    from debug_symbols import split_debug_files
+
+    env = {}
+    setup_desktop_template(env, opts, product, target_platform, target)
+    strip = env.get('_%s-%s_STRIP' % (product, target), 'strip')
 
-        dll_files = globs(('*.dll',), dirpath=out_bin_dir)
-        if len(dll_files):
-            run_command(strip, args=['--strip-unneeded'] + dll_files, name='strip')
+    install_dir = path_join(opts.install_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    out_libs_dir = path_join(install_dir, 'lib')
+
+    if target_platform == 'osx':
+        split_debug_files(opts, product, target, strip, globs(('*.dylib',), dirpath=out_libs_dir), 'macho')
+        return
+
+    shared_lib_files = globs(('*.so',), dirpath=out_libs_dir)
+    object_format = 'elf'
+
+    if target_platform == 'windows':
+        shared_lib_files += globs(('*.dll',), dirpath=path_join(install_dir, 'bin'))
+        object_format = 'pe'
+
+    if len(shared_lib_files):
+        split_debug_files(opts, product, target, strip, shared_lib_files, object_format)
+
+    # Static libraries are still stripped the usual way
+    static_lib_files = globs(('*.a',), dirpath=out_libs_dir)
+    if len(static_lib_files):
+        runtime.strip_files(opts, product, target, strip, static_lib_files)
 
 
 def configure(opts: DesktopOpts, product: str, target_platform: str, target: str):
@@ -209,8 +239,6 @@ def configure(opts: DesktopOpts, product: str, target_platform: str, target: str
 
 
 def make(opts: DesktopOpts, product: str, target_platform: str, target: str):
-    build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
-
     if target_platform == 'windows':
         mxe = 'mxe-Win64' if target == 'x86_64' else 'mxe-Win32'
         replace_in_new_file(
@@ -219,35 +247,57 @@ def make(opts: DesktopOpts, product: str, target_platform: str, target: str):
             dst_file='%s/mono/btls/%s.cmake' % (opts.mono_source_root, mxe)
         )
 
-    make_args = make_default_args(opts)
-    make_args += ['-C', build_dir]
+    runtime.run_make(opts, product, target)
+    runtime.run_make_install(opts, product, target)
+
+    checkpoints = get_checkpoints(opts, product, target, opts.configuration)
 
-    run_command('make', args=make_args, name='make')
-    run_command('make', args=['-C', '%s/mono' % build_dir, 'install'], name='make install mono')
-    run_command('make', args=['-C', '%s/support' % build_dir, 'install'], name='make install support')
-    run_command('make', args=['-C', '%s/data' % build_dir, 'install'], name='make install data')
+    if opts.split_debug:
+        checkpoints.run('strip', lambda: split_debug(opts, product, target_platform, target), inputs=['split-debug', opts.symbol_store])
+    elif opts.strip_libs:
+        checkpoints.run('strip', lambda: strip_libs(opts, product, target_platform, target))
+
+def size_report(opts: DesktopOpts, product: str, target_platform: str, target: str):
+    from size_report import report_library_sizes
+
+    env = {}
+    setup_desktop_template(env, opts, product, target_platform, target)
+    strip = env.get('_%s-%s_STRIP' % (product, target), 'strip')
+    object_format = { 'osx': 'macho', 'windows': 'pe' }.get(target_platform, 'elf')
+
+    report_library_sizes(opts, product, target, strip, object_format)
 
-    if opts.strip_libs:
-        strip_libs(opts, product, target_platform, target)
 
 def copy_bcl(opts: DesktopOpts, product: str, target_platform: str, target: str):
-    from distutils.dir_util import copy_tree
     from bcl import get_profile_install_dirs
+    from tree_sync import sync_tree
     dest_dir = path_join(opts.install_dir, '%s-%s-%s' % (product, target, opts.configuration), 'lib/mono/4.5')
-    for src_dir in get_profile_install_dirs(opts, 'desktop-win32' if target_platform == 'windows' else 'desktop'):
+    src_dirs = get_profile_install_dirs(opts, 'desktop-win32' if target_platform == 'windows' else 'desktop')
+    for src_dir in src_dirs:
         if not os.path.isdir(src_dir):
             raise BuildError('BCL source directory does not exist: %s. The BCL must be built prior to this.' % src_dir)
-        copy_tree(src_dir, dest_dir)
+
+    def copy():
+        for src_dir in src_dirs:
+            # Don't delete files missing from the BCL. The runtime installs its own files in this directory.
+            sync_tree(src_dir, dest_dir, link_mode=opts.link_mode, jobs=int(opts.jobs))
+
+    checkpoints = get_checkpoints(opts, product, target, opts.configuration)
+    checkpoints.run('copy-bcl', copy, inputs=[get_tree_fingerprint(src_dir) for src_dir in src_dirs], outputs=[dest_dir])
 
 def clean(opts: DesktopOpts, product: str, target_platform: str, target: str):
+    clean_checkpoints(opts, product, target, opts.configuration)
+    remove_build_dir(opts, product, target)
     rm_rf(
         path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration)),
         path_join(opts.configure_dir, '%s-%s-%s.config.cache' % (product, target, opts.configuration)),
+        runtime.get_strip_index_file(opts, product, target),
         path_join(opts.install_dir, '%s-%s-%s' % (product, target, opts.configuration))
     )
 
 
 def run_main(raw_args, target_platform):
+    import build_trace
     import cmd_utils
     from collections import OrderedDict
     from typing import Callable
@@ -257,16 +307,18 @@ def run_main(raw_args, target_platform):
     actions['make'] = make
     actions['copy-bcl'] = copy_bcl
     actions['clean'] = clean
+    actions['size-report'] = size_report
 
     parser = cmd_utils.build_arg_parser(description='Builds the Mono runtime for the Desktop')
 
     default_help = 'default: %(default)s'
 
-    parser.add_argument('action', choices=['configure', 'make', 'copy-bcl', 'clean'])
+    parser.add_argument('action', choices=['configure', 'make', 'copy-bcl', 'clean', 'size-report', 'watch'])
     parser.add_argument('--target', choices=targets[target_platform], action='append', required=True)
     parser.add_argument('--with-llvm', action='store_true', default=False, help=default_help)
 
     cmd_utils.add_runtime_arguments(parser, default_help)
+    cmd_utils.add_watch_arguments(parser, default_help)
 
     args = parser.parse_args(raw_args)
 
@@ -275,6 +327,8 @@ def run_main(raw_args, target_platform):
 
     opts = desktop_opts_from_args(args)
 
+    cmd_utils.init_build_session(opts)
+
     if not os.path.isdir(opts.mono_source_root):
         print('Mono sources directory not found: ' + opts.mono_source_root)
         sys.exit(1)
@@ -285,10 +339,18 @@ def run_main(raw_args, target_platform):
     if is_cross_compiling(target_platform) and sys.platform == 'darwin':
         raise RuntimeError('Cross-compiling from macOS is not supported')
 
-    action = actions[input_action]
-
     try:
+        if input_action == 'watch':
+            import watch
+            watch.watch_targets(opts, 'desktop-%s' % target_platform, input_targets, debounce=args.watch_debounce,
+                    poll_interval=args.watch_poll_interval, force_polling=args.watch_polling)
+            return
+
+        action = actions[input_action]
+
         for target in input_targets:
-            action(opts, 'desktop-%s' % target_platform, target_platform, target)
+            product = 'desktop-%s' % target_platform
+            with build_trace.target_span(input_action, product=product, target=target, configuration=opts.configuration):
+                action(opts, product, target_platform, target)
     except BuildError as e:
         sys.exit(e.message)
@@ -6,6 +6,8 @@ import sys
 
 from os.path import join as path_join
 
+from checkpoint import clean_checkpoints, get_checkpoints
+from memory_build import remove_build_dir
 from options import *
 from os_utils import *
 import runtime
@@ -425,6 +427,22 @@ def strip_libs(opts: iOSOpts, product: str, target: str):
     return
 
 
+def split_debug(opts: iOSOpts, product: str, target: str):
+    from debug_symbols import split_debug_files
+
+    env = {}
+    if target in sim_targets:
+        setup_ios_simulator_template(env, opts, target)
+    else:
+        setup_ios_device_template(env, opts, target)
+
+    install_dir = path_join(opts.install_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    lib_files = globs(('*.dylib',), dirpath=path_join(install_dir, 'lib'))
+
+    if len(lib_files):
+        split_debug_files(opts, product, target, env['_ios-%s_STRIP' % target], lib_files, 'macho')
+
+
 def configure(opts: iOSOpts, product: str, target: str):
     env = {}
 
@@ -453,21 +471,22 @@ def configure(opts: iOSOpts, product: str, target: str):
 def make(opts: iOSOpts, product: str, target: str):
     env = {}
 
-    build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    runtime.run_make(opts, product, target, cross=is_cross(target))
+    runtime.run_make_install(opts, product, target, cross=is_cross(target))
 
-    make_args = make_default_args(opts)
-    make_args += ['-C', build_dir]
-
-    run_command('make', args=make_args, name='make')
-    run_command('make', args=['-C', '%s/mono' % build_dir, 'install'], name='make install mono')
-    run_command('make', args=['-C', '%s/support' % build_dir, 'install'], name='make install support')
-    run_command('make', args=['-C', '%s/data' % build_dir, 'install'], name='make install data')
+    if is_cross(target):
+        return
 
-    if opts.strip_libs and not is_cross(target):
+    if opts.split_debug:
+        checkpoints = get_checkpoints(opts, product, target, opts.configuration)
+        checkpoints.run('strip', lambda: split_debug(opts, product, target), inputs=['split-debug', opts.symbol_store])
+    elif opts.strip_libs:
         strip_libs(opts, product, target)
 
 
 def clean(opts: iOSOpts, product: str, target: str):
+    clean_checkpoints(opts, product, target, opts.configuration)
+    remove_build_dir(opts, product, target)
     rm_rf(
         path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration)),
         path_join(opts.configure_dir, '%s-%s-%s.config.cache' % (product, target, opts.configuration)),
@@ -476,6 +495,7 @@ def clean(opts: iOSOpts, product: str, target: str):
 
 
 def main(raw_args):
+    import build_trace
     import cmd_utils
     from cmd_utils import custom_bool
     from collections import OrderedDict
@@ -502,7 +522,7 @@ def main(raw_args):
     default_osx_toolchain = '/Applications/Xcode.app/Contents/Developer/Toolchains/XcodeDefault.xctoolchain'
     default_ios_version_min = '10.0' # Same as Godot
 
-    parser.add_argument('action', choices=['configure', 'make', 'clean'])
+    parser.add_argument('action', choices=['configure', 'make', 'clean', 'watch'])
     parser.add_argument('--target', choices=target_values, action='append', required=True)
     parser.add_argument('--ios-toolchain', default=default_ios_toolchain, help=default_help)
     parser.add_argument('--ios-sdk', default='', help=default_help)
@@ -512,6 +532,7 @@ def main(raw_args):
     parser.add_argument('--osx-triple-abi', default='darwin18', help=default_help)
 
     cmd_utils.add_runtime_arguments(parser, default_help)
+    cmd_utils.add_watch_arguments(parser, default_help)
 
     args = parser.parse_args(raw_args)
 
@@ -520,21 +541,32 @@ def main(raw_args):
 
     opts = ios_opts_from_args(args)
 
+    cmd_utils.init_build_session(opts)
+
     targets = cmd_utils.expand_input_targets(input_targets, target_shortcuts)
 
     if not os.path.isdir(opts.mono_source_root):
         print('Mono sources directory not found: ' + opts.mono_source_root)
         sys.exit(1)
 
-    action = actions[input_action]
-
     try:
+        if input_action == 'watch':
+            import watch
+            watch.watch_targets(opts, 'ios', targets, debounce=args.watch_debounce,
+                    poll_interval=args.watch_poll_interval, force_polling=args.watch_polling)
+            return
+
+        action = actions[input_action]
+
         for target in targets:
-            action(opts, 'ios', target)
+            with build_trace.target_span(input_action, product='ios', target=target, configuration=opts.configuration):
+                action(opts, 'ios', target)
     except BuildError as e:
         sys.exit(e.message)
 
 
 if __name__ == '__main__':
     from sys import argv
-    main(argv[1:])
+    from metrics_db import recording_exit_status
+    with recording_exit_status():
+        main(argv[1:])
@@ -5,4 +5,6 @@ from desktop import run_main
 
 if __name__ == '__main__':
     from sys import argv
-    run_main(argv[1:], target_platform='linux')
+    from metrics_db import recording_exit_status
+    with recording_exit_status():
+        run_main(argv[1:], target_platform='linux')
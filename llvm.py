@@ -22,6 +22,9 @@ def make(opts: BaseOpts, target: str):
     stamp_file = path_join(opts.configure_dir, '.stamp-%s-make' % target)
 
     if os.path.isfile(stamp_file):
+        if opts.time_trace:
+            from clang_time_trace import warn
+            warn('LLVM \'%s\' is already built, so \'--time-trace\' has no effect on it. Run \'clean\' first to build it with time traces.' % target)
         return
 
     build_dir = path_join(opts.configure_dir, 'llvm-%s' % target)
@@ -64,6 +67,17 @@ def make(opts: BaseOpts, target: str):
     if target in ['llvm32', 'llvmwin32']:
         CMAKE_ARGS += ['-DLLVM_BUILD_32_BITS=On']
 
+    if opts.time_trace:
+        from clang_time_trace import get_time_trace_flags, warn
+        if target in mxe_targets:
+            warn('\'--time-trace\' requires clang, but \'%s\' is built with MXE. It will be built without it.' % target)
+        else:
+            # Setting CMAKE_<LANG>_FLAGS replaces the CFLAGS and CXXFLAGS that CMake would initialize them with
+            for lang, flags_var, compiler_var, default_compiler in [('C', 'CFLAGS', 'CC', 'cc'), ('CXX', 'CXXFLAGS', 'CXX', 'c++')]:
+                TIME_TRACE_FLAGS = get_time_trace_flags(os.environ.get(compiler_var, default_compiler), 'llvm-%s (%s)' % (target, lang.replace('X', '+')))
+                if TIME_TRACE_FLAGS:
+                    CMAKE_ARGS += ['-DCMAKE_%s_FLAGS="%s"' % (lang, ' '.join(os.environ.get(flags_var, '').split() + TIME_TRACE_FLAGS))]
+
     CMAKE_ARGS += [os.environ.get('llvm-%s_CMAKE_ARGS' % target, '')]
 
     # IMPORTANT: We must specify the jobs count for this Makefile.
@@ -83,7 +97,12 @@ def make(opts: BaseOpts, target: str):
     if not find_executable('cmake') and not 'CMAKE' in os.environ:
         print('WARNING: Cannot find CMake. Required by the llvm Makefile.')
 
-    run_command('make', args=make_args, name='make')
+    # Retry on failure. The process limit errors mentioned above can still happen with high job counts.
+    retry_call(lambda: run_command('make', args=make_args, name='make'), retries=opts.retries, delay=opts.retry_delay, name='make llvm')
+
+    if opts.time_trace:
+        from clang_time_trace import report_time_trace
+        report_time_trace(opts, 'llvm-%s' % target, build_dir)
 
     touch(stamp_file)
 
@@ -107,6 +126,7 @@ def clean(opts: BaseOpts, target: str):
 
 
 def main(raw_args):
+    import build_trace
     import cmd_utils
 
     parser = cmd_utils.build_arg_parser(description='Builds LLVM for Mono')
@@ -121,16 +141,21 @@ def main(raw_args):
     args = parser.parse_args(raw_args)
 
     opts = base_opts_from_args(args)
+
+    cmd_utils.init_build_session(opts)
     targets = args.target
 
     try:
         for target in targets:
             action = { 'make': make, 'clean': clean }[args.action]
-            action(opts, target)
+            with build_trace.target_span(args.action, product='llvm', target=target):
+                action(opts, target)
     except BuildError as e:
         sys.exit(e.message)
 
 
 if __name__ == '__main__':
     from sys import argv
-    main(argv[1:])
+    from metrics_db import recording_exit_status
+    with recording_exit_status():
+        main(argv[1:])
@@ -0,0 +1,170 @@
+import gzip
+import json
+import os.path
+import re
+import threading
+import time
+
+from collections import deque
+from os.path import join as path_join
+
+
+# With '--capture-logs' (implied by '--progress'), the output of every command run with 'run_command' is written
+# to its own gzip-compressed log: '<log_dir>/<product>-<target>-<configuration>/<NNN>-<step>.log.gz'. Only the
+# last lines are kept in memory. When a command fails, those lines and the first compiler error found in the
+# output are printed. '<log_dir>/index.json' maps every step to its log.
+#
+# Separate script invocations (e.g.: 'configure' and then 'make') share the log directory. The numbers continue
+# from the ones in the index, the logs are created exclusively (so concurrent invocations skip the numbers taken
+# by each other) and every invocation adds its steps to the index when it exits.
+
+# Longer lines (e.g.: compiler command lines with 'V=1') are truncated in the ring buffer, not in the log
+MAX_LINE_LENGTH = 4096
+
+ERROR_RE = re.compile(rb'(^|: |\) ?: )(fatal )?error( [A-Z]+[0-9]+)?: |undefined reference to |Undefined symbols for architecture |^ld: .* not found', re.IGNORECASE)
+MAKE_ERROR_RE = re.compile(rb'^g?make(\[[0-9]+\])?: \*\*\* ')
+
+
+class StepLog:
+    def __init__(self, path: str, tail_lines: int):
+        self.path = path
+        # Raises FileExistsError if the log was created by another invocation
+        self.file = gzip.open(path, 'xb', compresslevel=6)
+        self.tail = deque(maxlen=tail_lines)
+        self.first_error = None
+        self.first_make_error = None
+        self.size = 0
+
+    def write(self, line: bytes):
+        self.file.write(line)
+        self.size += len(line)
+        if self.first_error is None and ERROR_RE.search(line):
+            self.first_error = line[:MAX_LINE_LENGTH]
+        elif self.first_make_error is None and MAKE_ERROR_RE.search(line):
+            self.first_make_error = line[:MAX_LINE_LENGTH]
+        self.tail.append(line[:MAX_LINE_LENGTH])
+
+    def close(self):
+        self.file.close()
+
+    def get_first_error(self) -> str:
+        # The errors of the compiler are more useful than the one of make that follows them
+        line = self.first_error or self.first_make_error
+        return line.decode(errors='replace').rstrip() if line is not None else ''
+
+    def get_tail(self) -> list:
+        return [line.decode(errors='replace').rstrip('\r\n') for line in self.tail]
+
+
+class LogCapture:
+    def __init__(self, log_dir: str, tail_lines: int):
+        self.log_dir = log_dir
+        self.tail_lines = tail_lines
+        self.lock = threading.Lock()
+        self.count = max([get_log_number(entry) for entry in load_index(log_dir)], default=0)
+        self.index = []
+
+    def open_step(self, name: str, args: list, context: dict) -> StepLog:
+        from os_utils import mkdir_p
+
+        target_dir = '-'.join(context[key] for key in ['product', 'target', 'configuration'] if context.get(key)) or 'session'
+
+        dirpath = path_join(self.log_dir, target_dir)
+        mkdir_p(dirpath)
+
+        step_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+        while True:
+            with self.lock:
+                self.count += 1
+                number = self.count
+            try:
+                step_log = StepLog(path_join(dirpath, '%03d-%s.log.gz' % (number, step_name)), self.tail_lines)
+                break
+            except FileExistsError:
+                continue
+
+        import subprocess
+        # Not scanned for errors, as the command line may contain anything
+        step_log.file.write(('$ %s\n' % subprocess.list2cmdline(args)).encode())
+
+        step_log.entry = dict(context, name=name, command=subprocess.list2cmdline(args), log=step_log.path, started=time.time())
+        with self.lock:
+            self.index.append(step_log.entry)
+
+        return step_log
+
+    def close_step(self, step_log: StepLog, exit_code: int):
+        step_log.close()
+        step_log.entry.update(exit_code=exit_code, wall_time=time.time() - step_log.entry['started'],
+            output_bytes=step_log.size, first_error=step_log.get_first_error())
+
+    def save_index(self):
+        '''Adds the steps of this invocation to the index, locked against other invocations'''
+        import fcntl
+        from os_utils import write_file_if_changed
+
+        with self.lock:
+            index = list(self.index)
+        if not index:
+            return
+
+        with open(path_join(self.log_dir, '.index.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            index = load_index(self.log_dir) + index
+            write_file_if_changed(path_join(self.log_dir, 'index.json'), json.dumps(index, indent=4))
+
+
+def load_index(log_dir: str) -> list:
+    index_path = path_join(log_dir, 'index.json')
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        return index if isinstance(index, list) else []
+    except (OSError, ValueError):
+        return []
+
+
+def get_log_number(entry: dict) -> int:
+    match = re.match(r'^([0-9]+)-', os.path.basename(entry.get('log', '')))
+    return int(match.group(1)) if match else 0
+
+
+capture = None
+
+
+def start_capture(log_dir: str, tail_lines: int):
+    '''Captures the output of the commands from now on. The index is written when the process exits.'''
+    import atexit
+    from os_utils import mkdir_p
+
+    global capture
+    if capture is not None:
+        return
+
+    mkdir_p(log_dir)
+    capture = LogCapture(log_dir, tail_lines)
+    atexit.register(capture.save_index)
+
+
+def open_step(name: str, args: list):
+    '''Returns the log the command output should be written to, or None if the output is not captured'''
+    from build_trace import context_args
+    if capture is None:
+        return None
+    return capture.open_step(name, args, context_args.get())
+
+
+def close_step(step_log: StepLog, exit_code: int):
+    capture.close_step(step_log, exit_code)
+
+
+def get_failure_report(name: str, step_log: StepLog) -> str:
+    lines = ['FAILED: \'%s\'. Log: %s' % (name, step_log.path)]
+    first_error = step_log.get_first_error()
+    if first_error:
+        lines += ['First error:', '    ' + first_error]
+    if step_log.tail:
+        lines += ['Last %s lines:' % len(step_log.tail)]
+        lines += ['    ' + line for line in step_log.get_tail()]
+    return '\n'.join(lines)
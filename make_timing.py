@@ -0,0 +1,221 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+# With '--make-timing', the runtime builds run make with 'MAKE=<shim>', so every recursive make (including the
+# ones started by nested builds like BTLS, through MAKEFLAGS) goes through this script, which records its
+# directory and wall time. With '--make-timing-compilers', 'CC' and 'CXX' are also prefixed with a shim, which
+# records every compile and link. The records of each target are written to
+# '<configure_dir>/make-timing/<product>-<target>-<configuration>/records.jsonl' and a per-directory and
+# per-file breakdown is printed and written to 'report.json' next to them after make.
+#
+# The shim is started for every compiler invocation, so it must stay cheap to import.
+
+source_exts = ['.c', '.cc', '.cpp', '.cxx', '.m', '.mm', '.s', '.S', '.asm']
+
+
+def get_make_dir(cwd: str, args: list) -> str:
+    directory = cwd
+    for i, arg in enumerate(args):
+        if arg == '-C' and i + 1 < len(args):
+            directory = os.path.join(directory, args[i + 1])
+        elif arg.startswith('-C') and len(arg) > 2:
+            directory = os.path.join(directory, arg[2:])
+        elif arg.startswith('--directory='):
+            directory = os.path.join(directory, arg[len('--directory='):])
+    return os.path.normpath(directory)
+
+
+def get_compiler_file(cwd: str, args: list) -> str:
+    '''The source file compiled, or the output if linking'''
+    sources = [arg for arg in args[1:] if os.path.splitext(arg)[1] in source_exts and not arg.startswith('-')]
+    if '-c' in args and sources:
+        return os.path.normpath(os.path.join(cwd, sources[-1]))
+    if '-o' in args and args.index('-o') + 1 < len(args):
+        return os.path.normpath(os.path.join(cwd, args[args.index('-o') + 1]))
+    return ''
+
+
+def record(records_file: str, kind: str, args: list) -> int:
+    '''Runs the command and appends its timing to the records'''
+    cwd = os.getcwd()
+    start = time.time()
+    try:
+        # The file descriptors of the make jobserver must be inherited by the command
+        exit_code = subprocess.call(args, close_fds=False)
+    except OSError as e:
+        sys.stderr.write('%s: %s\n' % (args[0], e))
+        exit_code = 127
+    end = time.time()
+
+    entry = { 'kind': kind, 'cwd': cwd, 'start': start, 'end': end, 'exit_code': exit_code }
+    if kind == 'make':
+        entry['dir'] = get_make_dir(cwd, args[1:])
+    else:
+        entry['file'] = get_compiler_file(cwd, args)
+
+    # A single write with O_APPEND, so concurrent shims don't interleave their records
+    fd = os.open(records_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(entry) + '\n').encode())
+    finally:
+        os.close(fd)
+
+    return exit_code
+
+
+def get_timing_dir(opts, product: str, target: str) -> str:
+    return os.path.join(opts.configure_dir, 'make-timing', '%s-%s-%s' % (product, target, opts.configuration))
+
+
+def get_makefile_var(makefile: str, name: str) -> str:
+    if not os.path.isfile(makefile):
+        return ''
+    with open(makefile, 'r', errors='replace') as f:
+        for line in f:
+            if line.startswith(name + ' = '):
+                return line[len(name) + 3:].strip()
+    return ''
+
+
+def write_shim(path: str, records_file: str, kind: str, command: list):
+    from os_utils import chmod_plus_x, write_file_if_changed
+    import shlex
+    args = [sys.executable, os.path.abspath(__file__), 'record', records_file, kind] + command
+    write_file_if_changed(path, '#!/bin/sh\nexec %s "$@"\n' % ' '.join(shlex.quote(arg) for arg in args))
+    chmod_plus_x(path)
+
+
+def start_make_timing(opts, product: str, target: str, build_dir: str) -> list:
+    '''Clears the previous records of the target. Returns the arguments to add to the make command line.'''
+    from os_utils import BuildError, find_executable, mkdir_p, rm_rf
+
+    if not opts.make_timing and not opts.make_timing_compilers:
+        return []
+
+    timing_dir = get_timing_dir(opts, product, target)
+    records_file = os.path.join(timing_dir, 'records.jsonl')
+
+    mkdir_p(os.path.join(timing_dir, 'bin'))
+    rm_rf(records_file)
+
+    real_make = find_executable('make')
+    if not real_make:
+        raise BuildError('Cannot find make')
+
+    make_shim = os.path.join(timing_dir, 'bin', 'make')
+    write_shim(make_shim, records_file, 'make', [real_make])
+    make_args = ['MAKE=' + make_shim]
+
+    if opts.make_timing_compilers:
+        # Prefix the compilers found by configure, keeping their flags
+        for var, kind in [('CC', 'cc'), ('CXX', 'cxx')]:
+            value = get_makefile_var(os.path.join(build_dir, 'Makefile'), var)
+            if not value:
+                print('WARNING: Could not find %s in the Makefile. Its invocations will not be timed.' % var)
+                continue
+            shim = os.path.join(timing_dir, 'bin', kind)
+            write_shim(shim, records_file, kind, [])
+            make_args += ['%s=%s %s' % (var, shim, value)]
+
+    return make_args
+
+
+def load_records(records_file: str) -> list:
+    records = []
+    with open(records_file, 'r') as f:
+        for line in f:
+            try:
+                records += [json.loads(line)]
+            except ValueError:
+                pass # Truncated if the build was interrupted
+    return records
+
+
+def get_union_time(intervals: list) -> float:
+    total = 0
+    current_start, current_end = None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            total += current_end - current_start if current_end is not None else 0
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    return total + (current_end - current_start if current_end is not None else 0)
+
+
+def is_subdir(path: str, parent: str) -> bool:
+    return path.startswith(parent.rstrip('/') + '/')
+
+
+def get_breakdown(records: list, build_dir: str) -> tuple:
+    '''
+    Per-directory and per-file costs. The inclusive time of a directory is the wall time of its makes, including
+    the makes of its subdirectories. The exclusive time excludes the time those subdirectory makes were running.
+    '''
+    def relative(path):
+        return os.path.relpath(path, build_dir) if path == build_dir or is_subdir(path, build_dir) else path
+
+    makes = [r for r in records if r['kind'] == 'make']
+    compiles = [r for r in records if r['kind'] != 'make']
+
+    def is_nested(inner, outer):
+        return outer is not inner and outer['start'] <= inner['start'] and inner['end'] <= outer['end']
+
+    # Makefiles re-run make in their own directory (e.g.: automake's 'all-am'). Only count the outermost one.
+    makes = [make for make in makes if not any(other['dir'] == make['dir'] and is_nested(make, other) for other in makes)]
+
+    directories = {}
+    for make in makes:
+        children = [(other['start'], other['end']) for other in makes
+            if is_subdir(other['dir'], make['dir']) and is_nested(other, make)]
+        entry = directories.setdefault(relative(make['dir']), { 'makes': 0, 'inclusive': 0, 'exclusive': 0, 'compiles': 0, 'compile_time': 0 })
+        entry['makes'] += 1
+        entry['inclusive'] += make['end'] - make['start']
+        entry['exclusive'] += make['end'] - make['start'] - get_union_time(children)
+
+    files = []
+    for compile in compiles:
+        entry = directories.setdefault(relative(compile['cwd']), { 'makes': 0, 'inclusive': 0, 'exclusive': 0, 'compiles': 0, 'compile_time': 0 })
+        entry['compiles'] += 1
+        entry['compile_time'] += compile['end'] - compile['start']
+        files += [{ 'file': relative(compile['file']) if compile['file'] else '', 'kind': compile['kind'],
+            'time': compile['end'] - compile['start'], 'exit_code': compile['exit_code'] }]
+
+    files.sort(key=lambda f: -f['time'])
+    return directories, files
+
+
+def report_make_timing(opts, product: str, target: str, build_dir: str, top: int=20):
+    from os_utils import write_file_if_changed
+
+    timing_dir = get_timing_dir(opts, product, target)
+    records_file = os.path.join(timing_dir, 'records.jsonl')
+
+    if not os.path.isfile(records_file):
+        print('No make timing records for %s-%s-%s' % (product, target, opts.configuration))
+        return
+
+    directories, files = get_breakdown(load_records(records_file), build_dir)
+
+    print('Make timing of %s-%s-%s (exclusive: without the time of nested subdirectory makes):' % (product, target, opts.configuration))
+    print('  %10s  %10s  %8s  %10s  %s' % ('inclusive', 'exclusive', 'compiles', 'compile s', 'directory'))
+    for directory, entry in sorted(directories.items(), key=lambda item: -item[1]['exclusive']):
+        print('  %10.1f  %10.1f  %8s  %10.1f  %s' % (entry['inclusive'], entry['exclusive'], entry['compiles'], entry['compile_time'], directory))
+
+    if files:
+        print('Slowest compiler invocations:')
+        for f in files[:top]:
+            print('  %8.1fs  %s%s' % (f['time'], f['file'] or '(%s)' % f['kind'], ' (failed)' if f['exit_code'] != 0 else ''))
+
+    write_file_if_changed(os.path.join(timing_dir, 'report.json'), json.dumps({ 'directories': directories, 'files': files }, indent=4))
+
+
+if __name__ == '__main__':
+    # Shim mode: make_timing.py record <records_file> <kind> <command> [args...]
+    if len(sys.argv) < 5 or sys.argv[1] != 'record':
+        sys.exit('usage: make_timing.py record <records_file> <make|cc|cxx> <command> [args...]')
+    sys.exit(record(sys.argv[2], sys.argv[3], sys.argv[4:]))
@@ -0,0 +1,248 @@
+import json
+import os
+import os.path
+import shutil
+import time
+
+from contextlib import contextmanager
+from os.path import join as path_join
+
+from options import RuntimeOpts
+from os_utils import *
+
+
+# With '--build-in-memory', the build directory '<configure_dir>/<name>' is a symlink to
+# '<memory_dir>/<name>'. Commands run in it get the symlink path as PWD, so configure records
+# paths through the symlink. Make and the tools it runs (e.g.: CMake for BoringSSL) resolve the
+# symlink though, and record paths into memory. When a build directory is moved back to disk
+# (spilled) by replacing the symlink with the directory, those paths no longer exist. So spilling
+# invalidates the checkpoints of the target from 'configure' on, and marks the build directory
+# (SPILLED_MARKER) so it can't be built until it's configured again. '<memory_dir>/usage.json'
+# records the build directories in memory and when they were last used, to spill the least
+# recently used ones first.
+#
+# A build directory only grows after it's placed, so whether it fits is decided with its size after its last
+# build, recorded in '<configure_dir>/.memory-build-sizes.json' (on disk, so it survives a cleared tmpfs). For a
+# target that was never built, the largest recorded size of the same product is used. If nothing is known, the
+# build directory stays on disk.
+
+SPILLED_MARKER = '.spilled-from-memory'
+
+
+def get_memory_build_dir(opts: RuntimeOpts, name: str) -> str:
+    return path_join(opts.memory_dir, name)
+
+
+def get_dir_size(dirpath: str) -> int:
+    size = 0
+    for root, dirnames, filenames in os.walk(dirpath):
+        for filename in filenames:
+            try:
+                size += os.lstat(path_join(root, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def locked_usage(opts: RuntimeOpts):
+    '''Yields the usage records of the memory directory, locked against other build processes, and saves them afterwards'''
+    import fcntl
+
+    mkdir_p(opts.memory_dir)
+    usage_file = path_join(opts.memory_dir, 'usage.json')
+
+    with open(path_join(opts.memory_dir, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        usage = {}
+        if os.path.isfile(usage_file):
+            with open(usage_file, 'r') as f:
+                usage = json.load(f)
+        # Forget the directories that were removed or spilled by other means (e.g.: 'clean')
+        usage = { name: record for name, record in usage.items() if os.path.isdir(get_memory_build_dir(opts, name)) }
+        yield usage
+        write_file_if_changed(usage_file, json.dumps(usage, indent=4, sort_keys=True))
+
+
+def get_known_sizes_file(opts: RuntimeOpts) -> str:
+    return path_join(opts.configure_dir, '.memory-build-sizes.json')
+
+
+def load_known_sizes(opts: RuntimeOpts) -> dict:
+    sizes_file = get_known_sizes_file(opts)
+    if not os.path.isfile(sizes_file):
+        return {}
+    with open(sizes_file, 'r') as f:
+        return json.load(f)
+
+
+def record_known_size(opts: RuntimeOpts, product: str, name: str, size: int):
+    '''Must be called with the usage locked'''
+    sizes = load_known_sizes(opts)
+    sizes[name] = { 'product': product, 'size': size }
+    mkdir_p(opts.configure_dir)
+    write_file_if_changed(get_known_sizes_file(opts), json.dumps(sizes, indent=4, sort_keys=True))
+
+
+def estimate_size(opts: RuntimeOpts, product: str, name: str) -> int:
+    '''The expected size of the build directory after make, or None if unknown'''
+    sizes = load_known_sizes(opts)
+    if name in sizes:
+        return sizes[name]['size']
+    product_sizes = [record['size'] for record in sizes.values() if record['product'] == product]
+    return max(product_sizes) if product_sizes else None
+
+
+def is_in_memory(opts: RuntimeOpts, name: str, link_path: str) -> bool:
+    return os.path.islink(link_path) and os.path.realpath(link_path) == os.path.realpath(get_memory_build_dir(opts, name))
+
+
+def spill(opts: RuntimeOpts, usage: dict, name: str):
+    link_path = usage[name]['link']
+    memory_build_dir = get_memory_build_dir(opts, name)
+
+    if is_in_memory(opts, name, link_path):
+        print('Spilling build directory to disk: %s' % link_path)
+        tmp_path = link_path + '.spill-tmp'
+        rm_rf(tmp_path)
+        # copy2 preserves the mtimes, so make doesn't rebuild anything
+        shutil.copytree(memory_build_dir, tmp_path, symlinks=True)
+        os.remove(link_path)
+        os.rename(tmp_path, link_path)
+
+        from checkpoint import get_checkpoints_by_name
+        get_checkpoints_by_name(opts, name).invalidate_from('configure')
+        with open(path_join(link_path, SPILLED_MARKER), 'w'):
+            pass
+        print('The spilled build directory must be configured again: %s' % link_path)
+
+    rm_rf(memory_build_dir)
+    del usage[name]
+
+
+def enforce_budget(opts: RuntimeOpts, usage: dict, extra_bytes: int=0, keep: str='') -> bool:
+    '''
+    Spills the least recently used build directories until the ones in memory, plus 'extra_bytes',
+    fit in the budget. Directories used by other running builds and 'keep' are not spilled.
+    Returns whether the budget is met.
+    '''
+    budget = opts.memory_budget * 1024 * 1024
+
+    for name, record in usage.items():
+        record['size'] = get_dir_size(get_memory_build_dir(opts, name))
+
+    total = extra_bytes + sum(record['size'] for record in usage.values())
+
+    for name in sorted(usage, key=lambda name: usage[name]['last_used']):
+        if total <= budget:
+            break
+        record = usage[name]
+        if name == keep or (record['pid'] and record['pid'] != os.getpid() and is_process_alive(record['pid'])):
+            continue
+        total -= record['size']
+        spill(opts, usage, name)
+
+    return total <= budget
+
+
+def prepare_build_dir(opts: RuntimeOpts, product: str, target: str, configure: bool=False):
+    '''
+    Places the build directory in memory if '--build-in-memory' is enabled and it fits in the budget.
+    Must be called before using the build directory, with 'configure' if it's to configure it. Removes
+    the symlink to a build directory that no longer exists in memory (e.g.: tmpfs cleared by a reboot),
+    so it's configured again on disk. Raises if the build directory was spilled and not configured again.
+    '''
+    name = '%s-%s-%s' % (product, target, opts.configuration)
+    link_path = path_join(opts.configure_dir, name)
+
+    if os.path.islink(link_path) and not os.path.exists(link_path):
+        print('Build directory no longer exists in memory: %s' % link_path)
+        os.remove(link_path)
+
+    spilled_marker = path_join(link_path, SPILLED_MARKER)
+    if os.path.isfile(spilled_marker):
+        if not configure:
+            raise BuildError('The build directory was moved from memory to disk and must be configured again: ' + link_path)
+        os.remove(spilled_marker)
+
+    if not opts.build_in_memory:
+        return
+
+    with locked_usage(opts) as usage:
+        memory_build_dir = get_memory_build_dir(opts, name)
+
+        if is_in_memory(opts, name, link_path):
+            usage[name] = { 'link': link_path, 'last_used': time.time(), 'pid': os.getpid(), 'size': usage.get(name, {}).get('size', 0) }
+            return
+
+        on_disk = os.path.isdir(link_path)
+        size = get_dir_size(link_path) if on_disk else 0
+
+        estimated_size = estimate_size(opts, product, name)
+        if estimated_size is None:
+            print('Size of the build directory unknown until it is built once; keeping it on disk: %s' % link_path)
+            return
+
+        if not enforce_budget(opts, usage, extra_bytes=max(size, estimated_size), keep=name):
+            print('Build directory does not fit in the memory budget; keeping it on disk: %s' % link_path)
+            return
+
+        rm_rf(memory_build_dir)
+
+        if on_disk:
+            print('Moving build directory to memory: %s -> %s' % (link_path, memory_build_dir))
+            tmp_path = memory_build_dir + '.tmp'
+            rm_rf(tmp_path)
+            shutil.copytree(link_path, tmp_path, symlinks=True)
+            os.rename(tmp_path, memory_build_dir)
+        else:
+            mkdir_p(memory_build_dir)
+
+        mkdir_p(opts.configure_dir)
+        tmp_link_path = link_path + '.link-tmp'
+        if os.path.lexists(tmp_link_path):
+            os.remove(tmp_link_path)
+        os.symlink(memory_build_dir, tmp_link_path)
+        rm_rf(link_path)
+        os.rename(tmp_link_path, link_path)
+
+        usage[name] = { 'link': link_path, 'last_used': time.time(), 'pid': os.getpid(), 'size': size }
+
+
+def release_build_dir(opts: RuntimeOpts, product: str, target: str):
+    '''Called when done with the build directory. Spills build directories if the budget was exceeded.'''
+    if not opts.build_in_memory:
+        return
+
+    name = '%s-%s-%s' % (product, target, opts.configuration)
+    link_path = path_join(opts.configure_dir, name)
+
+    with locked_usage(opts) as usage:
+        # Also recorded when the build directory was kept on disk, so it can be placed in memory next time
+        if os.path.isdir(link_path):
+            record_known_size(opts, product, name, get_dir_size(link_path))
+
+        if name in usage:
+            usage[name]['last_used'] = time.time()
+            usage[name]['pid'] = 0
+        if not enforce_budget(opts, usage):
+            print('WARNING: The build directories in memory exceed the memory budget')
+
+
+def remove_build_dir(opts: RuntimeOpts, product: str, target: str):
+    '''Removes the memory copy of the build directory, if any. The symlink must be removed by the caller.'''
+    name = '%s-%s-%s' % (product, target, opts.configuration)
+    link_path = path_join(opts.configure_dir, name)
+
+    if is_in_memory(opts, name, link_path):
+        rm_rf(get_memory_build_dir(opts, name))
@@ -0,0 +1,146 @@
+import os
+import os.path
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# SQLite database of the build metrics of every run, enabled with '--metrics-db':
+#   runs: one row per script invocation, with the Mono and script revisions and the host
+#   steps: the wall time and resource usage of every command (see resource_usage.py)
+#   artifacts: the size of the files produced for each target (e.g.: the installed libraries)
+# 'report.py' compares the latest run with the previous ones to find regressions.
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    finished REAL NOT NULL,
+    script TEXT NOT NULL,
+    argv TEXT NOT NULL,
+    mono_revision TEXT NOT NULL,
+    script_revision TEXT NOT NULL,
+    host TEXT NOT NULL,
+    jobs TEXT NOT NULL,
+    success INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    product TEXT NOT NULL,
+    target TEXT NOT NULL,
+    configuration TEXT NOT NULL,
+    name TEXT NOT NULL,
+    wall_time REAL NOT NULL,
+    user_time REAL,
+    system_time REAL,
+    max_rss_kib INTEGER,
+    in_blocks INTEGER,
+    out_blocks INTEGER,
+    exit_code INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    product TEXT NOT NULL,
+    target TEXT NOT NULL,
+    configuration TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS steps_run_id ON steps(run_id);
+CREATE INDEX IF NOT EXISTS artifacts_run_id ON artifacts(run_id);
+'''
+
+artifacts = []
+artifacts_lock = threading.Lock()
+
+
+def record_artifact(product: str, target: str, configuration: str, path: str, size: int):
+    with artifacts_lock:
+        artifacts.append({ 'product': product, 'target': target, 'configuration': configuration, 'path': path, 'size': size })
+
+
+def get_git_revision(path: str) -> str:
+    '''The HEAD revision, with a '-dirty' suffix if there are uncommitted changes. Empty if not a git repository.'''
+    import subprocess
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) != 0
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return revision + ('-dirty' if dirty else '')
+
+
+def get_host() -> str:
+    import platform
+    return '%s-%s' % (platform.node(), platform.machine())
+
+
+def connect(db_path: str):
+    import sqlite3
+    db = sqlite3.connect(db_path, timeout=60)
+    db.executescript(schema)
+    return db
+
+
+def save_run(db_path: str, started: float, mono_source_root: str, jobs: str):
+    import json
+    import resource_usage
+
+    with resource_usage.steps_lock:
+        steps = list(resource_usage.steps)
+    with artifacts_lock:
+        run_artifacts = list(artifacts)
+
+    if not steps and not run_artifacts:
+        return
+
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+
+    db = connect(db_path)
+    with db:
+        cursor = db.execute('INSERT INTO runs (started, finished, script, argv, mono_revision, script_revision, host, jobs, success) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            started, time.time(), os.path.basename(sys.argv[0]), json.dumps(sys.argv[1:]),
+            get_git_revision(mono_source_root), get_git_revision(script_dir), get_host(), jobs,
+            int(exit_status['success'])
+        ))
+        run_id = cursor.lastrowid
+
+        db.executemany('INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [(
+            run_id, step.get('product', ''), step.get('target', ''), step.get('configuration', ''), step['name'], step['wall_time'],
+            step.get('user_time'), step.get('system_time'), step.get('max_rss_kib'), step.get('in_blocks'), step.get('out_blocks'), step['exit_code']
+        ) for step in steps])
+
+        db.executemany('INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?)', [(
+            run_id, artifact['product'], artifact['target'], artifact['configuration'], artifact['path'], artifact['size']
+        ) for artifact in run_artifacts])
+    db.close()
+
+    print('Build metrics saved to: %s (run %s)' % (db_path, run_id))
+
+
+# Whether the script succeeded. The exit codes of the steps aren't enough: a step may fail and then pass
+# with '--retries', and a script may fail without any failed command. The scripts run their main function
+# in 'recording_exit_status', which sees both 'sys.exit' and uncaught exceptions.
+exit_status = { 'success': True }
+
+
+@contextmanager
+def recording_exit_status():
+    try:
+        yield
+    except SystemExit as e:
+        if e.code is not None and e.code != 0:
+            exit_status['success'] = False
+        raise
+    except BaseException:
+        exit_status['success'] = False
+        raise
+
+
+def start_recording(db_path: str, mono_source_root: str, jobs: str):
+    '''Saves the metrics of this run to the database when the process exits'''
+    import atexit
+    started = time.time()
+    atexit.register(lambda: save_run(db_path, started, mono_source_root, jobs))
@@ -11,6 +11,18 @@ class BaseOpts:
     install_dir: str
     mono_source_root: str
     mxe_prefix: str
+    resume: bool
+    retries: int
+    retry_delay: float
+    link_mode: str
+    trace_file: str
+    resource_report: str
+    metrics_db: str
+    time_trace: bool
+    progress: bool
+    log_dir: str
+    capture_logs: bool
+    log_tail: int
 
 
 @dataclass
@@ -19,6 +31,18 @@ class RuntimeOpts(BaseOpts):
     release: bool
     enable_cxx: bool
     strip_libs: bool
+    minimal_build: bool
+    split_debug: bool
+    symbol_store: str
+    debug_level: str
+    split_dwarf: bool
+    compress_debug_sections: bool
+    build_in_memory: bool
+    memory_dir: str
+    memory_budget: int
+    make_timing: bool
+    make_timing_compilers: bool
+    size_baseline: str
 
 
 @dataclass
@@ -49,20 +73,33 @@ class DesktopOpts(RuntimeOpts):
 class BclOpts(BaseOpts):
     tests: bool
     remove_pdb: bool
+    exclude: list
 
 
 # Need to make paths absolute as we change cwd
 
 
 def base_opts_from_args(args):
-    from os.path import abspath
+    from os.path import abspath, join as path_join
     return BaseOpts(
         verbose_make = args.verbose_make,
         jobs = args.jobs,
         configure_dir = abspath(args.configure_dir),
         install_dir = abspath(args.install_dir),
         mono_source_root = abspath(args.mono_sources),
-        mxe_prefix = args.mxe_prefix
+        mxe_prefix = args.mxe_prefix,
+        resume = args.resume,
+        retries = args.retries,
+        retry_delay = args.retry_delay,
+        link_mode = args.link_mode,
+        trace_file = abspath(args.trace_file) if args.trace_file else '',
+        resource_report = abspath(args.resource_report) if args.resource_report else '',
+        metrics_db = abspath(args.metrics_db) if args.metrics_db else '',
+        time_trace = args.time_trace,
+        progress = args.progress,
+        log_dir = abspath(args.log_dir) if args.log_dir else path_join(abspath(args.configure_dir), 'logs'),
+        capture_logs = args.capture_logs or args.progress,
+        log_tail = args.log_tail
     )
 
 
@@ -72,7 +109,19 @@ def runtime_opts_from_args(args):
         configuration = args.configuration,
         release = (args.configuration == 'release'),
         enable_cxx = args.enable_cxx,
-        strip_libs = args.strip_libs
+        strip_libs = args.strip_libs,
+        minimal_build = args.minimal_build,
+        split_debug = args.split_debug,
+        symbol_store = abspath(args.symbol_store) if args.symbol_store else '',
+        debug_level = args.debug_level,
+        split_dwarf = args.split_dwarf,
+        compress_debug_sections = args.compress_debug_sections,
+        build_in_memory = args.build_in_memory,
+        memory_dir = abspath(args.memory_dir),
+        memory_budget = args.memory_budget,
+        make_timing = args.make_timing,
+        make_timing_compilers = args.make_timing_compilers,
+        size_baseline = abspath(args.size_baseline) if args.size_baseline else ''
     )
 
 
@@ -102,7 +151,8 @@ def bcl_opts_from_args(args):
     return BclOpts(
         **vars(base_opts_from_args(args)),
         tests = args.tests,
-        remove_pdb = args.remove_pdb
+        remove_pdb = args.remove_pdb,
+        exclude = args.exclude
     )
 
 
@@ -21,18 +21,75 @@ def run_command(command, args=[], cwd=None, env=None, name='command'):
     check_call_args = {}
     if cwd is not None:
         check_call_args['cwd'] = cwd
+        # Keep the logical path (e.g.: through a symlink) for the shell's 'pwd', as configure uses it
+        env = dict(env if env is not None else os.environ)
+        env['PWD'] = os.path.abspath(cwd)
     if env is not None:
         check_call_args['env'] = env
 
     import subprocess
+    import time
+    import log_capture
+    import resource_usage
+    from build_trace import context_args, span
+
     try:
         print('Running command \'%s\': %s' % (name, subprocess.list2cmdline(args)))
-        subprocess.check_call(args, **check_call_args)
+        with span(name, cat='command', command=subprocess.list2cmdline(args), cwd=cwd or os.getcwd()) as span_args:
+            # With '--capture-logs' the output goes to the log of the step
+            step_log = log_capture.open_step(name, args)
+            start = time.time()
+            exit_code = -1
+            try:
+                exit_code, usage = resource_usage.call(args, output=step_log.write if step_log else None, **check_call_args)
+            finally:
+                if step_log is not None:
+                    log_capture.close_step(step_log, exit_code)
+            resource_usage.record_step(name, context_args.get(), time.time() - start, exit_code, usage)
+            span_args.update(usage or {})
+            if step_log is not None:
+                span_args['log'] = step_log.path
+            if exit_code != 0:
+                if step_log is not None:
+                    import progress
+                    progress.print_to_terminal(log_capture.get_failure_report(name, step_log))
+                raise subprocess.CalledProcessError(exit_code, args)
         print('Command \'%s\' completed successfully' % name)
     except subprocess.CalledProcessError as e:
         raise BuildError('\'%s\' exited with error code: %s' % (name, e.returncode))
 
 
+# Calls 'fn', retrying up to 'retries' times if it fails with a BuildError.
+# Meant for steps that may fail for transient reasons (e.g.: 'posix_spawn failed', network errors).
+def retry_call(fn, retries: int=0, delay: float=0, name: str='command'):
+    import time
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except BuildError as e:
+            if attempt >= retries:
+                raise
+            attempt += 1
+            print('WARNING: \'%s\' failed: %s. Retrying in %s seconds (attempt %s of %s)' % (name, e.message, delay, attempt, retries))
+            time.sleep(delay)
+
+
+# Calls 'fn' for each item using a pool of 'jobs' threads. Returns the results in the same order
+# as the items. If any call raises, the first exception (in item order) is re-raised.
+def run_parallel(fn, items, jobs: int=1) -> list:
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        # Each item runs in a copy of the caller's context (e.g.: the trace arguments of the target)
+        futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+    return [future.result() for future in futures]
+
+
 print_env_sh_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'print_env.sh')
 
 
@@ -52,14 +109,18 @@ def source(script: str, cwd=None) -> dict:
 def mkdir_p(path):
     if not os.path.exists(path):
         print('creating directory: ' + path)
-        os.makedirs(path)
+        # Another thread may create it in the meantime
+        os.makedirs(path, exist_ok=True)
 
 
 # Remove files and/or directories recursively
 def rm_rf(*paths):
     from shutil import rmtree
     for path in paths:
-        if os.path.isfile(path):
+        if os.path.islink(path):
+            print('removing symlink: ' + path)
+            os.remove(path)
+        elif os.path.isfile(path):
             print('removing file: ' + path)
             os.remove(path)
         elif os.path.isdir(path):
@@ -93,18 +154,86 @@ def find_executable(name) -> str:
     return ''
 
 
-def replace_in_new_file(src_file, search, replace, dst_file):
+# Atomically writes the file, but only if the content is different, so the mtime of
+# generated files doesn't change needlessly. Returns whether the file was written.
+def write_file_if_changed(filepath: str, content) -> bool:
+    import tempfile
+
+    data = content.encode('utf-8') if isinstance(content, str) else content
+
+    if os.path.isfile(filepath):
+        with open(filepath, 'rb') as file:
+            if file.read() == data:
+                print('file is up to date: ' + filepath)
+                return False
+
+    dirpath = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix='.%s.' % os.path.basename(filepath), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        if os.path.isfile(filepath):
+            mode = os.stat(filepath).st_mode & 0o7777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, filepath)
+    except:
+        os.remove(tmp_path)
+        raise
+
+    print('writing file: ' + filepath)
+    return True
+
+
+def replace_in_new_file(src_file, search, replace, dst_file) -> bool:
     with open(src_file, 'r') as file:
         content = file.read()
 
     content = content.replace(search, replace)
 
-    with open(dst_file, 'w') as file:
-        file.write(content)
+    return write_file_if_changed(dst_file, content)
+
+
+def replace_in_file(filepath, search, replace) -> bool:
+    return replace_in_new_file(src_file=filepath, search=search, replace=replace, dst_file=filepath)
 
 
-def replace_in_file(filepath, search, replace):
-    replace_in_new_file(src_file=filepath, search=search, replace=replace, dst_file=filepath)
+def file_sha256(filepath: str) -> str:
+    import hashlib
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def break_hardlink(filepath: str):
+    '''
+    Replaces the file with a copy of itself if it has other hardlinks (e.g.: deduplicated install files or
+    '--link-mode=hardlink'). Must be called before running tools that modify files in place, like strip and objcopy.
+    '''
+    import shutil
+    if os.path.islink(filepath) or os.stat(filepath).st_nlink <= 1:
+        return
+    tmp_path = filepath + '.unlink-tmp'
+    shutil.copy2(filepath, tmp_path)
+    os.replace(tmp_path, filepath)
+
+
+def copy_replacing(src: str, dst: str):
+    '''
+    Like 'shutil.copy', but replaces the destination file instead of writing to it, so its other hardlinks
+    (e.g.: deduplicated install files or '--link-mode=hardlink') keep their content.
+    '''
+    import shutil
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    tmp_path = dst + '.copy-tmp'
+    shutil.copy(src, tmp_path)
+    os.replace(tmp_path, dst)
 
 
 def touch(filepath: str):
@@ -218,9 +347,7 @@ exit $?;
 
     mkdir_p(build_dir)
 
-    with open(wrapper_path, 'w') as f:
-        f.write(wrapper_src)
-
-    chmod_plus_x(wrapper_path)
+    if write_file_if_changed(wrapper_path, wrapper_src):
+        chmod_plus_x(wrapper_path)
 
     return wrapper_path
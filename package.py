@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import os.path
+import sys
+import time
+
+from os.path import join as path_join
+
+from build_trace import span
+from os_utils import *
+
+
+# Each archive '<tree>.tar.<ext>' is written along with '<tree>.tar.<ext>.manifest.json', which lists the
+# sha256, size and mode of every file in the tree (and the target of every symlink). In incremental
+# mode an archive is only rebuilt if the content of its manifest changed.
+compressions = {
+    'zstd': 'zst',
+    'xz': 'xz',
+    'gzip': 'gz'
+}
+
+
+def get_trees(install_dir: str, trees) -> list:
+    from debug_symbols import SYMBOL_STORE_DIR_NAME
+
+    if trees:
+        return trees
+    # Hidden directories are internal (e.g.: the dedupe content store). The symbol store of '--split-debug'
+    # is not a runtime; it's only archived if requested with '--tree'.
+    return sorted(d for d in os.listdir(install_dir) if not d.startswith('.') and d != SYMBOL_STORE_DIR_NAME and os.path.isdir(path_join(install_dir, d)))
+
+
+def get_archive_path(output_dir: str, tree: str, compression: str) -> str:
+    return path_join(output_dir, '%s.tar.%s' % (tree, compressions[compression]))
+
+
+def get_manifest_path(archive_path: str) -> str:
+    return archive_path + '.manifest.json'
+
+
+def list_tree_entries(install_dir: str, tree: str) -> list:
+    '''Returns the paths of the tree relative to 'install_dir', sorted, directories before their content'''
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(path_join(install_dir, tree)):
+        dirnames.sort()
+        entries += [os.path.relpath(dirpath, install_dir)]
+        # Symlinks to directories are archived as symlinks, not followed
+        entries += sorted(os.path.relpath(path_join(dirpath, name), install_dir) for name in filenames + [d for d in dirnames if os.path.islink(path_join(dirpath, d))])
+    return entries
+
+
+def build_manifest(install_dir: str, tree: str, previous: dict, jobs: int) -> dict:
+    previous_files = previous.get('files', {})
+
+    def manifest_entry(rel_path):
+        path = path_join(install_dir, rel_path)
+        if os.path.islink(path):
+            return rel_path, { 'symlink': os.readlink(path) }
+        st = os.stat(path)
+        if os.path.isdir(path):
+            return rel_path, None
+        # Reuse the previous hash if the size and mtime didn't change
+        prev = previous_files.get(rel_path)
+        if prev and prev.get('size') == st.st_size and prev.get('mtime_ns') == st.st_mtime_ns:
+            sha256 = prev['sha256']
+        else:
+            sha256 = file_sha256(path)
+        return rel_path, { 'sha256': sha256, 'size': st.st_size, 'mode': '%o' % (st.st_mode & 0o7777), 'mtime_ns': st.st_mtime_ns }
+
+    files = {}
+    for rel_path, entry in run_parallel(manifest_entry, list_tree_entries(install_dir, tree), jobs):
+        if entry is not None:
+            files[rel_path] = entry
+
+    return { 'tree': tree, 'files': files }
+
+
+def manifest_content(manifest: dict) -> dict:
+    '''The part of the manifest that determines the archive content. mtimes are only a hashing cache.'''
+    files = { rel_path: { k: v for k, v in entry.items() if k != 'mtime_ns' } for rel_path, entry in manifest.get('files', {}).items() }
+    return { 'tree': manifest.get('tree'), 'compression': manifest.get('compression'), 'files': files }
+
+
+def load_manifest(manifest_path: str) -> dict:
+    if not os.path.isfile(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        print('WARNING: Ignoring corrupt manifest: ' + manifest_path)
+        return {}
+
+
+def get_compressor_command(compression: str, level: int, threads: int) -> list:
+    level_args = ['-%d' % level] if level else []
+    if compression == 'zstd':
+        return ['zstd', '-q', '-c', '-T%d' % threads] + level_args
+    if compression == 'xz':
+        return ['xz', '-c', '-T%d' % threads] + level_args
+    pigz = find_executable('pigz')
+    if pigz:
+        return [pigz, '-c', '-p', str(threads)] + level_args
+    return ['gzip', '-c'] + level_args
+
+
+def write_archive(install_dir: str, tree: str, archive_path: str, compressor_cmd: list):
+    import subprocess
+    import tarfile
+
+    tmp_path = '%s.tmp-%s' % (archive_path, os.getpid())
+
+    def normalize(tarinfo):
+        # The archives shouldn't depend on who built them
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = ''
+        return tarinfo
+
+    with open(tmp_path, 'wb') as out_file:
+        proc = subprocess.Popen(compressor_cmd, stdin=subprocess.PIPE, stdout=out_file)
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for rel_path in list_tree_entries(install_dir, tree):
+                    tar.add(path_join(install_dir, rel_path), arcname=rel_path, recursive=False, filter=normalize)
+        finally:
+            proc.stdin.close()
+            exit_code = proc.wait()
+
+    if exit_code != 0:
+        os.remove(tmp_path)
+        raise BuildError('\'%s\' exited with error code: %s' % (compressor_cmd[0], exit_code))
+
+    os.replace(tmp_path, archive_path)
+
+
+def package_tree(install_dir: str, tree: str, output_dir: str, compression: str, level: int, threads: int, incremental: bool, hash_jobs: int) -> dict:
+    tree_dir = path_join(install_dir, tree)
+    if not os.path.isdir(tree_dir):
+        raise BuildError('Install directory does not exist: ' + tree_dir)
+
+    archive_path = get_archive_path(output_dir, tree, compression)
+    manifest_path = get_manifest_path(archive_path)
+
+    previous = load_manifest(manifest_path)
+    manifest = build_manifest(install_dir, tree, previous, hash_jobs)
+    manifest['compression'] = compression
+
+    input_bytes = sum(entry.get('size', 0) for entry in manifest['files'].values())
+
+    if incremental and os.path.isfile(archive_path) and manifest_content(manifest) == manifest_content(previous):
+        print('Archive is up to date: ' + archive_path)
+        write_file_if_changed(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+        return { 'tree': tree, 'archive': archive_path, 'rebuilt': False, 'input_bytes': input_bytes, 'output_bytes': os.path.getsize(archive_path), 'seconds': 0 }
+
+    start = time.time()
+    write_archive(install_dir, tree, archive_path, get_compressor_command(compression, level, threads))
+    seconds = time.time() - start
+
+    # Written after the archive, so an interrupted run never leaves a manifest for a stale archive
+    write_file_if_changed(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+
+    output_bytes = os.path.getsize(archive_path)
+    print('Created archive %s: %s -> %s bytes in %.1fs' % (archive_path, input_bytes, output_bytes, seconds))
+
+    return { 'tree': tree, 'archive': archive_path, 'rebuilt': True, 'input_bytes': input_bytes, 'output_bytes': output_bytes, 'seconds': seconds }
+
+
+def package(install_dir: str, trees, output_dir: str, compression: str, level: int, jobs: int, threads: int, incremental: bool):
+    trees = get_trees(install_dir, trees)
+
+    if not trees:
+        raise BuildError('No install directories to package in: ' + install_dir)
+
+    if not find_executable(get_compressor_command(compression, level, 1)[0]):
+        raise BuildError('Cannot find the \'%s\' executable' % compression)
+
+    jobs = max(1, min(jobs, len(trees)))
+
+    # Split the cores between the archives being built at the same time. Hashing a tree comes before compressing
+    # it, so it uses its share of the cores whatever '--threads' is.
+    hash_jobs = max(1, os.cpu_count() // jobs)
+
+    if not threads:
+        threads = hash_jobs
+
+    mkdir_p(output_dir)
+
+    start = time.time()
+
+    def package_traced(tree):
+        with span('package %s' % tree, tree=tree, compression=compression):
+            return package_tree(install_dir, tree, output_dir, compression, level, threads, incremental, hash_jobs)
+
+    results = run_parallel(package_traced, trees, jobs)
+
+    rebuilt = [r for r in results if r['rebuilt']]
+    print('Packaged %s install directories (%s rebuilt, %s up to date) in %.1fs: %s -> %s bytes' % (
+        len(results), len(rebuilt), len(results) - len(rebuilt), time.time() - start,
+        sum(r['input_bytes'] for r in results), sum(r['output_bytes'] for r in results)))
+
+
+def main(raw_args):
+    import cmd_utils
+
+    parser = cmd_utils.build_arg_parser(description='Archives install directories concurrently, with multi-threaded compression and manifests')
+
+    default_help = 'default: %(default)s'
+
+    home = os.environ.get('HOME')
+
+    parser.add_argument('action', choices=['package'])
+    parser.add_argument('--install-dir', default=path_join(home, 'mono-installs'), help=default_help)
+    parser.add_argument('--output-dir', default=path_join(home, 'mono-packages'), help=default_help)
+    parser.add_argument('--tree', action='append', default=[], help='Install directory to archive (e.g.: desktop-linux-x86_64-release). Default: all of them, except the symbol store.')
+    parser.add_argument('--compression', choices=list(compressions), default='zstd', help=default_help)
+    parser.add_argument('--compression-level', type=int, default=0, help='Compression level. Default: the compressor\'s default.')
+    parser.add_argument('--jobs', '-j', nargs='?', const=str(os.cpu_count()), default='1', help='Number of archives to create at the same time.\n' + default_help)
+    parser.add_argument('--threads', type=int, default=0, help='Compression threads per archive. Default: the number of cores divided by the number of jobs.')
+    parser.add_argument('--incremental', action='store_true', default=False, help='Only rebuild the archives whose manifest changed.\n' + default_help)
+    parser.add_argument('--trace-file', default='', help='Write a timeline of the archives to this file, in Chrome Trace Event format.')
+
+    args = parser.parse_args(raw_args)
+
+    if args.trace_file:
+        import build_trace
+        build_trace.start_trace(args.trace_file)
+
+    try:
+        package(os.path.abspath(args.install_dir), args.tree, os.path.abspath(args.output_dir), args.compression,
+                args.compression_level, int(args.jobs), args.threads, args.incremental)
+    except BuildError as e:
+        sys.exit(e.message)
+
+
+if __name__ == '__main__':
+    from sys import argv
+    main(argv[1:])
@@ -3,7 +3,8 @@
 def main(raw_args):
     import os
     import cmd_utils
-    from os_utils import get_emsdk_root
+    import patch_utils
+    from os_utils import BuildError, get_emsdk_root
 
     parser = cmd_utils.build_arg_parser(description='Apply patches to the active Emscripten SDK')
 
@@ -16,6 +17,8 @@ def main(raw_args):
     else:
         parser.add_argument('--mono-sources', required=True)
 
+    patch_utils.add_patch_arguments(parser, default_help)
+
     args = parser.parse_args(raw_args)
 
     mono_source_root = args.mono_sources
@@ -25,15 +28,11 @@ def main(raw_args):
         '%s/sdks/builds/fix-emscripten-8511.diff' % mono_source_root,
     ]
 
-    from subprocess import Popen
     from sys import exit
-    for patch in patches:
-        patch_cmd = 'patch -N -p1 < %s' % patch
-        print('Running: %s' % patch_cmd)
-        proc = Popen('bash -c \'%s; exit $?\'' % patch_cmd, cwd=emsdk_root, shell=True)
-        exit_code = proc.wait()
-        if exit_code != 0:
-            exit('patch exited with error code: %s' % exit_code)
+    try:
+        patch_utils.apply_patches(patches, emsdk_root, state_file=args.patch_state, restore_mtimes=args.restore_mtimes)
+    except BuildError as e:
+        exit(e.message)
 
 
 if __name__ == '__main__':
@@ -5,7 +5,8 @@ def main(raw_args):
     import cmd_utils
     import os
     import os.path
-    from os_utils import get_emsdk_root
+    import patch_utils
+    from os_utils import BuildError
 
     parser = cmd_utils.build_arg_parser(description='Apply patches to the Mono source tree')
 
@@ -18,6 +19,8 @@ def main(raw_args):
     else:
         parser.add_argument('--mono-sources', required=True)
 
+    patch_utils.add_patch_arguments(parser, default_help)
+
     args = parser.parse_args(raw_args)
 
     this_script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -41,15 +44,12 @@ def main(raw_args):
     else:
         patches += ['offsets-tool-extra-cflags_old.diff']
 
-    from subprocess import Popen
     from sys import exit
-    for patch in patches:
-        patch_cmd = 'patch -N -p1 < %s' % os.path.join(patches_dir, patch)
-        print('Running: %s' % patch_cmd)
-        proc = Popen('bash -c \'%s; exit $?\'' % patch_cmd, cwd=mono_source_root, shell=True)
-        exit_code = proc.wait()
-        if exit_code != 0:
-            exit('patch exited with error code: %s' % exit_code)
+    try:
+        patch_utils.apply_patches([os.path.join(patches_dir, patch) for patch in patches], mono_source_root,
+            state_file=args.patch_state, restore_mtimes=args.restore_mtimes)
+    except BuildError as e:
+        exit(e.message)
 
 
 if __name__ == '__main__':
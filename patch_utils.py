@@ -0,0 +1,134 @@
+import json
+import os
+import os.path
+
+from os.path import join as path_join
+
+from os_utils import *
+
+
+def get_default_state_file(root: str) -> str:
+    # Prefer the '.git' directory so the state survives 'git reset' and 'git clean'
+    git_dir = path_join(root, '.git')
+    if os.path.isdir(git_dir):
+        return path_join(git_dir, 'godot-mono-builds-patches.json')
+    return path_join(root, '.godot-mono-builds-patches.json')
+
+
+def get_patched_files(patch_file: str, strip: int=1) -> list:
+    files = []
+    with open(patch_file, 'r', errors='replace') as f:
+        for line in f:
+            if not line.startswith('+++ '):
+                continue
+            path = line[4:].rstrip('\n').split('\t')[0].strip()
+            if path == '/dev/null':
+                continue
+            path = '/'.join(path.split('/')[strip:])
+            if path and not path in files:
+                files += [path]
+    return files
+
+
+def hash_file_or_none(filepath: str):
+    return file_sha256(filepath) if os.path.isfile(filepath) else None
+
+
+def load_state(state_file: str) -> dict:
+    if os.path.isfile(state_file):
+        try:
+            with open(state_file, 'r') as f:
+                state = json.load(f)
+            if isinstance(state, dict) and 'patches' in state and 'files' in state:
+                return state
+        except ValueError:
+            print('WARNING: Ignoring corrupt patch state file: ' + state_file)
+    return { 'patches': {}, 'files': {} }
+
+
+def save_state(state_file: str, state: dict):
+    write_file_if_changed(state_file, json.dumps(state, indent=4, sort_keys=True))
+
+
+def is_recorded_as_applied(state: dict, root: str, patch_name: str, patch_hash: str, files) -> bool:
+    if state['patches'].get(patch_name) != patch_hash:
+        return False
+    for file in files:
+        recorded = state['files'].get(file)
+        if recorded is None or hash_file_or_none(path_join(root, file)) != recorded['sha256']:
+            return False
+    return True
+
+
+def patch_applies(patch_file: str, root: str, reverse: bool=False) -> bool:
+    import subprocess
+    args = ['patch', '-p1', '-f', '-s', '--dry-run', '-i', patch_file]
+    args += ['-R'] if reverse else []
+    return subprocess.call(args, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+
+
+def apply_patches(patch_files, root: str, state_file: str='', restore_mtimes: bool=False):
+    '''
+    Applies the patches that are missing from the tree at 'root'. The state file records the applied
+    patches and the content hashes of the files they produce, so already applied patches are verified
+    by hashing instead of by running 'patch'. Files whose content is not changed keep their mtime.
+    If 'restore_mtimes' is True, files that end up with the same content they had the last time the
+    patches were applied get the mtime they had back then (e.g.: after 'git reset --hard').
+    '''
+
+    if not state_file:
+        state_file = get_default_state_file(root)
+
+    state = load_state(state_file)
+    state_changed = False
+
+    for patch_file in patch_files:
+        patch_name = os.path.basename(patch_file)
+        patch_hash = file_sha256(patch_file)
+        files = get_patched_files(patch_file)
+
+        if is_recorded_as_applied(state, root, patch_name, patch_hash, files):
+            print('Patch already applied: %s' % patch_name)
+            continue
+
+        previous = {}
+        for file in files:
+            path = path_join(root, file)
+            if os.path.isfile(path):
+                previous[file] = (file_sha256(path), os.stat(path).st_mtime_ns)
+
+        if patch_applies(patch_file, root, reverse=True):
+            print('Patch already applied (not recorded): %s' % patch_name)
+        elif patch_applies(patch_file, root):
+            run_command('patch', args=['-N', '-p1', '-s', '--no-backup-if-mismatch', '-i', patch_file], cwd=root, name='patch %s' % patch_name)
+        else:
+            raise BuildError('Patch \'%s\' does not apply to: %s' % (patch_name, root))
+
+        for file in files:
+            path = path_join(root, file)
+            if not os.path.isfile(path):
+                state['files'].pop(file, None)
+                continue
+
+            sha256 = file_sha256(path)
+            recorded = state['files'].get(file)
+
+            if file in previous and previous[file][0] == sha256:
+                os.utime(path, ns=(previous[file][1], previous[file][1]))
+            elif restore_mtimes and recorded is not None and recorded['sha256'] == sha256:
+                os.utime(path, ns=(recorded['mtime_ns'], recorded['mtime_ns']))
+
+            state['files'][file] = { 'sha256': sha256, 'mtime_ns': os.stat(path).st_mtime_ns }
+
+        state['patches'][patch_name] = patch_hash
+        state_changed = True
+
+    if state_changed:
+        save_state(state_file, state)
+
+
+def add_patch_arguments(parser, default_help):
+    parser.add_argument('--patch-state', default='', help='File that records the applied patches. Defaults to a file inside the \'.git\' directory of the patched tree.')
+    parser.add_argument('--restore-mtimes', action='store_true', default=False,
+        help='Restore the previous mtime of files whose content is identical to the last time the patches were applied. ' +
+             'Only safe if nothing was built from the unpatched sources in between.\n' + default_help)
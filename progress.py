@@ -0,0 +1,185 @@
+import json
+import os
+import os.path
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from os.path import join as path_join
+
+# With '--progress', the output of the commands is captured (see log_capture.py) and the messages of the scripts
+# go to '<log_dir>/session.log'. The terminal only shows one status line per active target, with the ETA computed
+# from the durations of the previous runs in '<log_dir>/durations.json'.
+
+HISTORY_SIZE = 5
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(max(seconds, 0))
+    if seconds >= 3600:
+        return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return '%02d:%02d' % (seconds // 60, seconds % 60)
+
+
+def get_target_key(args: dict) -> str:
+    return '-'.join(args[key] for key in ['product', 'target', 'configuration'] if args.get(key)) or 'session'
+
+
+class Progress:
+    def __init__(self, log_dir: str, terminal):
+        self.log_dir = log_dir
+        self.terminal = terminal
+        self.is_tty = terminal.isatty()
+        self.lock = threading.Lock()
+        self.active = OrderedDict()
+        self.drawn_lines = 0
+        self.history_file = path_join(log_dir, 'durations.json')
+        self.history = self.load_history()
+        self.durations = {}
+
+    def load_history(self) -> dict:
+        if not os.path.isfile(self.history_file):
+            return {}
+        try:
+            with open(self.history_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def save_history(self):
+        from os_utils import write_file_if_changed
+        with self.lock:
+            for key, durations in self.durations.items():
+                self.history[key] = (self.history.get(key, []) + durations)[-HISTORY_SIZE:]
+            self.durations = {}
+            write_file_if_changed(self.history_file, json.dumps(self.history, indent=1, sort_keys=True))
+
+    def get_expected(self, history_key: str):
+        durations = sorted(self.history.get(history_key, []))
+        return durations[len(durations) // 2] if durations else None
+
+    def get_status_line(self, target_key: str, state: dict) -> str:
+        now = time.time()
+        elapsed = now - state['started']
+        step = ' > '.join(s for s in [state['action'], state['phase'], state['step']] if s)
+
+        expected = self.get_expected('target:%s:%s' % (target_key, state['action']))
+        if expected is None and state['step']:
+            # No previous run of the whole action. Fall back to the current step.
+            step_expected = self.get_expected('command:%s:%s' % (target_key, state['step']))
+            expected = elapsed + step_expected - (now - state['step_started']) if step_expected is not None else None
+
+        eta = 'ETA %s' % format_duration(expected - elapsed) if expected is not None and expected > elapsed else 'ETA unknown'
+        return '%s: %s [%s] %s' % (target_key, step, format_duration(elapsed), eta)
+
+    def render(self):
+        with self.lock:
+            lines = [self.get_status_line(key, state) for key, state in self.active.items()]
+            if not self.is_tty:
+                return
+            columns = self.get_columns()
+            out = '\x1b[%dA' % self.drawn_lines if self.drawn_lines else ''
+            out += ''.join('\r\x1b[2K%s\n' % line[:columns - 1] for line in lines)
+            # Clear the lines of the targets that finished
+            out += '\r\x1b[2K\n' * max(self.drawn_lines - len(lines), 0)
+            out += '\x1b[%dA' % max(self.drawn_lines - len(lines), 0) if self.drawn_lines > len(lines) else ''
+            self.terminal.write(out)
+            self.terminal.flush()
+            self.drawn_lines = len(lines)
+
+    def get_columns(self) -> int:
+        import shutil
+        return shutil.get_terminal_size().columns
+
+    def print_message(self, text: str):
+        '''Prints to the terminal, above the status lines'''
+        with self.lock:
+            if self.is_tty and self.drawn_lines:
+                self.terminal.write('\x1b[%dA\r\x1b[J' % self.drawn_lines)
+                self.drawn_lines = 0
+            self.terminal.write(text + '\n')
+            self.terminal.flush()
+        self.render()
+
+    def span_started(self, name: str, cat: str, args: dict):
+        target_key = get_target_key(args)
+        now = time.time()
+
+        with self.lock:
+            if cat == 'target':
+                self.active[target_key] = { 'action': name, 'phase': '', 'step': '', 'started': now, 'step_started': now }
+            elif target_key in self.active:
+                state = self.active[target_key]
+                if cat == 'phase':
+                    state['phase'] = name
+                elif cat == 'command':
+                    state['step'] = name
+                    state['step_started'] = now
+                else:
+                    return
+            else:
+                return
+            line = self.get_status_line(target_key, self.active[target_key])
+
+        if self.is_tty:
+            self.render()
+        else:
+            self.print_message(line)
+
+    def span_ended(self, name: str, cat: str, args: dict, duration: float):
+        target_key = get_target_key(args)
+        ok = args.get('status') == 'ok'
+
+        if cat in ['target', 'command'] and ok:
+            with self.lock:
+                self.durations.setdefault('%s:%s:%s' % (cat, target_key, name), []).append(duration)
+
+        if cat == 'target':
+            with self.lock:
+                self.active.pop(target_key, None)
+            self.print_message('%s %s: %s in %s' % ('Finished' if ok else 'Failed', name, target_key, format_duration(duration)))
+        elif cat == 'phase' and target_key in self.active:
+            with self.lock:
+                self.active[target_key]['phase'] = ''
+
+    def refresh_loop(self):
+        while True:
+            time.sleep(1)
+            self.render()
+
+
+progress = None
+
+
+def start_progress(log_dir: str):
+    import atexit
+    import build_trace
+    from os_utils import mkdir_p
+
+    global progress
+
+    mkdir_p(log_dir)
+
+    progress = Progress(log_dir, sys.stdout)
+    build_trace.listeners.append(progress)
+
+    # Everything the scripts print goes to the session log from now on
+    sys.stdout = open(path_join(log_dir, 'session.log'), 'w', buffering=1)
+
+    if progress.is_tty:
+        threading.Thread(target=progress.refresh_loop, daemon=True).start()
+
+    def at_exit():
+        progress.save_history()
+        progress.print_message('Logs: %s' % log_dir)
+
+    atexit.register(at_exit)
+
+
+def print_to_terminal(text: str):
+    '''Prints to the terminal, even in progress mode where the standard output goes to the session log'''
+    if progress is None:
+        print(text)
+    else:
+        progress.print_message(text)
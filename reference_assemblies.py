@@ -37,6 +37,7 @@ def clean(opts: BaseOpts):
 
 
 def main(raw_args):
+    import build_trace
     import cmd_utils
 
     actions = {
@@ -57,13 +58,18 @@ def main(raw_args):
 
     opts = base_opts_from_args(args)
 
+    cmd_utils.init_build_session(opts)
+
     try:
         action = actions[args.action]
-        action(opts)
+        with build_trace.target_span(args.action, product='reference-assemblies'):
+            action(opts)
     except BuildError as e:
         sys.exit(e.message)
 
 
 if __name__ == '__main__':
     from sys import argv
-    main(argv[1:])
+    from metrics_db import recording_exit_status
+    with recording_exit_status():
+        main(argv[1:])
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import os
+import os.path
+import sys
+
+from os.path import join as path_join
+
+from os_utils import *
+
+
+def median(values: list) -> float:
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def get_run(db, run_id: int) -> dict:
+    row = db.execute('SELECT id, started, script, argv, mono_revision, script_revision, host FROM runs WHERE id = ?', (run_id,)).fetchone()
+    if row is None:
+        raise BuildError('Run not found: %s' % run_id)
+    return dict(zip(['id', 'started', 'script', 'argv', 'mono_revision', 'script_revision', 'host'], row))
+
+
+def get_baseline_run_ids(db, run: dict, baseline_runs: int) -> list:
+    '''The previous successful runs of the same script on the same host'''
+    rows = db.execute('SELECT id FROM runs WHERE id < ? AND script = ? AND host = ? AND success = 1 ORDER BY id DESC LIMIT ?',
+        (run['id'], run['script'], run['host'], baseline_runs)).fetchall()
+    return [row[0] for row in rows]
+
+
+def get_step_times(db, run_id: int) -> dict:
+    # Steps with the same name for the same target in one run (e.g.: retries) are added up
+    rows = db.execute('SELECT product, target, configuration, name, SUM(wall_time) FROM steps WHERE run_id = ? GROUP BY product, target, configuration, name', (run_id,))
+    return { tuple(row[:4]): row[4] for row in rows }
+
+
+def get_artifact_sizes(db, run_id: int) -> dict:
+    rows = db.execute('SELECT product, target, configuration, path, MAX(size) FROM artifacts WHERE run_id = ? GROUP BY product, target, configuration, path', (run_id,))
+    return { tuple(row[:4]): row[4] for row in rows }
+
+
+def find_regressions(latest: dict, baselines: list, threshold: float, min_delta: float) -> list:
+    '''Returns (key, latest value, baseline median, change in %) for the values above the baseline median by more than the threshold'''
+    regressions = []
+    for key, value in sorted(latest.items()):
+        history = [baseline[key] for baseline in baselines if key in baseline]
+        if not history:
+            continue
+        baseline_value = median(history)
+        if value - baseline_value < min_delta:
+            continue
+        change = 100 * (value - baseline_value) / baseline_value if baseline_value else float('inf')
+        if change > threshold:
+            regressions += [(key, value, baseline_value, change)]
+    return regressions
+
+
+def format_key(key: tuple) -> str:
+    target = '-'.join(k for k in key[:3] if k)
+    return '%s: %s' % (target, key[3]) if target else key[3]
+
+
+def report(db_path: str, run_id: int, baseline_runs: int, time_threshold: float, size_threshold: float, min_seconds: float) -> bool:
+    '''Prints the comparison of a run with its baseline. Returns whether regressions were found.'''
+    import metrics_db
+
+    if not os.path.isfile(db_path):
+        raise BuildError('Metrics database not found: ' + db_path)
+
+    db = metrics_db.connect(db_path)
+
+    if not run_id:
+        row = db.execute('SELECT MAX(id) FROM runs').fetchone()
+        if row[0] is None:
+            raise BuildError('No runs recorded in: ' + db_path)
+        run_id = row[0]
+
+    run = get_run(db, run_id)
+    baseline_ids = get_baseline_run_ids(db, run, baseline_runs)
+
+    print('Run %s: %s %s' % (run['id'], run['script'], run['argv']))
+    print('    Mono revision: %s, script revision: %s, host: %s' % (run['mono_revision'] or 'unknown', run['script_revision'] or 'unknown', run['host']))
+
+    if not baseline_ids:
+        print('No previous successful runs of \'%s\' on this host to compare with' % run['script'])
+        return False
+
+    print('Baseline: median of runs %s' % ', '.join(str(i) for i in reversed(baseline_ids)))
+
+    time_regressions = find_regressions(get_step_times(db, run_id), [get_step_times(db, i) for i in baseline_ids], time_threshold, min_seconds)
+    size_regressions = find_regressions(get_artifact_sizes(db, run_id), [get_artifact_sizes(db, i) for i in baseline_ids], size_threshold, 1)
+
+    db.close()
+
+    for key, value, baseline_value, change in time_regressions:
+        print('REGRESSION: %s took %.1fs (baseline: %.1fs, +%.0f%%)' % (format_key(key), value, baseline_value, change))
+    for key, value, baseline_value, change in size_regressions:
+        print('REGRESSION: %s is %s bytes (baseline: %s bytes, +%.1f%%)' % (format_key(key), value, int(baseline_value), change))
+
+    if not time_regressions and not size_regressions:
+        print('No regressions above %s%% (time) and %s%% (size)' % (time_threshold, size_threshold))
+        return False
+
+    return True
+
+
+def main(raw_args):
+    import cmd_utils
+
+    parser = cmd_utils.build_arg_parser(description='Compares the latest build run recorded with \'--metrics-db\' with the previous runs')
+
+    default_help = 'default: %(default)s'
+
+    home = os.environ.get('HOME')
+
+    parser.add_argument('action', choices=['report'])
+    parser.add_argument('--metrics-db', default=path_join(home, 'mono-configs', 'build-metrics.sqlite'), help=default_help)
+    parser.add_argument('--run', type=int, default=0, help='Run to compare. Default: the latest one.')
+    parser.add_argument('--baseline-runs', type=int, default=5, help='Number of previous successful runs of the same script on the same host to use as baseline.\n' + default_help)
+    parser.add_argument('--time-threshold', type=float, default=10, help='Flag steps that are slower than the baseline median by more than this percentage.\n' + default_help)
+    parser.add_argument('--size-threshold', type=float, default=2, help='Flag artifacts that are larger than the baseline median by more than this percentage.\n' + default_help)
+    parser.add_argument('--min-seconds', type=float, default=1, help='Ignore time differences smaller than this, which are mostly noise.\n' + default_help)
+
+    args = parser.parse_args(raw_args)
+
+    try:
+        regressions = report(os.path.abspath(args.metrics_db), args.run, args.baseline_runs, args.time_threshold, args.size_threshold, args.min_seconds)
+    except BuildError as e:
+        sys.exit(e.message)
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    from sys import argv
+    main(argv[1:])
@@ -0,0 +1,141 @@
+import json
+import os
+import sys
+import threading
+
+
+# Resource usage of the commands run with 'run_command', collected with wait4(2). The usage of a
+# command includes all its descendants that were waited for (e.g.: the compilers run by make).
+# Peak RSS is the largest of the command and its descendants, not their sum.
+
+steps = []
+steps_lock = threading.Lock()
+
+
+def exit_code_from_status(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def usage_from_rusage(rusage) -> dict:
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    max_rss_kib = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return {
+        'user_time': rusage.ru_utime,
+        'system_time': rusage.ru_stime,
+        'max_rss_kib': max_rss_kib,
+        'in_blocks': rusage.ru_inblock,
+        'out_blocks': rusage.ru_oublock,
+        'voluntary_switches': rusage.ru_nvcsw,
+        'involuntary_switches': rusage.ru_nivcsw
+    }
+
+
+def call(args: list, output=None, **popen_args):
+    '''Runs the command and returns its exit code and resource usage (None if not supported by the platform).
+    If 'output' is set, it's called with each line of the combined stdout and stderr of the command.'''
+    import subprocess
+
+    if output is not None:
+        popen_args.update(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    proc = subprocess.Popen(args, **popen_args)
+
+    try:
+        if output is not None:
+            with proc.stdout:
+                # Bounded, as a single line can be huge
+                for line in iter(lambda: proc.stdout.readline(64 * 1024), b''):
+                    output(line)
+
+        if not hasattr(os, 'wait4'):
+            return proc.wait(), None
+
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+
+    # Let Popen know the process was already reaped
+    proc.returncode = exit_code_from_status(status)
+
+    return proc.returncode, usage_from_rusage(rusage)
+
+
+def record_step(name: str, context: dict, wall_time: float, exit_code: int, usage) -> dict:
+    step = dict(context, name=name, wall_time=wall_time, exit_code=exit_code)
+    if usage is not None:
+        step.update(usage)
+    with steps_lock:
+        steps.append(step)
+    return step
+
+
+def get_totals(steps: list) -> dict:
+    totals = {}
+    for key in ['wall_time', 'user_time', 'system_time', 'in_blocks', 'out_blocks', 'voluntary_switches', 'involuntary_switches']:
+        totals[key] = sum(step.get(key, 0) for step in steps)
+    totals['max_rss_kib'] = max([step.get('max_rss_kib', 0) for step in steps] + [0])
+    return totals
+
+
+def format_step_target(step: dict) -> str:
+    return '-'.join(step[key] for key in ['product', 'target', 'configuration'] if step.get(key))
+
+
+def print_summary():
+    with steps_lock:
+        all_steps = list(steps)
+
+    if not all_steps:
+        return
+
+    rows = [('step', 'target', 'wall s', 'user s', 'sys s', 'cpu %', 'max rss MiB', 'in blk', 'out blk', 'vol cs', 'invol cs')]
+
+    def row(name, target, step):
+        wall = step['wall_time']
+        cpu = step.get('user_time', 0) + step.get('system_time', 0)
+        return (name, target, '%.1f' % wall, '%.1f' % step.get('user_time', 0), '%.1f' % step.get('system_time', 0),
+            '%.0f' % (100 * cpu / wall if wall else 0), '%.0f' % (step.get('max_rss_kib', 0) / 1024),
+            str(step.get('in_blocks', 0)), str(step.get('out_blocks', 0)),
+            str(step.get('voluntary_switches', 0)), str(step.get('involuntary_switches', 0)))
+
+    rows += [row(step['name'], format_step_target(step), step) for step in all_steps]
+    rows += [row('total', '', get_totals(all_steps))]
+
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+
+    print('Resource usage of the commands (CPU times include all descendants):')
+    for r in rows:
+        print('  ' + '  '.join(value.ljust(width) if i < 2 else value.rjust(width) for i, (value, width) in enumerate(zip(r, widths))))
+
+
+def write_report(path: str, jobs: str):
+    from os_utils import write_file_if_changed
+
+    with steps_lock:
+        all_steps = list(steps)
+
+    report = {
+        'argv': sys.argv,
+        'jobs': jobs,
+        'cpu_count': os.cpu_count(),
+        'steps': all_steps,
+        'totals': get_totals(all_steps)
+    }
+
+    write_file_if_changed(path, json.dumps(report, indent=4))
+
+
+def start_report(report_file: str, jobs: str):
+    '''Prints the summary table when the process exits and, if 'report_file' is set, writes the JSON report'''
+    import atexit
+
+    def at_exit():
+        print_summary()
+        if report_file:
+            write_report(report_file, jobs)
+
+    atexit.register(at_exit)
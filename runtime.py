@@ -2,10 +2,66 @@
 import os
 from os.path import join as path_join
 
-from options import RuntimeOpts
+from checkpoint import get_checkpoints, get_source_fingerprint
+from clang_time_trace import get_time_trace_flags, report_time_trace
+from make_timing import report_make_timing, start_make_timing
+from memory_build import prepare_build_dir, release_build_dir
+from metrics_db import record_artifact
+from options import RuntimeOpts, make_default_args
 from os_utils import *
 
 
+# Subdirectories of the build directory installed by 'make install' for the runtime targets
+runtime_install_subdirs = ['mono', 'support', 'data']
+
+# With '--minimal-build', only the subdirectories needed for the installed files are built: for the runtime targets,
+# the subdirectories of the top level Makefile up to the last one installed; for the cross-compilers, the subdirectories
+# of 'mono' up to 'mini', where the AOT compiler is built. make builds 'SUBDIRS' in order, so the subdirectories before
+# these are the ones they may depend on (e.g.: libgc with Boehm, or the convenience libraries 'mini' links against).
+# The list is read from the configured Makefiles, so it follows what configure enabled for each product and target.
+minimal_cross_install_subdirs = ['mono/mini']
+
+
+def get_object_format(host_triple: str) -> str:
+    if any(s in host_triple for s in ['apple', 'darwin']):
+        return 'macho'
+    if any(s in host_triple for s in ['mingw', 'windows', 'cygwin']):
+        return 'pe'
+    return 'elf'
+
+
+def get_debug_info_flags(opts: RuntimeOpts, host_triple: str):
+    '''Returns the compiler and linker flags for the debug info options'''
+
+    if opts.debug_level == 'default':
+        CFLAGS = ['-g'] if opts.release else ['-ggdb3']
+    else:
+        CFLAGS = ['-g%s' % opts.debug_level]
+
+    LDFLAGS = []
+
+    if opts.debug_level == '0':
+        return CFLAGS, LDFLAGS
+
+    # Split DWARF and compressed debug sections are only supported by the ELF toolchains
+    is_elf = get_object_format(host_triple) == 'elf'
+
+    if opts.split_dwarf:
+        if is_elf:
+            CFLAGS += ['-gsplit-dwarf']
+        else:
+            print('WARNING: \'--split-dwarf\' is not supported when targeting \'%s\'; ignoring' % host_triple)
+
+    if opts.compress_debug_sections:
+        if is_elf:
+            CFLAGS += ['-gz']
+            LDFLAGS += ['-Wl,--compress-debug-sections=zlib']
+        else:
+            print('WARNING: \'--compress-debug-sections\' is not supported when targeting \'%s\'; ignoring' % host_triple)
+
+    return CFLAGS, LDFLAGS
+
+
 def setup_runtime_template(env: dict, opts: RuntimeOpts, product: str, target: str, host_triple: str, llvm: str=''):
     BITNESS = ''
     if any(s in host_triple for s in ['i686', 'i386']):
@@ -13,31 +69,35 @@ def setup_runtime_template(env: dict, opts: RuntimeOpts, product: str, target: s
     elif 'x86_64' in host_triple:
         BITNESS = '-m64'
 
+    DEBUG_FLAGS, DEBUG_LDFLAGS = get_debug_info_flags(opts, host_triple)
+    OPT_FLAGS = ['-O2'] + DEBUG_FLAGS if opts.release else ['-O0'] + DEBUG_FLAGS + ['-fno-omit-frame-pointer']
+
     CFLAGS = []
-    CFLAGS += ['-O2', '-g'] if opts.release else ['-O0', '-ggdb3', '-fno-omit-frame-pointer']
+    CFLAGS += OPT_FLAGS
     CFLAGS += env.get('_%s-%s_CFLAGS' % (product, target), [])
     CFLAGS += env.get('%s-%s_CFLAGS' % (product, target), [])
     CFLAGS += [BITNESS] if BITNESS else []
 
     CXXFLAGS = []
-    CXXFLAGS += ['-O2', '-g'] if opts.release else ['-O0', '-ggdb3', '-fno-omit-frame-pointer']
+    CXXFLAGS += OPT_FLAGS
     CXXFLAGS += env.get('_%s-%s_CXXFLAGS' % (product, target), [])
     CXXFLAGS += env.get('%s-%s_CXXFLAGS' % (product, target), [])
     CXXFLAGS += [BITNESS] if BITNESS else []
 
     CPPFLAGS = []
-    CPPFLAGS += ['-O2', '-g'] if opts.release else ['-O0', '-ggdb3', '-fno-omit-frame-pointer']
+    CPPFLAGS += OPT_FLAGS
     CPPFLAGS += env.get('_%s-%s_CPPFLAGS' % (product, target), [])
     CPPFLAGS += env.get('%s-%s_CPPFLAGS' % (product, target), [])
     CPPFLAGS += [BITNESS] if BITNESS else []
 
     CXXCPPFLAGS = []
-    CXXCPPFLAGS += ['-O2', '-g'] if opts.release else ['-O0', '-ggdb3', '-fno-omit-frame-pointer']
+    CXXCPPFLAGS += OPT_FLAGS
     CXXCPPFLAGS += env.get('_%s-%s_CXXCPPFLAGS' % (product, target), [])
     CXXCPPFLAGS += env.get('%s-%s_CXXCPPFLAGS' % (product, target), [])
     CXXCPPFLAGS += [BITNESS] if BITNESS else []
 
     LDFLAGS = []
+    LDFLAGS += DEBUG_LDFLAGS
     LDFLAGS += env.get('_%s-%s_LDFLAGS' % (product, target), [])
     LDFLAGS += env.get('%s-%s_LDFLAGS' % (product, target), [])
 
@@ -65,6 +125,11 @@ def setup_runtime_template(env: dict, opts: RuntimeOpts, product: str, target: s
     set_product_env_var('CMAKE')
     set_product_env_var('STRIP')
 
+    if opts.time_trace:
+        TIME_TRACE_FLAGS = get_time_trace_flags(CONFIGURE_ENVIRONMENT.get('CC', 'cc'), '%s-%s' % (product, target))
+        CFLAGS += TIME_TRACE_FLAGS
+        CXXFLAGS += TIME_TRACE_FLAGS
+
     CONFIGURE_ENVIRONMENT['CFLAGS'] = CFLAGS
     CONFIGURE_ENVIRONMENT['CXXFLAGS'] = CXXFLAGS
     CONFIGURE_ENVIRONMENT['CPPFLAGS'] = CPPFLAGS
@@ -119,6 +184,7 @@ def setup_runtime_cross_template(env: dict, opts: RuntimeOpts, product: str, tar
         offsets_tool_env.update(virtualenv_vars)
 
     build_dir = '%s/%s-%s-%s' % (opts.configure_dir, product, target, opts.configuration)
+    prepare_build_dir(opts, product, target, configure=True)
     mkdir_p(build_dir)
 
     run_command('python3', [
@@ -141,11 +207,15 @@ def run_autogen(opts: RuntimeOpts):
     if not find_executable('glibtoolize') and 'CUSTOM_GLIBTOOLIZE_PATH' in os.environ:
         autogen_env['PATH'] = os.environ['CUSTOM_GLIBTOOLIZE_PATH'] + ':' + autogen_env['PATH']
 
-    run_command(os.path.join(opts.mono_source_root, 'autogen.sh'), cwd=opts.mono_source_root, env=autogen_env, name='autogen')
+    retry_call(
+        lambda: run_command(os.path.join(opts.mono_source_root, 'autogen.sh'), cwd=opts.mono_source_root, env=autogen_env, name='autogen'),
+        retries=opts.retries, delay=opts.retry_delay, name='autogen'
+    )
 
 
 def run_configure(env: dict, opts: RuntimeOpts, product: str, target: str):
     build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    prepare_build_dir(opts, product, target, configure=True)
     mkdir_p(build_dir)
 
     def str_dict_val(val):
@@ -166,4 +236,207 @@ def run_configure(env: dict, opts: RuntimeOpts, product: str, target: str):
     if target_extra_path:
         configure_env['PATH'] += ':' + target_extra_path
 
-    run_command(configure, args=configure_args, cwd=build_dir, env=configure_env, name='configure')
+    checkpoints = get_checkpoints(opts, product, target, opts.configuration)
+    checkpoints.run('configure',
+        lambda: run_command(configure, args=configure_args, cwd=build_dir, env=configure_env, name='configure'),
+        inputs=[configure_args, target_extra_path, file_sha256(configure)],
+        outputs=[path_join(build_dir, 'Makefile')]
+    )
+
+
+def read_makefile_vars(makefile: str) -> dict:
+    '''The simple variable assignments of a generated Makefile. Lines of disabled automake conditionals are comments.'''
+    import re
+
+    if not os.path.isfile(makefile):
+        raise BuildError('Makefile not found: %s. Was the target configured?' % makefile)
+
+    with open(makefile, 'r', errors='replace') as f:
+        content = f.read().replace('\\\n', ' ')
+
+    variables = {}
+    for line in content.splitlines():
+        match = re.match(r'^([A-Za-z_][A-Za-z0-9_]*)\s*:?=\s*(.*)$', line)
+        if match:
+            variables[match.group(1)] = match.group(2).strip()
+    return variables
+
+
+def get_makefile_subdirs(makefile: str) -> list:
+    import re
+
+    variables = read_makefile_vars(makefile)
+
+    def expand(value, depth=0):
+        if depth > 10:
+            return value
+        return re.sub(r'\$[({]([A-Za-z0-9_]+)[)}]', lambda match: expand(variables.get(match.group(1), ''), depth + 1), value)
+
+    return [subdir for subdir in expand(variables.get('SUBDIRS', '')).split() if subdir != '.']
+
+
+def get_subdirs_through(makefile: str, required: str, needed: list) -> list:
+    '''The subdirectories of the Makefile up to the last of 'needed', which must include 'required' '''
+    subdirs = get_makefile_subdirs(makefile)
+    if required not in subdirs:
+        raise BuildError('\'%s\' is not in the SUBDIRS of %s: %s. Cannot work out a minimal build.' % (required, makefile, ' '.join(subdirs)))
+    last = max(subdirs.index(subdir) for subdir in needed if subdir in subdirs)
+    return subdirs[:last + 1]
+
+
+def get_make_plan(opts: RuntimeOpts, product: str, target: str, cross: bool=False):
+    '''
+    Returns the list of (subdir, make_targets) to build and the list of subdirs to install.
+    An empty subdir means the whole build directory.
+    '''
+    if not opts.minimal_build:
+        return [('', [])], runtime_install_subdirs
+
+    build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+
+    if cross:
+        subdirs = get_subdirs_through(path_join(build_dir, 'mono', 'Makefile'), 'mini', ['mini'])
+        return [('mono/' + subdir, []) for subdir in subdirs], minimal_cross_install_subdirs
+
+    subdirs = get_subdirs_through(path_join(build_dir, 'Makefile'), 'mono', runtime_install_subdirs)
+    return [(subdir, []) for subdir in subdirs], [subdir for subdir in runtime_install_subdirs if subdir in subdirs]
+
+
+def run_make(opts: RuntimeOpts, product: str, target: str, cross: bool=False):
+    build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+
+    make_subdirs, install_subdirs = get_make_plan(opts, product, target, cross)
+
+    prepare_build_dir(opts, product, target)
+
+    def make():
+        timing_args = start_make_timing(opts, product, target, build_dir)
+
+        try:
+            for subdir, make_targets in make_subdirs:
+                subdir_path = path_join(build_dir, subdir) if subdir else build_dir
+
+                if subdir and not os.path.isfile(path_join(subdir_path, 'Makefile')):
+                    raise BuildError('Subdirectory in the SUBDIRS of the build but not configured: ' + subdir_path)
+
+                make_args = make_default_args(opts)
+                make_args += timing_args
+                make_args += ['-C', subdir_path] + make_targets
+
+                run_command('make', args=make_args, name='make %s' % subdir if subdir else 'make')
+        finally:
+            if timing_args:
+                report_make_timing(opts, product, target, build_dir)
+
+        if opts.time_trace:
+            report_time_trace(opts, '%s-%s-%s' % (product, target, opts.configuration), build_dir)
+
+    checkpoints = get_checkpoints(opts, product, target, opts.configuration)
+    checkpoints.run('make', make, inputs=[make_subdirs, get_source_fingerprint(opts.mono_source_root)])
+
+
+def run_make_install(opts: RuntimeOpts, product: str, target: str, cross: bool=False):
+    build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    install_dir = path_join(opts.install_dir, '%s-%s-%s' % (product, target, opts.configuration))
+
+    make_subdirs, install_subdirs = get_make_plan(opts, product, target, cross)
+
+    def make_install(subdir):
+        return lambda: run_command('make', args=['-C', '%s/%s' % (build_dir, subdir), 'install'], name='make install %s' % subdir)
+
+    run_install_phases(opts, product, target, [('install-%s' % subdir, make_install(subdir), [install_dir]) for subdir in install_subdirs])
+
+    report_build_sizes(opts, product, target)
+
+    release_build_dir(opts, product, target)
+
+
+def run_install_phases(opts: RuntimeOpts, product: str, target: str, phases):
+    '''
+    Runs the install phases concurrently. 'phases' is a list of '(phase, fn, outputs)' tuples. The phases
+    must not write the same files (e.g.: 'make install' of different subdirectories). Reports the wall time.
+    '''
+    import time
+
+    checkpoints = get_checkpoints(opts, product, target, opts.configuration)
+
+    start = time.time()
+    run_parallel(lambda phase: checkpoints.run(phase[0], phase[1], outputs=phase[2]), phases, int(opts.jobs))
+    print('Install phase of %s-%s-%s completed in %.1fs' % (product, target, opts.configuration, time.time() - start))
+
+
+def report_build_sizes(opts: RuntimeOpts, product: str, target: str):
+    '''Prints the total size of the object files in the build directory and of each installed library'''
+    build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    install_dir = path_join(opts.install_dir, '%s-%s-%s' % (product, target, opts.configuration))
+
+    totals = { '.o': [0, 0], '.dwo': [0, 0] }
+
+    for dirpath, dirnames, filenames in os.walk(build_dir):
+        for filename in filenames:
+            ext = os.path.splitext(filename)[1]
+            if ext in totals and not os.path.islink(path_join(dirpath, filename)):
+                totals[ext][0] += 1
+                totals[ext][1] += os.path.getsize(path_join(dirpath, filename))
+
+    print('Build size of %s-%s-%s: %s object files (%s bytes), %s split DWARF files (%s bytes)' % (
+        product, target, opts.configuration, totals['.o'][0], totals['.o'][1], totals['.dwo'][0], totals['.dwo'][1]))
+
+    for lib_file in get_installed_lib_files(install_dir):
+        print('    %s: %s bytes' % (os.path.relpath(lib_file, install_dir), os.path.getsize(lib_file)))
+        record_artifact(product, target, opts.configuration, os.path.relpath(lib_file, install_dir), os.path.getsize(lib_file))
+
+
+def get_installed_lib_files(install_dir: str) -> list:
+    '''The native libraries of an install directory, without symlinks'''
+    lib_files = globs(('*.a', '*.so', '*.dylib'), dirpath=path_join(install_dir, 'lib')) + globs(('*.dll',), dirpath=path_join(install_dir, 'bin'))
+    return sorted(lib_file for lib_file in lib_files if not os.path.islink(lib_file))
+
+
+def get_strip_index_file(opts: RuntimeOpts, product: str, target: str) -> str:
+    return path_join(opts.configure_dir, '%s-%s-%s.strip-index.json' % (product, target, opts.configuration))
+
+
+def strip_files(opts: RuntimeOpts, product: str, target: str, strip: str, files, strip_args=['--strip-unneeded']):
+    '''
+    Strips the files in parallel, one strip process per file. Files whose content hash matches the
+    recorded hash of their stripped output are skipped. Reports the size saved for each file.
+    '''
+    import json
+    import shlex
+
+    index_file = get_strip_index_file(opts, product, target)
+    index = {}
+    if os.path.isfile(index_file):
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+
+    strip_cmd = shlex.split(strip)
+
+    def strip_file(file):
+        record = index.get(file)
+        if record is not None and record['args'] == strip_args and record['sha256'] == file_sha256(file):
+            return file, None
+
+        size_before = os.path.getsize(file)
+        break_hardlink(file)
+        run_command(strip_cmd[0], args=strip_cmd[1:] + strip_args + [file], name='strip %s' % os.path.basename(file))
+        size_after = os.path.getsize(file)
+
+        return file, { 'args': strip_args, 'sha256': file_sha256(file), 'size_before': size_before, 'size_after': size_after }
+
+    total_saved = 0
+    skipped = 0
+
+    for file, record in run_parallel(strip_file, files, int(opts.jobs)):
+        if record is None:
+            skipped += 1
+            continue
+        index[file] = record
+        saved = record['size_before'] - record['size_after']
+        total_saved += saved
+        print('Stripped %s: %s -> %s bytes (saved %s bytes)' % (file, record['size_before'], record['size_after'], saved))
+
+    print('Strip: %s files stripped, %s already stripped, %s bytes saved' % (len(files) - skipped, skipped, total_saved))
+
+    write_file_if_changed(index_file, json.dumps(index, indent=4, sort_keys=True))
@@ -0,0 +1,257 @@
+import json
+import os
+import os.path
+import re
+
+from os.path import join as path_join
+
+from build_trace import span
+from debug_symbols import run_tool_output, tool_from_strip
+from options import RuntimeOpts
+from os_utils import *
+from runtime import get_installed_lib_files
+
+
+# The 'size-report' action attributes the size of the installed libraries of a target (.so, .a, .dylib, .dll)
+# to sections ('size -A'), object files and symbols ('nm -S'), using the binutils or LLVM tools with the prefix
+# of the target's 'strip'. Archives are attributed to their members. Shared libraries are attributed through
+# the symbols defined by the object files of the build directory, so that part requires the build directory;
+# symbols defined by several object files (e.g.: static functions with the same name) are not attributed.
+# Section sizes are the sizes of the sections, which includes '.bss' and the debug sections if not stripped.
+# The options used ('size -A', 'nm -S') are the GNU and LLVM ones. cctools (Xcode, osxcross) doesn't support them,
+# so Mach-O targets use 'llvm-size' and 'llvm-nm' from PATH instead.
+#
+# The report is written to '<configure_dir>/size-reports/<product>-<target>-<configuration>.json' and compared
+# with the previous different report of the target (kept as '<...>.previous.json'), or with '--size-baseline'.
+
+SIZE_ROW_RE = re.compile(r'^(\S+)\s+(\d+)\s+\d+\s*$')
+NM_ROW_RE = re.compile(r'^[0-9a-fA-F]+\s+([0-9a-fA-F]+)\s+(\S)\s+(.+)$')
+
+object_files_per_command = 500
+
+
+def get_size_report_file(opts: RuntimeOpts, product: str, target: str) -> str:
+    return path_join(opts.configure_dir, 'size-reports', '%s-%s-%s.json' % (product, target, opts.configuration))
+
+
+def check_tool(tool: str, name: str, object_format: str):
+    import shlex
+
+    command = shlex.split(tool)
+    program = command[0] if os.path.isabs(command[0]) else find_executable(command[0])
+    # The tool may be wrapped (e.g.: the osxcross wrapper followed by '<triple>-nm')
+    if not program or any(not os.path.exists(token) for token in command if os.path.isabs(token)):
+        raise BuildError('Cannot find \'%s\', needed for the size report' % tool)
+
+    version = run_tool_output(tool, ['--version'])
+    if 'GNU' not in version and 'LLVM' not in version:
+        hint = ' Install LLVM (\'llvm-nm\' and \'llvm-size\') for Mach-O targets.' if object_format == 'macho' else ''
+        raise BuildError('\'%s\' is not the GNU or LLVM %s. The size report needs their options (\'%s\').%s' % (
+            tool, name, 'size -A' if name == 'size' else 'nm -S', hint))
+
+
+def get_size_tools(strip: str, object_format: str) -> tuple:
+    size_tool = tool_from_strip(strip, 'size')
+    nm = tool_from_strip(strip, 'nm')
+
+    if object_format == 'macho':
+        size_tool = find_executable('llvm-size') or size_tool
+        nm = find_executable('llvm-nm') or nm
+
+    check_tool(size_tool, 'size', object_format)
+    check_tool(nm, 'nm', object_format)
+
+    return size_tool, nm
+
+
+def get_member_name(header: str) -> str:
+    # GNU size: 'member.o   (ex libfoo.a):', nm: 'member.o:' or 'libfoo.a(member.o):'
+    name = header[:-1].split()[0] if header.strip() else ''
+    match = re.match(r'^.*\((.+)\)$', name)
+    return match.group(1) if match else name
+
+
+def add_size(sizes: dict, key: str, size: int):
+    sizes[key] = sizes.get(key, 0) + size
+
+
+def read_sections(size_tool: str, file: str) -> tuple:
+    '''Returns the size of each section, and of each archive member'''
+    sections, members = {}, {}
+    member = ''
+    for line in run_tool_output(size_tool, ['-A', file]).splitlines():
+        if line.rstrip().endswith(':'):
+            member = get_member_name(line.strip()) if file.endswith('.a') else ''
+            continue
+        match = SIZE_ROW_RE.match(line)
+        if match and match.group(1) != 'Total':
+            add_size(sections, match.group(1), int(match.group(2)))
+            if member:
+                add_size(members, member, int(match.group(2)))
+    return sections, members
+
+
+def read_symbols(nm: str, files: list, extra_args: list=[]) -> list:
+    '''Returns (file or archive member, symbol, size) for each defined symbol with a size'''
+    symbols = []
+    current = files[0] if len(files) == 1 else ''
+    for line in run_tool_output(nm, ['-S', '-C', '--defined-only'] + extra_args + files).splitlines():
+        match = NM_ROW_RE.match(line)
+        if match:
+            symbols += [(current, match.group(3), int(match.group(1), 16))]
+        elif line.rstrip().endswith(':'):
+            current = line.strip()[:-1] if line.strip()[:-1] in files else get_member_name(line.strip())
+    return symbols
+
+
+def get_object_symbols(nm: str, build_dir: str, jobs: int) -> dict:
+    '''Maps each symbol defined by the object files of the build directory to its object file, or to None if ambiguous'''
+    object_files = []
+    for dirpath, dirnames, filenames in os.walk(build_dir):
+        object_files += [path_join(dirpath, filename) for filename in filenames if filename.endswith(('.o', '.obj'))]
+
+    def object_name(file):
+        # libtool builds the PIC objects in '.libs'
+        return os.path.relpath(file, build_dir).replace('/.libs/', '/')
+
+    chunks = [object_files[i:i + object_files_per_command] for i in range(0, len(object_files), object_files_per_command)]
+
+    objects = {}
+    for symbols in run_parallel(lambda chunk: read_symbols(nm, chunk), chunks, jobs):
+        for file, symbol, size in symbols:
+            name = object_name(file)
+            objects[symbol] = name if objects.get(symbol, name) == name else None
+    return objects
+
+
+def analyze_file(size_tool: str, nm: str, file: str, object_symbols: dict) -> dict:
+    sections, members = read_sections(size_tool, file)
+    symbol_list = read_symbols(nm, [file])
+    if not symbol_list and not file.endswith('.a'):
+        # Stripped shared library
+        symbol_list = read_symbols(nm, [file], extra_args=['-D'])
+
+    if not sections and not symbol_list:
+        print('WARNING: Could not read the sections or symbols of %s with \'%s\' and \'%s\'' % (file, size_tool, nm))
+
+    symbols = {}
+    for member, symbol, size in symbol_list:
+        add_size(symbols, symbol, size)
+
+    if file.endswith('.a'):
+        objects = members
+    elif object_symbols:
+        objects = {}
+        for symbol, size in symbols.items():
+            add_size(objects, object_symbols.get(symbol) or '(not attributed)', size)
+        attributed = sum(size for name, size in objects.items() if name != '(not attributed)')
+        objects['(not attributed)'] = os.path.getsize(file) - attributed
+    else:
+        objects = {}
+
+    return { 'size': os.path.getsize(file), 'sections': sections, 'objects': objects, 'symbols': symbols }
+
+
+def diff_sizes(current: dict, previous: dict) -> list:
+    '''Returns (name, size, delta) for every entry that changed, the largest changes first'''
+    changes = [(name, current.get(name, 0), current.get(name, 0) - previous.get(name, 0)) for name in set(current) | set(previous)]
+    return sorted([change for change in changes if change[2] != 0], key=lambda change: -abs(change[2]))
+
+
+def format_delta(delta: int) -> str:
+    return '%+d' % delta if delta else ''
+
+
+def print_size_report(report: dict, baseline: dict, top: int):
+    baseline_files = baseline.get('files', {}) if baseline else {}
+    categories = [('Sections', 'sections'), ('Object files', 'objects'), ('Symbols', 'symbols')]
+
+    for name, entry in sorted(report['files'].items()):
+        previous = baseline_files.get(name, None)
+        if previous is None:
+            print('  %s: %s bytes%s' % (name, entry['size'], ' (new)' if baseline else ''))
+        else:
+            print('  %s: %s bytes (%s)' % (name, entry['size'], format_delta(entry['size'] - previous['size']) or 'unchanged'))
+
+        for title, key in categories:
+            if not entry[key]:
+                continue
+            print('    Largest %s:' % title.lower())
+            for item, size in sorted(entry[key].items(), key=lambda item: -item[1])[:top]:
+                delta = size - previous[key].get(item, 0) if previous is not None else 0
+                print('      %10s  %9s  %s' % (size, format_delta(delta), item))
+
+        if previous is not None:
+            for title, key in categories:
+                changes = diff_sizes(entry[key], previous[key])
+                if not changes:
+                    continue
+                print('    %s with the largest changes:' % title)
+                for item, size, delta in changes[:top]:
+                    print('      %10s  %9s  %s%s' % (size, format_delta(delta), item, ' (removed)' if item not in entry[key] else ''))
+
+    for name in sorted(set(baseline_files) - set(report['files'])):
+        print('  %s: removed (was %s bytes)' % (name, baseline_files[name]['size']))
+
+
+def report_library_sizes(opts: RuntimeOpts, product: str, target: str, strip: str, object_format: str, top: int=10):
+    '''
+    Prints and writes the size report of the installed libraries of the target. 'strip' is the target's strip,
+    from which the other tools are derived. 'object_format' is one of 'elf', 'pe', 'macho' or 'wasm'.
+    '''
+    name = '%s-%s-%s' % (product, target, opts.configuration)
+    install_dir = path_join(opts.install_dir, name)
+    build_dir = path_join(opts.configure_dir, name)
+
+    lib_files = get_installed_lib_files(install_dir)
+    if not lib_files:
+        raise BuildError('No libraries installed for %s. Run \'make\' first.' % name)
+
+    size_tool, nm = get_size_tools(strip, object_format)
+
+    object_symbols = {}
+    if any(not lib_file.endswith('.a') for lib_file in lib_files):
+        if os.path.isdir(build_dir):
+            with span('read object symbols', build_dir=build_dir):
+                object_symbols = get_object_symbols(nm, build_dir, int(opts.jobs))
+        else:
+            print('Build directory not found: %s. Shared libraries will not be attributed to object files.' % build_dir)
+
+    def analyze(lib_file):
+        with span('size report %s' % os.path.basename(lib_file), file=lib_file):
+            return os.path.relpath(lib_file, install_dir), analyze_file(size_tool, nm, lib_file, object_symbols)
+
+    report = {
+        'product': product,
+        'target': target,
+        'configuration': opts.configuration,
+        'files': dict(run_parallel(analyze, lib_files, int(opts.jobs)))
+    }
+
+    report_file = get_size_report_file(opts, product, target)
+    previous_file = report_file[:-len('.json')] + '.previous.json'
+
+    def load(path):
+        if not path or not os.path.isfile(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    # Keep the last report that differs from this one, so running the action twice still shows the changes of the last build
+    last_report = load(report_file)
+    if last_report is not None and last_report['files'] != report['files']:
+        mkdir_p(os.path.dirname(previous_file))
+        os.replace(report_file, previous_file)
+
+    if opts.size_baseline and not os.path.isfile(opts.size_baseline):
+        raise BuildError('Size baseline not found: ' + opts.size_baseline)
+
+    baseline_file = opts.size_baseline or previous_file
+    baseline = load(baseline_file)
+
+    print('Size report of %s%s:' % (name, ' (compared with %s)' % baseline_file if baseline is not None else ''))
+    print_size_report(report, baseline, top)
+
+    mkdir_p(os.path.dirname(report_file))
+    write_file_if_changed(report_file, json.dumps(report, indent=4, sort_keys=True))
+    print('Size report written to: ' + report_file)
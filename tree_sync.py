@@ -0,0 +1,162 @@
+import os
+import os.path
+import shutil
+import sys
+
+from os.path import join as path_join
+
+from os_utils import *
+
+
+link_modes = ['copy', 'hardlink', 'reflink']
+
+FICLONE = 0x40049409 # From linux/fs.h
+
+
+def files_are_equal(src: str, dst: str, src_stat, dst_stat) -> bool:
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return True
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    # Same size, different mtime. Only the content can tell.
+    return file_sha256(src) == file_sha256(dst)
+
+
+def reflink_file(src: str, dst: str) -> bool:
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def place_file(src: str, dst: str, link_mode: str) -> str:
+    '''
+    Creates 'dst' with the content of 'src' and returns how it was done ('hardlink', 'reflink' or 'copy').
+    The file is created under a temporary name and then renamed, so an existing 'dst' is replaced
+    rather than modified in place (it may be a hardlink shared with another tree).
+    '''
+    tmp_dst = '%s.sync-tmp-%s' % (dst, os.getpid())
+    if os.path.lexists(tmp_dst):
+        os.remove(tmp_dst)
+
+    method = 'copy'
+
+    if link_mode == 'hardlink':
+        try:
+            os.link(src, tmp_dst)
+            method = 'hardlink'
+        except OSError:
+            # Different filesystem, or not supported
+            pass
+    elif link_mode == 'reflink':
+        if reflink_file(src, tmp_dst):
+            method = 'reflink'
+
+    if method == 'copy':
+        shutil.copy2(src, tmp_dst)
+
+    os.replace(tmp_dst, dst)
+    return method
+
+
+def is_excluded(name: str, exclude) -> bool:
+    from fnmatch import fnmatch
+    return any(fnmatch(name, pattern) for pattern in exclude)
+
+
+def sync_tree(src_dir: str, dst_dir: str, link_mode: str='copy', jobs: int=1, delete: bool=False, exclude=[]) -> dict:
+    '''
+    Incrementally synchronizes 'dst_dir' with the files in 'src_dir'. Only files whose size, mtime
+    or content differ are copied (or hardlinked/reflinked, depending on 'link_mode'), in parallel.
+    Files and directories whose name matches one of the 'exclude' patterns are skipped.
+    If 'delete' is True, files in 'dst_dir' that don't exist in 'src_dir', or are excluded, are removed.
+    Returns a dictionary with statistics about the sync.
+    '''
+
+    if not os.path.isdir(src_dir):
+        raise BuildError('Cannot sync from non-existent directory: ' + src_dir)
+
+    assert link_mode in link_modes
+
+    stats = { 'unchanged': 0, 'copy': 0, 'hardlink': 0, 'reflink': 0, 'removed': 0, 'bytes': 0, 'skipped': 0, 'skipped_bytes': 0 }
+
+    src_files = set()
+    src_dirs = set(['.'])
+    to_update = []
+
+    def count_skipped(path):
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                for filename in filenames:
+                    count_skipped(path_join(dirpath, filename))
+        else:
+            stats['skipped'] += 1
+            stats['skipped_bytes'] += os.path.getsize(path)
+
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        rel_dir = os.path.relpath(dirpath, src_dir)
+
+        for dirname in [d for d in dirnames if is_excluded(d, exclude)]:
+            count_skipped(path_join(dirpath, dirname))
+        dirnames[:] = sorted(d for d in dirnames if not is_excluded(d, exclude))
+        src_dirs.update(os.path.normpath(path_join(rel_dir, d)) for d in dirnames)
+
+        mkdir_p(os.path.normpath(path_join(dst_dir, rel_dir)))
+
+        for filename in filenames:
+            src = path_join(dirpath, filename)
+
+            if is_excluded(filename, exclude):
+                count_skipped(src)
+                continue
+
+            rel_path = os.path.normpath(path_join(rel_dir, filename))
+            src_files.add(rel_path)
+
+            dst = path_join(dst_dir, rel_path)
+
+            src_stat = os.stat(src)
+
+            if os.path.isfile(dst) and not os.path.islink(dst) and files_are_equal(src, dst, src_stat, os.stat(dst)):
+                stats['unchanged'] += 1
+                continue
+
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                rm_rf(dst)
+
+            to_update += [(src, dst, src_stat.st_size)]
+
+    def update(item):
+        src, dst, size = item
+        return place_file(src, dst, link_mode), size
+
+    for method, size in run_parallel(update, to_update, jobs):
+        stats[method] += 1
+        stats['bytes'] += size if method == 'copy' else 0
+
+    if delete:
+        for dirpath, dirnames, filenames in os.walk(dst_dir, topdown=False):
+            rel_dir = os.path.normpath(os.path.relpath(dirpath, dst_dir))
+            for filename in filenames:
+                rel_path = os.path.normpath(path_join(rel_dir, filename))
+                if not rel_path in src_files:
+                    os.remove(path_join(dirpath, filename))
+                    stats['removed'] += 1
+            if dirpath != dst_dir and not os.listdir(dirpath) and not rel_dir in src_dirs:
+                os.rmdir(dirpath)
+
+    print('Synced \'%s\' to \'%s\': %s unchanged, %s copied (%s bytes), %s hardlinked, %s reflinked, %s removed, %s skipped (%s bytes)' % (
+        src_dir, dst_dir, stats['unchanged'], stats['copy'], stats['bytes'], stats['hardlink'], stats['reflink'], stats['removed'],
+        stats['skipped'], stats['skipped_bytes']))
+
+    return stats
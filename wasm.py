@@ -5,6 +5,9 @@ import os.path
 import runtime
 import sys
 
+from checkpoint import clean_checkpoints, get_checkpoints, get_source_fingerprint
+from make_timing import report_make_timing, start_make_timing
+from memory_build import prepare_build_dir, release_build_dir, remove_build_dir
 from options import *
 from os_utils import *
 from os.path import join as path_join
@@ -79,6 +82,7 @@ def setup_wasm_target_template(env: dict, opts: RuntimeOpts, target: str):
 
 def wasm_run_configure(env: dict, opts: RuntimeOpts, product: str, target: str, emsdk_root: str):
     build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+    prepare_build_dir(opts, product, target, configure=True)
     mkdir_p(build_dir)
 
     def str_dict_val(val):
@@ -100,7 +104,12 @@ def wasm_run_configure(env: dict, opts: RuntimeOpts, product: str, target: str,
 
     configure_env['PATH'] = emsdk_root + ':' + configure_env['PATH']
 
-    run_command('emconfigure', args=[configure] + configure_args, cwd=build_dir, env=configure_env, name='configure')
+    checkpoints = get_checkpoints(opts, product, target, opts.configuration)
+    checkpoints.run('configure',
+        lambda: run_command('emconfigure', args=[configure] + configure_args, cwd=build_dir, env=configure_env, name='configure'),
+        inputs=[configure_args, target_extra_path, emsdk_root, file_sha256(configure)],
+        outputs=[path_join(build_dir, 'Makefile')]
+    )
 
 
 def configure(opts: RuntimeOpts, product: str, target: str):
@@ -134,14 +143,34 @@ def make(opts: RuntimeOpts, product: str, target: str):
     make_env = os.environ.copy()
     make_env['PATH'] = emsdk_root + ':' + make_env['PATH']
 
-    run_command('emmake', args=['make'] + make_args, env=make_env, name='make')
+    prepare_build_dir(opts, product, target)
 
-    run_command('make', args=['-C', '%s/mono' % build_dir, 'install'], name='make install mono')
-    run_command('make', args=['-C', '%s/data' % build_dir, 'install'], name='make install data')
+    checkpoints = get_checkpoints(opts, product, target, opts.configuration)
 
-    # Copy support headers
+    def run_make():
+        timing_args = start_make_timing(opts, product, target, build_dir)
+        try:
+            run_command('emmake', args=['make'] + make_args + timing_args, env=make_env, name='make')
+        finally:
+            if timing_args:
+                report_make_timing(opts, product, target, build_dir)
+
+    checkpoints.run('make', run_make, inputs=[emsdk_root, get_source_fingerprint(opts.mono_source_root)])
+
+    def make_install(subdir):
+        return lambda: run_command('make', args=['-C', '%s/%s' % (build_dir, subdir), 'install'], name='make install %s' % subdir)
 
-    from shutil import copy
+    runtime.run_install_phases(opts, product, target, [
+        ('install-mono', make_install('mono'), [install_dir]),
+        ('install-data', make_install('data'), [install_dir]),
+        ('install-src', lambda: copy_wasm_src_files(opts, install_dir), [path_join(install_dir, 'src')])
+    ])
+
+    release_build_dir(opts, product, target)
+
+
+def copy_wasm_src_files(opts: RuntimeOpts, install_dir: str):
+    # Copy support headers
 
     headers = ['crc32.h', 'deflate.h', 'inffast.h', 'inffixed.h', 'inflate.h', 'inftrees.h', 'trees.h', 'zconf.h', 'zlib.h', 'zutil.h']
     dst_zlib_dir = '%s/include/support' % install_dir
@@ -159,8 +188,7 @@ def make(opts: RuntimeOpts, product: str, target: str):
 
     mkdir_p(dst_zlib_dir)
 
-    for header in headers:
-        copy(path_join(src_zlib_dir, header), dst_zlib_dir)
+    to_copy = [(path_join(src_zlib_dir, header), dst_zlib_dir) for header in headers]
 
     # Copy wasm src files
 
@@ -191,15 +219,26 @@ def make(opts: RuntimeOpts, product: str, target: str):
         src_dir = next(dir_with_file(src_dir_hints, wasm_src_file), '')
         if not src_dir:
             raise BuildError('File \'%s\' not found. Probed locations: %s' % (wasm_src_file, str(src_dir_hints)))
-        copy(path_join(src_dir, wasm_src_file), dst_wasm_src_dir)
+        to_copy += [(path_join(src_dir, wasm_src_file), dst_wasm_src_dir)]
 
     # Older versions didn't have .NET Core support
     src_dir = next(dir_with_file(src_dir_hints, 'pinvoke-tables-default-netcore.h'), '')
     if src_dir:
-        copy(path_join(src_dir, 'pinvoke-tables-default-netcore.h'), dst_wasm_src_dir)
+        to_copy += [(path_join(src_dir, 'pinvoke-tables-default-netcore.h'), dst_wasm_src_dir)]
+
+    run_parallel(lambda item: copy_replacing(*item), to_copy, int(opts.jobs))
+
+
+def size_report(opts: RuntimeOpts, product: str, target: str):
+    from size_report import report_library_sizes
+
+    # 'emnm' and 'emsize' wrap the LLVM tools of the emsdk, which understand wasm objects. Older emsdks don't have 'emsize'.
+    report_library_sizes(opts, product, target, path_join(get_emsdk_root(), 'emstrip'), 'wasm')
 
 
 def clean(opts: RuntimeOpts, product: str, target: str):
+    clean_checkpoints(opts, product, target, opts.configuration)
+    remove_build_dir(opts, product, target)
     rm_rf(
         path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration)),
         path_join(opts.configure_dir, '%s-%s-%s.config.cache' % (product, target, opts.configuration)),
@@ -208,6 +247,7 @@ def clean(opts: RuntimeOpts, product: str, target: str):
 
 
 def main(raw_args):
+    import build_trace
     import cmd_utils
     from collections import OrderedDict
     from typing import Callable
@@ -220,6 +260,7 @@ def main(raw_args):
     actions['configure'] = configure
     actions['make'] = make
     actions['clean'] = clean
+    actions['size-report'] = size_report
 
     parser = cmd_utils.build_arg_parser(description='Builds the Mono runtime for WebAssembly')
 
@@ -227,7 +268,7 @@ def main(raw_args):
 
     default_help = 'default: %(default)s'
 
-    parser.add_argument('action', choices=['configure', 'make', 'clean'])
+    parser.add_argument('action', choices=['configure', 'make', 'clean', 'size-report'])
     parser.add_argument('--target', choices=target_values, action='append', required=True)
 
     cmd_utils.add_runtime_arguments(parser, default_help)
@@ -239,6 +280,8 @@ def main(raw_args):
 
     opts = runtime_opts_from_args(args)
 
+    cmd_utils.init_build_session(opts)
+
     if not os.path.isdir(opts.mono_source_root):
         print('Mono sources directory not found: ' + opts.mono_source_root)
         sys.exit(1)
@@ -248,11 +291,14 @@ def main(raw_args):
 
     try:
         for target in targets:
-            action(opts, 'wasm', target)
+            with build_trace.target_span(input_action, product='wasm', target=target, configuration=opts.configuration):
+                action(opts, 'wasm', target)
     except BuildError as e:
         sys.exit(e.message)
 
 
 if __name__ == '__main__':
     from sys import argv
-    main(argv[1:])
+    from metrics_db import recording_exit_status
+    with recording_exit_status():
+        main(argv[1:])
@@ -0,0 +1,237 @@
+import os
+import os.path
+import sys
+import time
+
+from os.path import join as path_join
+
+from options import RuntimeOpts
+from os_utils import *
+
+
+# Mono source subdirectories that are rebuilt by the 'watch' action, in build order.
+# The directories are relative to both the Mono source root and the target's build directory.
+watch_subdirs = [
+    'mono/eglib',
+    'mono/arch',
+    'mono/utils',
+    'mono/cil',
+    'mono/sgen',
+    'mono/metadata',
+    'mono/btls',
+    'mono/mini',
+    'mono/profiler',
+    'support'
+]
+
+# These subdirectories only produce static convenience libraries that are linked into the
+# runtime in 'mono/mini', so changing any of them requires relinking 'mono/mini' too.
+relinked_by_mini = ['mono/eglib', 'mono/arch', 'mono/utils', 'mono/cil', 'mono/sgen', 'mono/metadata']
+
+ignored_dir_names = ['.git', '.deps', '.libs', 'autom4te.cache']
+ignored_file_suffixes = ('~', '.swp', '.swx', '.tmp', '.o', '.lo', '.la', '.a')
+
+
+def is_ignored_file(filename: str) -> bool:
+    return filename.startswith('.#') or filename.startswith('#') or filename.endswith(ignored_file_suffixes)
+
+
+def subdir_for_path(mono_source_root: str, path: str) -> str:
+    rel_path = os.path.relpath(path, mono_source_root).replace(os.sep, '/')
+    # Longest match first, so 'mono/mini' is never shadowed by a shorter prefix
+    for subdir in sorted(watch_subdirs, key=len, reverse=True):
+        if rel_path == subdir or rel_path.startswith(subdir + '/'):
+            return subdir
+    return ''
+
+
+def get_affected_subdirs(changed_subdirs) -> list:
+    affected = set(changed_subdirs)
+    if any(subdir in relinked_by_mini for subdir in affected):
+        affected.add('mono/mini')
+    return [subdir for subdir in watch_subdirs if subdir in affected]
+
+
+class PollingWatcher:
+    '''Fallback watcher that compares file modification times on every poll'''
+
+    def __init__(self, dirs, interval: float):
+        self.dirs = dirs
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self) -> dict:
+        snapshot = {}
+        for top_dir in self.dirs:
+            for dirpath, dirnames, filenames in os.walk(top_dir):
+                dirnames[:] = [d for d in dirnames if d not in ignored_dir_names]
+                for filename in filenames:
+                    if is_ignored_file(filename):
+                        continue
+                    path = path_join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def wait_for_changes(self, timeout: float) -> set:
+        time.sleep(min(timeout, self.interval))
+        new_snapshot = self.take_snapshot()
+        changed = set(p for p, st in new_snapshot.items() if self.snapshot.get(p) != st)
+        changed.update(p for p in self.snapshot if p not in new_snapshot)
+        self.snapshot = new_snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    '''Recursive directory watcher using the Linux inotify API through ctypes'''
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, dirs):
+        import ctypes
+        import ctypes.util
+
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.wd_paths = {}
+        for top_dir in dirs:
+            self.add_watch_recursive(top_dir)
+
+    def add_watch_recursive(self, top_dir: str):
+        for dirpath, dirnames, filenames in os.walk(top_dir):
+            dirnames[:] = [d for d in dirnames if d not in ignored_dir_names]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.WATCH_MASK)
+            if wd >= 0:
+                self.wd_paths[wd] = dirpath
+
+    def read_events(self) -> set:
+        import struct
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        header_size = struct.calcsize('iIII')
+        while offset + header_size <= len(data):
+            wd, mask, cookie, name_len = struct.unpack_from('iIII', data, offset)
+            name = data[offset + header_size:offset + header_size + name_len].rstrip(b'\0').decode(errors='replace')
+            offset += header_size + name_len
+
+            dirpath = self.wd_paths.get(wd)
+            if dirpath is None or not name:
+                continue
+            path = path_join(dirpath, name)
+
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and name not in ignored_dir_names:
+                    self.add_watch_recursive(path)
+                continue
+
+            if not is_ignored_file(name):
+                changed.add(path)
+        return changed
+
+    def wait_for_changes(self, timeout: float) -> set:
+        import select
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        return self.read_events()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(dirs, poll_interval: float, force_polling: bool):
+    if not force_polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(dirs)
+        except (OSError, AttributeError) as e:
+            print('WARNING: Cannot use inotify (%s); falling back to polling' % e)
+    return PollingWatcher(dirs, poll_interval)
+
+
+def wait_for_change_burst(watcher, debounce: float) -> set:
+    changed = set()
+    while not changed:
+        changed = watcher.wait_for_changes(timeout=3600)
+    # Keep collecting until the tree has been quiet for the debounce interval
+    while True:
+        more = watcher.wait_for_changes(timeout=debounce)
+        if not more:
+            return changed
+        changed.update(more)
+
+
+def rebuild_subdirs(opts: RuntimeOpts, product: str, target: str, subdirs):
+    build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+
+    # Not every subdirectory is enabled for every target (e.g.: btls, support)
+    subdirs = [s for s in subdirs if os.path.isfile(path_join(build_dir, s, 'Makefile'))]
+
+    for subdir in subdirs:
+        make_args = make_default_args(opts)
+        make_args += ['-C', path_join(build_dir, subdir)]
+        run_command('make', args=make_args, name='make %s' % subdir)
+
+    for subdir in subdirs:
+        run_command('make', args=['-C', path_join(build_dir, subdir), 'install'], name='make install %s' % subdir)
+
+
+def watch_targets(opts: RuntimeOpts, product: str, targets, debounce: float=1.0, poll_interval: float=1.0, force_polling: bool=False):
+    for target in targets:
+        build_dir = path_join(opts.configure_dir, '%s-%s-%s' % (product, target, opts.configuration))
+        if not os.path.isfile(path_join(build_dir, 'Makefile')):
+            raise BuildError('Build directory is not configured: %s. Run the \'configure\' and \'make\' actions first.' % build_dir)
+
+    source_dirs = [path_join(opts.mono_source_root, subdir) for subdir in watch_subdirs]
+    source_dirs = [d for d in source_dirs if os.path.isdir(d)]
+
+    watcher = create_watcher(source_dirs, poll_interval, force_polling)
+
+    print('Watching %s for changes (targets: %s). Press Ctrl+C to stop.' % (opts.mono_source_root, ', '.join(targets)))
+
+    try:
+        while True:
+            changed_files = wait_for_change_burst(watcher, debounce)
+            changed_subdirs = set(filter(None, (subdir_for_path(opts.mono_source_root, f) for f in changed_files)))
+            subdirs = get_affected_subdirs(changed_subdirs)
+
+            if not subdirs:
+                continue
+
+            print('Detected changes in: %s' % ', '.join(sorted(changed_subdirs)))
+
+            for target in targets:
+                try:
+                    rebuild_subdirs(opts, product, target, subdirs)
+                except BuildError as e:
+                    # Keep watching; the next edit will likely fix the error
+                    print('ERROR: Rebuild of target \'%s\' failed: %s' % (target, e.message))
+    except KeyboardInterrupt:
+        print('Stopped watching')
+    finally:
+        watcher.close()